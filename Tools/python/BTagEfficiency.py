@@ -2,8 +2,12 @@
 '''
 
 # Standard imports
-import ROOT, pickle, itertools, os
+import pickle, os, csv, re
 from operator import mul
+import numpy as np
+
+# Analysis
+import Analysis.Tools.SFCache as SFCache
 
 # Logging
 import logging
@@ -18,10 +22,187 @@ etaBins2016 = [[0,2.4]]
 etaBins2017 = [[0,2.5]]
 etaBins2018 = [[0,2.5]]
 
+# BTagEntry enum values (CondFormats/BTauObjects), defined here such that the module does not need ROOT
+OP_LOOSE, OP_MEDIUM, OP_TIGHT, OP_RESHAPING = 0, 1, 2, 3
+FLAV_B, FLAV_C, FLAV_UDSG = 0, 1, 2
+
 def toFlavourKey(pdgId):
-    if abs(pdgId)==5: return ROOT.BTagEntry.FLAV_B
-    if abs(pdgId)==4: return ROOT.BTagEntry.FLAV_C
-    return ROOT.BTagEntry.FLAV_UDSG
+    if abs(pdgId)==5: return FLAV_B
+    if abs(pdgId)==4: return FLAV_C
+    return FLAV_UDSG
+
+def toFlavourKey_array(pdgId):
+    ''' Array version of toFlavourKey
+    '''
+    absPdgId = np.abs( pdgId )
+    return np.where( absPdgId==5, FLAV_B, np.where( absPdgId==4, FLAV_C, FLAV_UDSG ) )
+
+def formulaToNumpy( formula ):
+    ''' Translate a TFormula string of the b-tag calibration csv files (x, +-*/, log, exp, sqrt, pow, comparisons and ?: ) into a python expression in numpy
+    '''
+    formula = re.sub( r'(TMath::)?\b(log|exp|sqrt|pow)\b', lambda m: 'np.%s'%( 'power' if m.group(2).lower()=='pow' else m.group(2).lower() ), formula, flags=re.IGNORECASE )
+    return translateTernary( formula )
+
+def translateTernary( formula ):
+    ''' Recursively replace 'cond ? a : b' by 'np.where(cond, a, b)'
+    '''
+    formula = formula.strip()
+
+    # strip enclosing parentheses
+    while formula.startswith('(') and formula.endswith(')'):
+        depth = 0
+        for i, c in enumerate(formula):
+            if c == '(': depth += 1
+            elif c == ')': depth -= 1
+            if depth == 0: break
+        if i != len(formula)-1: break
+        formula = formula[1:-1].strip()
+
+    # ternary operator has the lowest precedence and is right associative
+    depth, i_question, i_colon, nested = 0, None, None, 0
+    for i, c in enumerate(formula):
+        if c == '(': depth += 1
+        elif c == ')': depth -= 1
+        elif depth == 0 and c == '?':
+            if i_question is None: i_question = i
+            else: nested += 1
+        elif depth == 0 and c == ':' and i_question is not None:
+            if nested == 0:
+                i_colon = i
+                break
+            nested -= 1
+    if i_question is not None:
+        if i_colon is None:
+            raise ValueError( "Could not parse formula %s" % formula )
+        return "np.where(%s, %s, %s)" % tuple( map( translateTernary, [ formula[:i_question], formula[i_question+1:i_colon], formula[i_colon+1:] ] ) )
+
+    # translate parenthesized sub-expressions
+    res, depth, start = "", 0, 0
+    for i, c in enumerate(formula):
+        if c == '(':
+            if depth == 0:
+                res  += formula[start:i]
+                start = i+1
+            depth += 1
+        elif c == ')':
+            depth -= 1
+            if depth == 0:
+                # function arguments are separated by commas
+                res  += "(%s)" % ", ".join( map( translateTernary, formula[start:i].split(',') ) )
+                start = i+1
+    res += formula[start:]
+
+    return res
+
+class BTagCalibrationTable(object):
+    ''' Numpy implementation of BTagCalibrationReader::eval_auto_bounds for arrays of jets.
+        The csv entries are parsed once and stored per flavour and sysType; the formulas are compiled to numpy expressions.
+    '''
+
+    def __init__( self, filename, WP, measurementTypes, sysTypes = ['central', 'up', 'down'] ):
+
+        # measurementTypes: { jetFlavor: measurementType }
+        rows = { flav: { sys: [] for sys in sysTypes } for flav in measurementTypes.keys() }
+
+        with open( filename ) as f:
+            lines = [ l for l in f if l.strip() ]
+        for row in csv.reader( lines[1:], skipinitialspace = True ):
+            if len(row) < 11: continue
+            op, measurementType, sysType, flav = int( row[0] ), row[1].strip(), row[2].strip(), int( row[3] )
+            if op != WP or flav not in measurementTypes or measurementTypes[flav] != measurementType or sysType not in sysTypes: continue
+            # The reader works in single precision
+            etaMin, etaMax, ptMin, ptMax = map( lambda v: float( np.float32( v ) ), row[4:8] )
+            rows[flav][sysType].append( ( etaMin, etaMax, ptMin, ptMax, formulaToNumpy( row[10].strip().strip('"') ) ) )
+
+        for flav, entries in rows.iteritems():
+            if len( entries['central'] ) == 0:
+                raise ValueError( "No central entries for flavour %i, measurement type %s and WP %i in %s" % ( flav, measurementTypes[flav], WP, filename ) )
+
+        self.setRows( rows )
+
+    @classmethod
+    def fromRows( cls, rows ):
+        ''' Construct from the parsed rows (see setRows), e.g. from an SF cache
+        '''
+        self = cls.__new__( cls )
+        self.setRows( rows )
+        return self
+
+    def setRows( self, rows ):
+        ''' rows: { flav: { sysType: [ ( etaMin, etaMax, ptMin, ptMax, numpy formula ), ... ] } }
+        '''
+        self.rows      = rows
+        self.entries   = { flav: { sys: [ ( etaMin, etaMax, ptMin, ptMax, eval( "lambda x: %s" % formula, { 'np': np } ) ) for etaMin, etaMax, ptMin, ptMax, formula in entries ] for sys, entries in sysEntries.iteritems() } for flav, sysEntries in rows.iteritems() }
+        self.useAbsEta = { flav: not any( entry[0] < 0 for entries in sysEntries.values() for entry in entries ) for flav, sysEntries in rows.iteritems() }
+
+        # eta bounds, same for all jets of a flavour
+        self.etaBounds = {}
+        for flav, entries in self.entries.iteritems():
+            etaMin = min( [0.] + [ e[0] for e in entries['central'] ] )
+            etaMax = max( [0.] + [ e[1] for e in entries['central'] ] )
+            self.etaBounds[flav] = ( -etaMax if etaMin < 0 else etaMin, etaMax )
+
+    def _eval( self, entries, eta, pt ):
+        ''' first matching entry, 0 if there is none '''
+        res   = np.zeros( len(pt) )
+        found = np.zeros( len(pt), dtype = bool )
+        for etaMin, etaMax, ptMin, ptMax, func in entries:
+            sel = ~found & ( etaMin <= eta ) & ( eta <= etaMax ) & ( ptMin < pt ) & ( pt <= ptMax )
+            if np.any( sel ):
+                res[sel]    = func( pt[sel] )
+                found[sel]  = True
+        return res
+
+    def _min_max_pt( self, entries, eta ):
+        min_pt = np.full( len(eta), -1. )
+        max_pt = np.full( len(eta), -1. )
+        for etaMin, etaMax, ptMin, ptMax, func in entries:
+            sel = ( etaMin <= eta ) & ( eta <= etaMax )
+            init = sel & ( min_pt < 0 )
+            min_pt[init] = ptMin
+            max_pt[init] = ptMax
+            sel &= ~init
+            min_pt[sel] = np.minimum( min_pt[sel], ptMin )
+            max_pt[sel] = np.maximum( max_pt[sel], ptMax )
+        return min_pt, max_pt
+
+    def eval_auto_bounds( self, sys, flavKey, eta, pt ):
+        ''' Same as BTagCalibrationReader.eval_auto_bounds for arrays of eta and pt and an array (or a single value) of flavKey
+        '''
+        eta     = np.asarray( eta, dtype = np.float32 ).astype( float )
+        pt      = np.asarray( pt,  dtype = np.float32 ).astype( float )
+        flavKey = np.broadcast_to( flavKey, pt.shape )
+
+        res = np.ones( pt.shape )
+        for flav, entries in self.entries.iteritems():
+            sel = flavKey == flav
+            if not np.any( sel ): continue
+
+            eta_ = np.abs( eta[sel] ) if self.useAbsEta[flav] else eta[sel]
+            pt_  = pt[sel]
+
+            etaMin, etaMax = self.etaBounds[flav]
+            inBounds = ( eta_ > etaMin ) & ( eta_ <= etaMax )
+            eta_, pt_ = eta_[inBounds], pt_[inBounds]
+
+            min_pt, max_pt = self._min_max_pt( entries['central'], eta_ )
+            below, above   = pt_ <= min_pt, pt_ > max_pt
+            pt_for_eval = np.where( below, np.float32( min_pt + .0001 ), np.where( above, np.float32( max_pt - .0001 ), pt_ ) ).astype( float )
+
+            sf = self._eval( entries['central'], eta_, pt_for_eval )
+            if sys != 'central':
+                if sys not in entries:
+                    raise ValueError( "sysType %s not loaded" % sys )
+                sf_err = self._eval( entries[sys], eta_, pt_for_eval )
+                # double uncertainty on out-of-bounds
+                outOfBounds = below | above
+                sf = np.where( outOfBounds, sf + 2*( sf_err - sf ), sf_err )
+
+            res_ = np.ones( inBounds.shape )
+            res_[inBounds] = sf
+            res[sel] = res_
+
+        return res
 
 #Method 1ab
 effFile2016CSVv2   = 'TTLep_pow_2016_2j_2l_CSVv2_eta.pkl'
@@ -75,34 +256,45 @@ sfFile2017DeepJet  = 'b2017_DeepFlavour_94XSF_WP_V3_B_F.csv'
 sfFile2018DeepJet  = 'b2018_DeepJet_102XSF_V1.csv' 
 
 
-class BTagEfficiency:
+class BTagEfficiency(object):
 
     @staticmethod
     def getWeightDict_1b(effs, maxMultBTagWeight):
         '''Make Weight dictionary for jets
+           The weight for i tags is the coefficient of t^i in prod_jets( 1-e + e*t ), built up jet by jet in O(nJets*maxMult).
         '''
-        zeroTagWeight = 1.
-
+        tagWeight = [1.] + [0.]*maxMultBTagWeight
         for e in effs:
-            zeroTagWeight*=(1-e)
-
-        tagWeight={}
-        for i in range(min(len(effs), maxMultBTagWeight)+1):
-            tagWeight[i]=zeroTagWeight
-            twfSum = 0.
-            for tagged in itertools.combinations(effs, i):
-                twf=1.
-                for fac in [x/(1-x) for x in tagged]:
-                    twf*=fac
-                twfSum+=twf
-            tagWeight[i]*=twfSum
-
-        for i in range(maxMultBTagWeight+1):
-            if not tagWeight.has_key(i):
-                tagWeight[i] = 0.
+            for i in range(maxMultBTagWeight, 0, -1):
+                tagWeight[i] = tagWeight[i]*(1-e) + tagWeight[i-1]*e
+            tagWeight[0] *= (1-e)
+
+        return { i:tagWeight[i] for i in range(maxMultBTagWeight+1) }
+
+    @staticmethod
+    def getWeightArray_1b(effs, maxMultBTagWeight):
+        '''Vectorized getWeightDict_1b for an array of efficiencies with the jets along the last axis, e.g. (nEvents, nJets).
+           Padded jets must have efficiency 0. Returns an array of shape effs.shape[:-1] + (maxMultBTagWeight+1,)
+        '''
+        effs = np.asarray( effs, dtype=float )
+
+        tagWeight = np.zeros( effs.shape[:-1] + (maxMultBTagWeight+1,) )
+        tagWeight[...,0] = 1.
+        for i_jet in range( effs.shape[-1] ):
+            e = effs[...,i_jet,np.newaxis]
+            tagWeight[...,1:] = tagWeight[...,1:]*(1-e) + tagWeight[...,:-1]*e
+            tagWeight[...,0] *= (1-e[...,0])
 
         return tagWeight
 
+    def getWeightDict_1b_array(self, beff, maxMultBTagWeight):
+        '''Weights for all btagWeightNames at once from a padded (nEvents, nJets) structured array as returned by getBTagEff_array.
+           Padded jets must have zero efficiencies. Returns { var: array of shape (nEvents, maxMultBTagWeight+1) }.
+        '''
+        effs = np.stack( [ beff[var] for var in self.btagWeightNames ], axis=-2 )
+        tagWeight = BTagEfficiency.getWeightArray_1b( effs, maxMultBTagWeight )
+        return { var:tagWeight[...,i_var,:] for i_var, var in enumerate( self.btagWeightNames ) }
+
     def getBTagSF_1a(self, var, bJets, nonBJets):
         if var not in self.btagWeightNames:
             raise ValueError( "Don't know what to do with b-tag variation %s" %var )
@@ -115,7 +307,7 @@ class BTagEfficiency:
                 return 1
 
 
-    def __init__( self, WP=ROOT.BTagEntry.OP_MEDIUM, fastSim=False, year=2016, tagger='CSVv2' ):
+    def __init__( self, WP=OP_MEDIUM, fastSim=False, year=2016, tagger='CSVv2' ):
 
         if year not in [ 2016, 2017, 2018 ]:
             raise Exception("Lepton SF for year %i not known"%year)
@@ -179,6 +371,7 @@ class BTagEfficiency:
                 self.mcEfficiencyFile  = os.path.expandvars( os.path.join( self.dataDir, effFile2018DeepJet ) )
 
         logger.info ( "Loading scale factors from %s", self.scaleFactorFile )
+        import ROOT
         ROOT.gSystem.Load( 'libCondFormatsBTauObjects' ) 
         ROOT.gSystem.Load( 'libCondToolsBTau' )
         self.calib = ROOT.BTagCalibration( "csvv2", self.scaleFactorFile )
@@ -201,13 +394,72 @@ class BTagEfficiency:
             self.readerFS.load(self.calibFS, 1, "fastsim")
             self.readerFS.load(self.calibFS, 2, "fastsim")
 
+        # numpy versions of the readers for the batch methods
+        self.calibTable = BTagCalibrationTable( self.scaleFactorFile, WP, {0:"comb", 1:"comb", 2:"incl"} )
+        if fastSim:
+            self.calibTableFS = BTagCalibrationTable( self.scaleFactorFileFS, WP, {0:"fastsim", 1:"fastsim", 2:"fastsim"} )
+
         # Load MC efficiency
         logger.info( "Loading MC efficiency %s", self.mcEfficiencyFile )
         self.mcEff = pickle.load( file( self.mcEfficiencyFile ) )
 
+        # MC efficiency as array [flavour, pt bin, eta bin] with the flavour ordering of toFlavourKey_array
+        self.mcEffTable = np.array( [ [ [ self.mcEff[tuple(ptBin)][tuple(etaBin)][flav] for etaBin in self.etaBins ] for ptBin in ptBins ] for flav in ["b", "c", "other"] ] )
+        self.etaBorders = np.array( [ etaBin[0] for etaBin in self.etaBins ] + [ self.etaBins[-1][1] ] )
+
+        self.WP     = WP
+        self.cached = False
+
+    def toCache( self, filename = None ):
+        ''' Write the MC efficiencies and the parsed SF formulas to an SF cache file
+        '''
+        # json keys are strings, store the rows as lists
+        rows = lambda table: [ [ flav, sys, entries ] for flav, sysEntries in table.rows.iteritems() for sys, entries in sysEntries.iteritems() ]
+        meta = { 'year':self.year, 'tagger':self.tagger, 'fastSim':self.fastSim, 'WP':self.WP, 'etaBins':self.etaBins,
+                 'calibTable':rows( self.calibTable ), 'calibTableFS':rows( self.calibTableFS ) if self.fastSim else None }
+        SFCache.write( filename if filename is not None else SFCache.cache_file( 'BTagEfficiency', self.year, self.tagger, 'FastSim' if self.fastSim else 'FullSim', self.WP ),
+            { 'mcEffTable':[ self.mcEffTable ] }, meta = meta )
+
+    @classmethod
+    def fromCache( cls, WP=OP_MEDIUM, fastSim=False, year=2016, tagger='CSVv2', filename = None ):
+        ''' Construct from an SF cache file without the BTagCalibration readers, the csv files and the MC efficiency pickle.
+            getSF and getMCEff are evaluated with the batch methods.
+        '''
+        maps, meta = SFCache.load( filename if filename is not None else SFCache.cache_file( 'BTagEfficiency', year, tagger, 'FastSim' if fastSim else 'FullSim', WP ) )
+        if ( meta['year'], meta['tagger'], meta['fastSim'], meta['WP'] ) != ( year, tagger, fastSim, WP ):
+            raise ValueError( "SF cache is for year %i, tagger %s, fastSim %r and WP %i." % ( meta['year'], meta['tagger'], meta['fastSim'], meta['WP'] ) )
+
+        def table( rows ):
+            res = {}
+            for flav, sys, entries in rows:
+                res.setdefault( flav, {} )[str(sys)] = [ tuple( entry[:4] ) + ( str( entry[4] ), ) for entry in entries ]
+            return BTagCalibrationTable.fromRows( res )
+
+        self = cls.__new__( cls )
+        self.year    = year
+        self.tagger  = tagger
+        self.fastSim = fastSim
+        self.WP      = WP
+        self.cached  = True
+        self.btagWeightNames = [ 'MC', 'SF', 'SF_b_Down', 'SF_b_Up', 'SF_l_Down', 'SF_l_Up' ]
+        if self.fastSim:
+            self.btagWeightNames += [ 'SF_FS_Up', 'SF_FS_Down']
+
+        self.calibTable = table( meta['calibTable'] )
+        if fastSim:
+            self.calibTableFS = table( meta['calibTableFS'] )
+
+        self.etaBins    = [ list( etaBin ) for etaBin in meta['etaBins'] ]
+        self.mcEffTable = maps['mcEffTable'][0]
+        self.etaBorders = np.array( [ etaBin[0] for etaBin in self.etaBins ] + [ self.etaBins[-1][1] ] )
+        return self
+
     def getMCEff(self, pdgId, pt, eta):
         ''' Get MC efficiency for jet
         '''
+        if self.cached:
+            return float( self.getMCEff_array( [pdgId], [pt], [eta] )[0] )
+
         for ptBin in ptBins:
             if pt>=ptBin[0] and (pt<ptBin[1] or ptBin[1]<0):
                 aeta=abs(eta)
@@ -221,6 +473,9 @@ class BTagEfficiency:
         return 1
 
     def getSF(self, pdgId, pt, eta):
+        if self.cached:
+            return tuple( self.getSF_array( [pdgId], [pt], [eta] )[0] )
+
         # BTag SF Not implemented below 20 GeV
         if pt<20: 
             if self.fastSim:
@@ -266,6 +521,73 @@ class BTagEfficiency:
         else:
             return (sf, sf_b_d, sf_b_u, sf_l_d, sf_l_u)
 
+    def getMCEff_array(self, pdgId, pt, eta):
+        ''' Get MC efficiency for arrays of jets
+        '''
+        pt   = np.asarray( pt, dtype=float )
+        aeta = np.abs( np.asarray( eta, dtype=float ) )
+
+        ptIndex  = np.searchsorted( ptBorders, pt, side='right' ) - 1
+        etaIndex = np.searchsorted( self.etaBorders, aeta, side='right' ) - 1
+        valid    = ( ptIndex >= 0 ) & ( etaIndex >= 0 ) & ( etaIndex < len(self.etaBins) )
+
+        res = np.ones( pt.shape )
+        res[valid] = self.mcEffTable[ toFlavourKey_array( np.asarray( pdgId ) )[valid], ptIndex[valid], etaIndex[valid] ]
+        return res
+
+    def getSF_array(self, pdgId, pt, eta):
+        ''' Batch version of getSF. Returns an array of shape (nJets, 5) (or (nJets, 7) for fastSim) with the columns in the order of the getSF tuple.
+        '''
+        pdgId = np.asarray( pdgId )
+        pt    = np.asarray( pt,  dtype=float )
+        eta   = np.asarray( eta, dtype=float )
+
+        res = np.ones( ( len(pt), 7 if self.fastSim else 5 ) )
+
+        # BTag SF Not implemented below 20 GeV and above absEta 2.4
+        sel = ( pt >= 20 ) & ( np.abs( eta ) < 2.4 )
+        if not np.any( sel ): return res
+
+        flavKey  = toFlavourKey_array( pdgId[sel] )
+        pt, eta  = pt[sel], eta[sel]
+
+        #FastSim SFs
+        if self.fastSim:
+            sf_fs   = self.calibTableFS.eval_auto_bounds('central', flavKey, eta, pt)
+            sf_fs_u = self.calibTableFS.eval_auto_bounds('down',    flavKey, eta, pt)
+            sf_fs_d = self.calibTableFS.eval_auto_bounds('up',      flavKey, eta, pt)
+            # should not happen, however, if pt=1000 (exactly) the reader will return a sf of 0.
+            zero = sf_fs == 0
+            sf_fs[zero], sf_fs_u[zero], sf_fs_d[zero] = 1, 1, 1
+        else:
+            sf_fs = 1
+
+        #FullSim SFs (times FSSF)
+        sf      = sf_fs*self.calibTable.eval_auto_bounds('central', flavKey, eta, pt)
+        sf_d    = sf_fs*self.calibTable.eval_auto_bounds('down',    flavKey, eta, pt)
+        sf_u    = sf_fs*self.calibTable.eval_auto_bounds('up',      flavKey, eta, pt)
+
+        # b/c jets (flavKey 0, 1) get the b variations, light flavours the l variations
+        isHeavy = flavKey < 2
+        columns = [ sf, np.where( isHeavy, sf_d, 1. ), np.where( isHeavy, sf_u, 1. ), np.where( isHeavy, 1., sf_d ), np.where( isHeavy, 1., sf_u ) ]
+        if self.fastSim:
+            columns += [ sf*sf_fs_u/sf_fs, sf*sf_fs_d/sf_fs ]
+
+        res[sel] = np.column_stack( columns )
+        return res
+
+    def getBTagEff_array(self, pdgId, pt, eta):
+        ''' Batch version of addBTagEffToJet. Returns a structured array with one field per entry in btagWeightNames.
+        '''
+        mcEff = self.getMCEff_array( pdgId, pt, eta )
+        sf    = self.getSF_array( pdgId, pt, eta )
+
+        beff = np.empty( len(mcEff), dtype = [ (name, float) for name in self.btagWeightNames ] )
+        beff['MC'] = mcEff
+        for i_sf, name in enumerate( self.btagWeightNames[1:] ):
+            beff[name] = mcEff*sf[:,i_sf]
+        return beff
+
     def addBTagEffToJet(self, j):
         mcEff = self.getMCEff(j['hadronFlavour'], j['pt'], j['eta'])
         sf =    self.getSF(j['hadronFlavour'], j['pt'], j['eta'])
@@ -290,13 +612,14 @@ class btagEfficiency_1d:
     def addBTagEffToJet(self, j):
         j['beff'] = {sys: 1. if sys not in flavourSys_1d[abs(j['hadronFlavour'])] else self.readers[sys].eval(toFlavourKey(j['hadronFlavour']), j['eta'], j['pt'], j['btagCSV']) for sys in self.btagWeightNames}
 
-    def __init__(self,  WP = ROOT.BTagEntry.OP_MEDIUM):
+    def __init__(self,  WP = OP_MEDIUM):
+        import ROOT
         self.btagWeightNames = reduce(or_, flavourSys_1d.values())
 
         self.scaleFactorFile = sfFile_1d
         logger.info( "Loading scale factors from %s", self.scaleFactorFile )
         self.calib = ROOT.BTagCalibration("csvv2", self.scaleFactorFile )
-        self.readers = {sys: ROOT.BTagCalibrationReader(self.calib, ROOT.BTagEntry.OP_RESHAPING, "iterativefit", sys) for sys in self.btagWeightNames}
+        self.readers = {sys: ROOT.BTagCalibrationReader(self.calib, OP_RESHAPING, "iterativefit", sys) for sys in self.btagWeightNames}
 
 
 if __name__ == "__main__":
@@ -6,12 +6,18 @@
 # Standard imports
 import os
 import pickle
+import hashlib
 
 
 # Logger
 import logging
 logger = logging.getLogger(__name__)
 
+def key_digest( key ):
+    ''' Stable digest of a key. Unlike hash() it does not change between interpreter runs or versions.
+    '''
+    return hashlib.md5( repr(key) ).hexdigest()
+
 class DirDB:
     def __init__( self, directory ):
         '''
@@ -25,19 +31,33 @@ class DirDB:
             pass
 
     def __get_filename( self, key ):
+        filename = key_digest(key)
+        return filename[:4] + '/' + filename[4:]
+
+    def __get_legacy_filename( self, key ):
+        ''' Layout of caches written with hash(key). Only used for reading.
+        '''
         filename = str(hash(key))
         if len(filename)>4:
             return filename[:4] + '/' + filename[4:]
         else:
             return filename
 
+    def __find_file( self, key ):
+        for filename in [ self.__get_filename(key), self.__get_legacy_filename(key) ]:
+            if os.path.exists( os.path.join( self.directory, filename ) ):
+                return os.path.join( self.directory, filename )
+        return None
+
     def get(self, key):
         ''' Get all entries in the database matching the provided key.
         '''
 
         result = None
+        filename = self.__find_file(key)
+        if filename is None: return result
         try:
-            result = pickle.load( file(os.path.join( self.directory, self.__get_filename(key) )) ) 
+            result = pickle.load( file(filename) ) 
         except IOError:
             # nothing found
             pass
@@ -47,7 +67,7 @@ class DirDB:
     def contains(self, key):
         ''' We got that thing?
         '''
-        return os.path.exists( os.path.join( self.directory, self.__get_filename(key) ) )
+        return self.__find_file(key) is not None
 
     def add(self, key, data, overwrite=False):
 
@@ -59,7 +79,7 @@ class DirDB:
             pass
 
         if not overwrite:
-            if os.path.exists( filename ):
+            if self.contains( key ):
                 logger.warning( "Already found key '%r'. Do not store data.", key )
                 return data
         pickle.dump( data, file( filename, 'w' ) )
@@ -0,0 +1,194 @@
+''' Content addressed cache for TChain::Draw results of the yield and plot helpers.
+
+Keys consist of the chain (tree name, files with modification time and size, aliases and friends), the cut string and the quantities drawn.
+Chains with an entry list set by the caller are not cached.
+Results are stored in a DirDB. The selection of a cut is stored as TEntryList in a ROOT file per cut.
+A cut is split in its top level '&&' terms. A new entry list starts from the cached entry list of the
+largest subset of its terms, i.e. a tighter cut only reads the events of a looser, cached selection.
+'''
+
+# Standard imports
+import os
+import uuid
+import ROOT
+
+# Analysis
+from Analysis.Tools.DirDB import DirDB, key_digest
+
+# Logging
+import logging
+logger = logging.getLogger(__name__)
+
+def top_level_split( cut, separator ):
+    ''' Split at separator outside of parentheses
+    '''
+    parts = []
+    depth = 0
+    start = 0
+    for i, char in enumerate( cut ):
+        if char == '(': depth += 1
+        elif char == ')': depth -= 1
+        elif depth == 0 and cut[i:i+len(separator)] == separator:
+            parts.append( cut[start:i] )
+            start = i+len(separator)
+    parts.append( cut[start:] )
+    return parts
+
+def is_enclosed( cut ):
+    ''' True if the whole string is enclosed by a pair of parentheses
+    '''
+    if not ( cut.startswith('(') and cut.endswith(')') ): return False
+    depth = 0
+    for char in cut[:-1]:
+        if char == '(': depth += 1
+        elif char == ')': depth -= 1
+        if depth == 0: return False
+    return True
+
+def cut_terms( cut ):
+    ''' Split a cut string in its top level '&&' terms. Returns a sorted tuple without trivial terms.
+    '''
+    cut = cut.replace(" ", "")
+    # remove parentheses around the whole string
+    while is_enclosed( cut ):
+        cut = cut[1:-1]
+
+    # '||' binds weaker than '&&'
+    if len( top_level_split( cut, '||' ) ) > 1:
+        terms = ( cut, )
+    else:
+        terms = set()
+        for term in top_level_split( cut, '&&' ):
+            terms.update( cut_terms( term ) if term != cut else ( term, ) )
+
+    return tuple( sorted( term for term in terms if term not in [ '', '1' ] ) )
+
+def chain_key( c ):
+    ''' Tree name, files with modification time and size (if the file is local), aliases and friends
+    '''
+    files = []
+    if hasattr( c, "GetListOfFiles" ):
+        filenames = [ f.GetTitle() for f in c.GetListOfFiles() ]
+    else:
+        filenames = [ c.GetDirectory().GetFile().GetName() ] if c.GetDirectory() and c.GetDirectory().GetFile() else []
+    for filename in filenames:
+        if os.path.exists( filename ):
+            files.append( ( filename, os.path.getmtime( filename ), os.path.getsize( filename ) ) )
+        else:
+            files.append( ( filename, ) )
+
+    aliases = tuple( sorted( ( a.GetName(), a.GetTitle() ) for a in ( c.GetListOfAliases() or [] ) ) )
+    friends = tuple( ( f.GetName(), chain_key( f.GetTree() ) ) for f in ( c.GetListOfFriends() or [] ) )
+    return ( c.GetName(), tuple( files ), aliases, friends )
+
+class DrawCache:
+
+    def __init__( self, directory ):
+        '''
+        Will create the directory if it doesn't exist
+        '''
+        self.directory  = directory
+        self.results    = DirDB( os.path.join( directory, 'results' ) )
+        self.entryListDirectory = os.path.join( directory, 'entryLists' )
+        try: # errors can appear in parallel processing
+            if not os.path.isdir( self.entryListDirectory ):
+                os.makedirs( self.entryListDirectory )
+        except:
+            pass
+
+        # entry lists loaded in this process
+        self.entryLists = {}
+
+    def entryListFile( self, chainKey, terms ):
+        return os.path.join( self.entryListDirectory, key_digest( ( chainKey, terms ) ) + '.root' )
+
+    def loadEntryList( self, chainKey, terms ):
+        filename = self.entryListFile( chainKey, terms )
+        if filename in self.entryLists:
+            return self.entryLists[filename]
+        if not os.path.exists( filename ):
+            return None
+        f = ROOT.TFile.Open( filename )
+        if not f or f.IsZombie():
+            logger.warning( "Could not read entry list %s", filename )
+            return None
+        entryList = f.Get( "entryList" )
+        if entryList:
+            entryList.SetDirectory( 0 )
+        f.Close()
+        if not entryList:
+            return None
+        self.entryLists[filename] = entryList
+        return entryList
+
+    def saveEntryList( self, chainKey, terms, entryList ):
+        filename = self.entryListFile( chainKey, terms )
+        # write to a temporary file and move, other processes must not read incomplete files
+        tmp_filename = filename + '.' + str(uuid.uuid4())
+        gDir = ROOT.gDirectory.GetName()
+        f = ROOT.TFile( tmp_filename, 'recreate' )
+        entryList.Write( "entryList" )
+        f.Close()
+        ROOT.gDirectory.cd( gDir+':/' )
+        os.rename( tmp_filename, filename )
+
+        entryLists = self.results.get( ( chainKey, 'entryLists' ) ) or []
+        if terms not in entryLists:
+            self.results.add( ( chainKey, 'entryLists' ), entryLists + [ terms ], overwrite = True )
+        self.entryLists[filename] = entryList
+
+    def getEntryList( self, c, cutString ):
+        ''' Entry list of the events passing the cut. Returns None for a trivial cut or if the chain has an entry list.
+        '''
+        terms = cut_terms( cutString )
+        if len(terms) == 0: return None
+        # the cached lists do not know about a pre-selection of the caller
+        if c.GetEntryList(): return None
+
+        chainKey  = chain_key( c )
+        entryList = self.loadEntryList( chainKey, terms )
+        if entryList is not None:
+            return entryList
+
+        # start from the cached selection with the largest subset of the terms
+        looser = None
+        for looser_terms in sorted( self.results.get( ( chainKey, 'entryLists' ) ) or [], key = len, reverse = True ):
+            if set( looser_terms ).issubset( terms ):
+                looser = self.loadEntryList( chainKey, looser_terms )
+                if looser is not None:
+                    logger.debug( "Selecting '%s' starting from cached '%s'", "&&".join( terms ), "&&".join( looser_terms ) )
+                    break
+
+        if looser is not None:
+            c.SetEntryList( looser )
+        name = "entryList_%s" % uuid.uuid4().hex
+        c.Draw( ">>%s" % name, cutString, "entrylist" )
+        entryList = ROOT.gDirectory.Get( name )
+        c.SetEntryList( 0 )
+        entryList.SetDirectory( 0 )
+
+        self.saveEntryList( chainKey, terms, entryList )
+        return entryList
+
+    def get( self, c, cutString, key, func ):
+        ''' Return the cached result for the chain, cut and key.
+            Otherwise call func with the entry list of the cut set on the chain and cache its result.
+            Chains with an entry list set by the caller are not cached.
+        '''
+        if c.GetEntryList():
+            return func()
+
+        fullKey = ( chain_key( c ), cut_terms( cutString ), key )
+        if self.results.contains( fullKey ):
+            return self.results.get( fullKey )
+
+        entryList = self.getEntryList( c, cutString )
+        if entryList is not None:
+            c.SetEntryList( entryList )
+        try:
+            res = func()
+        finally:
+            c.SetEntryList( 0 )
+
+        self.results.add( fullKey, res, overwrite = True )
+        return res
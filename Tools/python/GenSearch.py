@@ -1,3 +1,15 @@
+''' Navigation in the genParticle decay tree (reco::GenParticle).
+The pdgId, status and the mother and daughter indices of all particles are read once per event;
+descend, ascend and ancestry work on these arrays and are cached.
+'''
+
+import ROOT
+
+def address( p ):
+    ''' Address of the C++ object, identifies the particle independent of the python proxy
+    '''
+    return ROOT.addressof( p )
+
 class GenSearch:
 
     def __init__( self, genParticles ):
@@ -6,71 +18,126 @@ class GenSearch:
         else:
             self.genParticles = genParticles
 
+        # snapshot of the decay tree; mothers and daughters that are not in genParticles are appended
+        self.particles  = list( self.genParticles )
+        self.index      = { address( p ):i for i, p in enumerate( self.particles ) }
+        self.pdgIds     = []
+        self.status     = []
+        self.motherIndices   = []
+        self.daughterIndices = []
+        i = 0
+        while i < len( self.particles ):
+            p = self.particles[i]
+            self.pdgIds.append( p.pdgId() )
+            self.status.append( p.status() )
+            self.motherIndices.append( [ self.__index( p.mother(j) ) for j in xrange( p.numberOfMothers() ) ] )
+            self.daughterIndices.append( [ self.__index( p.daughter(j) ) for j in xrange( p.numberOfDaughters() ) ] )
+            i += 1
+
+        self.__descend  = {}
+        self.__ascend   = {}
+        self.__ancestry = {}
+
+    def __index( self, p ):
+        key = address( p )
+        if key not in self.index:
+            self.index[key] = len( self.particles )
+            self.particles.append( p )
+        return self.index[key]
+
     def ancestry( self, l, stop_at_pdgId=[2212] ):
-        self.__found = set()
-        return self.__ancestry( l, stop_at_pdgId=stop_at_pdgId )
+        ''' Returns the set of all genParticles in the ancestry of l
+        '''
+        return set( self.particles[i] for i in self.ancestry_indices( self.index[address( l )], stop_at_pdgId = stop_at_pdgId ) )
+
+    def ancestry_indices( self, i, stop_at_pdgId=[2212] ):
+        ''' Returns the indices of all particles in the ancestry of the particle with index i
+        '''
+        key = ( i, tuple( stop_at_pdgId ) )
+        if key not in self.__ancestry:
+            found = set()
+            self.__find_ancestors( i, set( stop_at_pdgId ), found )
+            self.__ancestry[key] = frozenset( found )
+        return self.__ancestry[key]
 
     @property
     def final_state_particles_no_neutrinos( self ):
         if hasattr( self, "final_state_particles_no_neutrinos_" ):
             return self.final_state_particles_no_neutrinos_
         else:
-            self.final_state_particles_no_neutrinos_ = filter( lambda p: p.status()==1 and abs(p.pdgId()) not in [12,14,16], self.genParticles ) 
+            self.final_state_particles_no_neutrinos_ = [ p for i, p in enumerate( self.genParticles ) if self.status[i]==1 and abs(self.pdgIds[i]) not in [12,14,16] ]
             return self.final_state_particles_no_neutrinos_
 
     def daughters(self, p):
-        return [p.daughter(i) for i in xrange( p.numberOfDaughters()) ]
+        return [ self.particles[i] for i in self.daughterIndices[self.index[address( p )]] ]
 
     def mothers(self, p):
-        return [p.mother(i) for i in xrange( p.numberOfMothers()) ]
+        return [ self.particles[i] for i in self.motherIndices[self.index[address( p )]] ]
 
     def isLast(self, p ):
         ''' Returns true if the decay products of p do not contain a particle with p.pdgId() '''
-        return p.pdgId() not in [d.pdgId() for d in self.daughters( p )]
+        i = self.index[address( p )]
+        return self.pdgIds[i] not in [ self.pdgIds[d] for d in self.daughterIndices[i] ]
 
     def isFirst(self, p ):
         ''' Returns true if the particle pdgId is not found in the list of mothers '''
-        return p.pdgId() not in [m.pdgId() for m in self.mothers( p )]
+        i = self.index[address( p )]
+        return self.pdgIds[i] not in [ self.pdgIds[m] for m in self.motherIndices[i] ]
+
+    def __follow( self, i, relatives, cache ):
+        ''' Follow the first relative with the same |pdgId| as long as there is one
+        '''
+        if i in cache: return cache[i]
+        chain = [ i ]
+        while True:
+            cands = [ j for j in relatives[chain[-1]] if abs(self.pdgIds[j])==abs(self.pdgIds[chain[-1]]) ]
+            if len(cands)==0 or cands[0] in chain:
+                break
+            if cands[0] in cache:
+                chain.append( cache[cands[0]] )
+                break
+            chain.append( cands[0] )
+        for j in chain:
+            cache[j] = chain[-1]
+        return chain[-1]
+
+    def descend_index( self, i ):
+        return self.__follow( i, self.daughterIndices, self.__descend )
+
+    def ascend_index( self, i ):
+        return self.__follow( i, self.motherIndices, self.__ascend )
 
     def descend(self, p):
         ''' Returns the last particle of the same pdgId in the decay chain started by p
         '''
-        cands = filter(lambda q:abs(q.pdgId())==abs(p.pdgId()), self.daughters(p) )
-        #if len(cands)>1: print "Warning: Found more than one particle with same pdgId %i in decay chain %r -> %r."%(p.pdgId(), p, cands)
-        if len(cands)>0:
-            if cands[0]==p:return p
-            return self.descend(cands[0])
-        return p
+        return self.particles[ self.descend_index( self.index[address( p )] ) ]
 
     def ascend(self, p):
         ''' Returns the first particle of the same pdgId in the decay chain started by p
         '''
-        cands = filter(lambda q:abs(q.pdgId())==abs(p.pdgId()), self.mothers(p) )
-        #if len(cands)>1: print "Warning: Found more than one particle with same pdgId %i in decay chain %r -> %r."%(p['pdgId'], p, cands)
-        if len(cands)>0:
-            if cands[0]==p:return p
-            return self.ascend(cands[0])
-        return p
+        return self.particles[ self.ascend_index( self.index[address( p )] ) ]
 
     def print_decay( self, p, prefix = ""):
         print prefix+" %s(pt %3.2f, eta %3.2f, phi %3.2f)" % ( pdgToName(p.pdgId()), p.pt(), p.eta(), p.phi())
         for d in self.daughters( self.descend( p ) ):
             self.print_decay( d, prefix = prefix+'--')
 
-    def __ancestry(self, p, stop_at_pdgId):
-        ''' Returns indices of all genParticles in the ancestry of l
+    def __find_ancestors(self, i, stop_at_pdgId, found):
+        ''' Adds the indices of all particles in the ancestry of i to found. Ancestors that are already found are not visited again.
         '''
-        #print stop_at_pdgId
-        #print "Looking at %s, nMothers %i, motherPdgID %i, already self.__found: %s"% ( p.pdgId(), p.numberOfMothers(), p.mother(0).pdgId(),",".join(str(x.pdgId()) for x in self.__found) )
-        for m in self.mothers(p):
-            if abs(m.pdgId()) in stop_at_pdgId or m.numberOfMothers()==0:
-                # print "Done."
-                return self.__found
+        stack = [ iter( self.motherIndices[i] ) ]
+        while stack:
+            for m in stack[-1]:
+                if abs(self.pdgIds[m]) in stop_at_pdgId or len(self.motherIndices[m])==0:
+                    # stop looking at the other mothers of this particle
+                    stack.pop()
+                    break
+                if m in found: continue
+                found.add( m )
+                stack.append( iter( self.motherIndices[m] ) )
+                break
             else:
-                self.__found.add( m )
-                self.__found.union( self.__ancestry( m , stop_at_pdgId = stop_at_pdgId ) )
-        # print "Done alltogether."
-        return self.__found
+                stack.pop()
             
 
 D_mesons = set([ 411, -411, 421, -421, 413, -413, 423, -423, 10411, -10411, 10421, -10421, 10413, -10413, 10423, -10423, 415, -415, 425, -425, 20413, -20413, 20423, -20423, 431, -431, 433, -433, 10431, -10431, 10433, -10433, 435, -435, 20433, -20433])
@@ -44,6 +44,7 @@ logger = logging.getLogger(__name__)
 import operator
 import numpy as np
 import scipy.special
+import scipy.linalg
 import itertools
 
 # Helpers
@@ -98,49 +99,76 @@ class HyperPoly:
                 self.combination[counter] = comb
                 counter += 1
 
-        # Now we solve A.x = b for a system of dimension DOF
-        # Fill A
-        A = np.empty( [self.ndof, self.ndof ] )
-        for d in range(self.ndof):
-            for e in range(self.ndof):
-                if d > e:
-                    A[d][e] = A[e][d]
-                else:
-                    A[d][e] = self.expectation(self.combination[d] + self.combination[e]) 
+        # Design matrix: the monomials of all param_points, shape ( N, ndof )
+        self.design_matrix = self.monomials( self.param_points )
 
-        # Invert (Yes, n^3. But ... only the inhomongeneity depends on the weights, so Ainv is universal for the sample!)
+        # Now we solve A.x = b for a system of dimension DOF with A_de = <de> = ( X^T X )_de / N
+        A = np.dot( self.design_matrix.T, self.design_matrix ) / float(self.N)
 
-        self.Ainv = timeit(np.linalg.inv)(A)
+        # Factorize (Yes, n^3. But ... only the inhomongeneity depends on the weights, so the factorization is universal for the sample!)
+        try:
+            self.cho_factor = timeit(scipy.linalg.cho_factor)(A)
+        except np.linalg.LinAlgError:
+            # e.g. fewer param_points than d.o.f.: fall back to the least-squares solution
+            logger.warning( "Matrix of %i param_points and %i d.o.f. is not positive definite. Use least-squares solution.", self.N, self.ndof )
+            self.cho_factor = None
+            self.A = A
         self.initialized = True
 
+    def monomials( self, points ):
+        ''' Matrix of all monomials (p_i - ref_i)*(p_j - ref_j)*... in the order of self.combination for an array of points of shape ( n, nvar )
+        '''
+        diff = np.asarray( points, dtype = float ) - np.asarray( self.ref_point, dtype = float )
+        res  = np.empty( ( diff.shape[0], self.ndof ) )
+        for d in range(self.ndof):
+            res[:, d] = np.prod( diff[:, list(self.combination[d])], axis = 1 )
+        return res
+
     def get_parametrization( self, weights ): 
-        ''' Obtain the parametrization for given weights
+        ''' Obtain the parametrization for given weights.
+            'weights' can also be an array of shape ( n, N ), then the n parametrizations are returned with shape ( n, ndof ).
         '''
-        if len(weights)!=self.N:
-            raise ValueError( "Need %i weights that correspond to the same number of param_points. Got %i." % (self.N, len(weights)) )
-        b = np.array( [ self.wEXT_expectation( weights, self.combination[d] ) for d in range(self.ndof) ] )
-        return np.dot(self.Ainv, b)
+        weights = np.asarray( weights, dtype = float )
+        if weights.shape[-1]!=self.N:
+            raise ValueError( "Need %i weights that correspond to the same number of param_points. Got %i." % (self.N, weights.shape[-1]) )
+        # b_d = < wEXT d > for all d and all weight vectors, shape ( ndof, n )
+        b = np.dot( self.design_matrix.T, weights.T ) / float(self.N)
+        if self.cho_factor is not None:
+            res = scipy.linalg.cho_solve( self.cho_factor, b )
+        else:
+            res = np.linalg.lstsq( self.A, b, rcond = None )[0]
+        return res.T
 
     def wEXT_expectation(self, weights, combination ):
         ''' Compute <wEXT ijk...> = 1/Nmeas Sum_meas( wEXT_meas*i_meas*j_meas*k_meas... )
         '''
-        return sum( [ weights[n]*np.prod( [ (self.param_points[n][elem]-self.ref_point[elem]) for elem in combination ] ) for n in xrange(self.N) ] ) / float(self.N)
+        return np.dot( np.asarray( weights, dtype = float ), self.monomial( combination ) ) / float(self.N)
 
     def expectation(self, combination ):
         ''' Compute <wEXT ijk...> = 1/Nmeas Sum_meas( i_meas*j_meas*k_meas... )
         '''
-        return sum( [ np.prod( [ (self.param_points[n][elem] - self.ref_point[elem]) for elem in combination ] ) for n in range(self.N) ]) / float(self.N)
+        return np.mean( self.monomial( combination ) )
+
+    def monomial( self, combination ):
+        ''' The monomial i_meas*j_meas*k_meas... for all param_points
+        '''
+        diff = np.asarray( self.param_points, dtype = float ) - np.asarray( self.ref_point, dtype = float )
+        return np.prod( diff[:, list(combination)], axis = 1 )
 
     def eval( self, coefficients, *point ):
         ''' Evaluate parametrization
         '''
         if not len(point) == self.nvar:
             raise ValueError( "Polynomial degree is %i. Got %i arguments." % (self.nvar, len(point) ) )
-#        return sum( ( coefficients[n] - self.reference_coefficients[n] ) * np.prod( [ point[elem] for elem in self.combination[n] ] ) for n in range(self.ndof) ) 
-        return sum( coefficients[n] * np.prod( [ (point[elem] - self.ref_point[elem]) for elem in self.combination[n] ] ) for n in range(self.ndof) ) 
+        return np.dot( self.monomials( [point] )[0], coefficients )
+
+    def eval_array( self, coefficients, points ):
+        ''' Evaluate parametrization for an array of points of shape ( n, nvar )
+        '''
+        return np.dot( self.monomials( points ), coefficients )
    
     def chi2( self, coefficients, weights):
-        return sum( [ (self.eval(coefficients, *self.param_points[n]) - weights[n])**2 for n in range(self.N) ] )
+        return np.sum( ( np.dot( self.design_matrix, coefficients ) - np.asarray( weights, dtype = float ) )**2 )
     
     def chi2_ndof( self, coefficients, weights):
         return self.chi2( coefficients, weights )/float(self.ndof)
@@ -0,0 +1,195 @@
+''' Implementation of a directory based results DB for CMS analyses
+    Same interface as DirDB, but entries are appended to a few segment files instead of one file per key.
+
+    Every instance appends to its own segment file 'segment_<uuid>' and writes one line 'digest offset length time'
+    per entry to 'segment_<uuid>.idx'. Index lines are written after the data is flushed, hence readers never see incomplete entries.
+    The index files of all processes are read on start and re-scanned incrementally when a key is not found,
+    at most once per rescan_interval seconds unless a new segment appeared in the directory.
+    Recently read objects are kept in an in-process LRU, which is not invalidated when other processes overwrite a key.
+'''
+
+# Standard imports
+import os
+import pickle
+import uuid
+import time
+from collections import OrderedDict
+
+# Analysis
+from Analysis.Tools.DirDB import key_digest
+
+# Logger
+import logging
+logger = logging.getLogger(__name__)
+
+def complete_lines( lines ):
+    ''' Drop an incomplete last line, an entry can currently be written
+    '''
+    return lines[:lines.rfind('\n')+1]
+
+def parse_index( lines ):
+    ''' Parse index lines to ( digest, offset, length, time )
+    '''
+    res = []
+    for line in lines.splitlines():
+        digest, offset, length, t = line.split()
+        res.append( ( digest, int(offset), int(length), float(t) ) )
+    return res
+
+class IndexedDirDB:
+
+    # file name prefix of segments and their index files
+    prefix = 'segment_'
+
+    def __init__( self, directory, cache_size = 128, rescan_interval = 1. ):
+        '''
+        Will create the directory if it doesn't exist
+        rescan_interval: minimum time in seconds between rescans of the index files on missing keys
+        '''
+        self.directory = directory
+        try: # errors can appear in parallel processing
+            if not os.path.isdir( self.directory ):
+                os.makedirs( self.directory )
+        except:
+            pass
+
+        # segment this instance appends to
+        self.segment = self.prefix+str(uuid.uuid4())
+
+        # digest -> ( time, segment, offset, length )
+        self.index = {}
+        # number of bytes already read from each index file
+        self.index_positions = {}
+        # modification time of the directory and time of the last scan
+        self.rescan_interval = rescan_interval
+        self.directory_mtime = None
+        self.last_scan       = 0
+        self.update_index()
+
+        # LRU of recently read objects
+        self.cache_size = cache_size
+        self.cache      = OrderedDict()
+
+    def segment_file( self, segment ):
+        return os.path.join( self.directory, segment )
+
+    def index_file( self, segment ):
+        return os.path.join( self.directory, segment + '.idx' )
+
+    def update_index( self, force = True ):
+        ''' Read new lines from all index files.
+            If not forced, only if the directory changed (new segments) or the last scan is older than rescan_interval.
+        '''
+        try:
+            mtime = os.path.getmtime( self.directory )
+        except OSError:
+            mtime = None
+        if not force and mtime == self.directory_mtime and time.time() - self.last_scan < self.rescan_interval:
+            return
+        self.directory_mtime = mtime
+        self.last_scan       = time.time()
+
+        for f in os.listdir( self.directory ):
+            if not ( f.startswith( self.prefix ) and f.endswith( '.idx' ) ): continue
+            position = self.index_positions.get( f, 0 )
+            try:
+                if os.path.getsize( os.path.join( self.directory, f ) ) <= position: continue
+                with open( os.path.join( self.directory, f ) ) as _f:
+                    _f.seek( position )
+                    lines = _f.read()
+            except (IOError, OSError):
+                logger.warning( "Warning! Ignoring error when reading index file %s", f )
+                continue
+            complete = complete_lines( lines )
+            self.index_positions[f] = position + len(complete)
+            segment = f[:-len('.idx')]
+            for digest, offset, length, t in parse_index( complete ):
+                entry = ( t, segment, offset, length )
+                if digest not in self.index or entry[0] >= self.index[digest][0]:
+                    self.index[digest] = entry
+
+    def __find( self, key ):
+        digest = key_digest( key )
+        if digest not in self.index:
+            self.update_index( force = False )
+        return digest, self.index.get( digest )
+
+    def __cache( self, digest, data ):
+        self.cache[digest] = data
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem( last = False )
+
+    def get(self, key):
+        ''' Get all entries in the database matching the provided key.
+        '''
+        return self.get_many( [key] )[0]
+
+    def get_many(self, keys):
+        ''' Get the entries for a list of keys. Every segment file is opened at most once.
+        '''
+        results = [ None for key in keys ]
+
+        # segment -> [ (offset, length, i_key, digest) ]
+        to_read = {}
+        for i_key, key in enumerate( keys ):
+            digest = key_digest( key )
+            if digest in self.cache:
+                # LRU: move to the end
+                results[i_key] = self.cache.pop( digest )
+                self.cache[digest] = results[i_key]
+                continue
+            digest, entry = self.__find( key )
+            if entry is None: continue
+            t, segment, offset, length = entry
+            to_read.setdefault( segment, [] ).append( ( offset, length, i_key, digest ) )
+
+        for segment, entries in to_read.iteritems():
+            try:
+                with open( self.segment_file( segment ), 'rb' ) as _f:
+                    for offset, length, i_key, digest in sorted( entries ):
+                        _f.seek( offset )
+                        results[i_key] = pickle.loads( _f.read( length ) )
+                        self.__cache( digest, results[i_key] )
+            except IOError:
+                logger.warning( "Warning! Ignoring IOError when reading %s", self.segment_file( segment ) )
+
+        return results
+
+    def contains(self, key):
+        ''' We got that thing?
+        '''
+        return self.__find( key )[1] is not None
+
+    def add(self, key, data, overwrite=False):
+
+        if not overwrite:
+            if self.contains( key ):
+                logger.warning( "Already found key '%r'. Do not store data.", key )
+                return data
+
+        digest = key_digest( key )
+        pdata  = pickle.dumps( data, pickle.HIGHEST_PROTOCOL )
+        with open( self.segment_file( self.segment ), 'ab' ) as _f:
+            _f.seek( 0, os.SEEK_END )
+            offset = _f.tell()
+            _f.write( pdata )
+        t = time.time()
+        with open( self.index_file( self.segment ), 'a' ) as _f:
+            _f.write( "%s %i %i %r\n" % ( digest, offset, len(pdata), t ) )
+
+        self.index[digest] = ( t, self.segment, offset, len(pdata) )
+        self.__cache( digest, data )
+        return data
+
+if __name__ == "__main__":
+    import Analysis.Tools.logger as logger
+    logger    = logger.get_logger( "DEBUG", logFile = None)
+
+    import ROOT
+
+    dirDB = IndexedDirDB("./test")
+
+    dirDB.add('y',1)
+    dirDB.add(3,1)
+    dirDB.add((2,3),ROOT.TH1F('x','x',100,0,1))
+    print dirDB.get_many( ['y', 3, 'z'] )
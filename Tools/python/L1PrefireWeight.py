@@ -9,10 +9,16 @@ https://twiki.cern.ch/twiki/bin/viewauth/CMS/L1ECALPrefiringWeightRecipe
 
 import os
 import math
-from Analysis.Tools.helpers import getObjFromFile, deltaR
+from Analysis.Tools.kinematics import to_arrays, delta_r_matrix
+from Analysis.Tools.arrayHelpers import HistoLookup
+import Analysis.Tools.SFCache as SFCache
 
-class L1PrefireWeight:
+class L1PrefireWeight(object):
     def __init__(self, year, syst=0.2):
+        # ROOT is only needed if the maps are not loaded from the cache
+        from Analysis.Tools.helpers import getObjFromFile
+
+        self.year = year
         if year == 2016:
             self.phEff  = getObjFromFile(os.path.expandvars('$CMSSW_BASE/src/Analysis/Tools/data/L1Prefiring/L1prefiring_photonpt_2016BtoH.root'), 'L1prefiring_photonpt_2016BtoH')
             self.jetEff = getObjFromFile(os.path.expandvars('$CMSSW_BASE/src/Analysis/Tools/data/L1Prefiring/L1prefiring_jetpt_2016BtoH.root'), 'L1prefiring_jetpt_2016BtoH')
@@ -26,7 +32,42 @@ class L1PrefireWeight:
         if self.phEff:
             self.maxPtG = self.phEff.GetYaxis().GetXmax()
             self.maxPtJ = self.jetEff.GetYaxis().GetXmax()
+            self.phEff_lookup  = HistoLookup.fromHisto( self.phEff )
+            self.jetEff_lookup = HistoLookup.fromHisto( self.jetEff )
+        self.rel_syst = syst
+
+    def toCache( self, filename = None ):
+        ''' Write the maps to an SF cache file
+        '''
+        maps = { 'phEff':[ self.phEff_lookup ], 'jetEff':[ self.jetEff_lookup ] } if self.phEff else {}
+        SFCache.write( filename if filename is not None else SFCache.cache_file( 'L1PrefireWeight', self.year ), maps, meta = { 'year':self.year } )
+
+    @classmethod
+    def fromCache( cls, year, syst=0.2, filename = None ):
+        ''' Construct from an SF cache file without ROOT
+        '''
+        maps, meta = SFCache.load( filename if filename is not None else SFCache.cache_file( 'L1PrefireWeight', year ) )
+        if meta['year'] != year:
+            raise ValueError( "SF cache is for year %i." % meta['year'] )
+        self = cls.__new__( cls )
+        self.year     = year
+        self.phEff    = None
+        self.jetEff   = None
         self.rel_syst = syst
+        if 'phEff' in maps:
+            self.phEff_lookup  = maps['phEff'][0]
+            self.jetEff_lookup = maps['jetEff'][0]
+            self.maxPtG = self.phEff_lookup.edges[1][-1]
+            self.maxPtJ = self.jetEff_lookup.edges[1][-1]
+        return self
+
+    def getPrefireRate(self, eff, lookup, eta, pt):
+        ''' Prefire rate and its stat. uncertainty from the ROOT map or, if loaded from the cache, its array copy
+        '''
+        if eff is not None:
+            ix, iy = eff.GetXaxis().FindBin(eta), eff.GetYaxis().FindBin(pt)
+            return eff.GetBinContent(ix, iy), eff.GetBinError(ix, iy)
+        return tuple( map( float, lookup.evaluate( eta, pt ) ) )
 
     def getWeight(self, photons, jets):
         weight          = 1.
@@ -34,7 +75,10 @@ class L1PrefireWeight:
         weightDown      = 1.
         overlapIndices  = []
 
-        for jet in jets:
+        # Delta R of all jet-photon pairs
+        dr = delta_r_matrix( *( to_arrays( jets ) + to_arrays( photons ) ) )
+
+        for i_jet, jet in enumerate(jets):
             if not 2.0 <= abs(jet['eta']) <= 3.0:
                 continue
             
@@ -44,14 +88,12 @@ class L1PrefireWeight:
 
             # get overlap with photons
             for i,photon in enumerate(photons):
-                if deltaR(photon, jet)<0.4:
+                if dr[i_jet][i]<0.4:
                     cleanJet = False
                     overlapIndices.append(i)
                     pt_g = photon['pt'] if photon['pt'] < self.maxPtG else self.maxPtG - 1.
-                    prefRatePh          = self.phEff.GetBinContent(self.phEff.GetXaxis().FindBin(photon['eta']), self.phEff.GetYaxis().FindBin(pt_g))
-                    prefRatePh_stat     = self.phEff.GetBinError(self.phEff.GetXaxis().FindBin(photon['eta']), self.phEff.GetYaxis().FindBin(pt_g))
-                    prefRateJet         = self.jetEff.GetBinContent(self.jetEff.GetXaxis().FindBin(jet['eta']), self.jetEff.GetYaxis().FindBin(pt_j))
-                    prefRateJet_stat    = self.jetEff.GetBinError(self.jetEff.GetXaxis().FindBin(jet['eta']), self.jetEff.GetYaxis().FindBin(pt_j))
+                    prefRatePh,  prefRatePh_stat  = self.getPrefireRate(self.phEff,  self.phEff_lookup,  photon['eta'], pt_g)
+                    prefRateJet, prefRateJet_stat = self.getPrefireRate(self.jetEff, self.jetEff_lookup, jet['eta'],    pt_j)
 
                     if prefRatePh > prefRateJet:
                         prefRate = prefRatePh
@@ -61,8 +103,7 @@ class L1PrefireWeight:
                         prefRate_stat = prefRateJet_stat
 
             if cleanJet:
-                prefRate        = self.jetEff.GetBinContent(self.jetEff.GetXaxis().FindBin(jet['eta']), self.jetEff.GetYaxis().FindBin(pt_j))
-                prefRate_stat   = self.jetEff.GetBinError(self.jetEff.GetXaxis().FindBin(jet['eta']), self.jetEff.GetYaxis().FindBin(pt_j))
+                prefRate, prefRate_stat = self.getPrefireRate(self.jetEff, self.jetEff_lookup, jet['eta'], pt_j)
 
             weight      *= (1 - prefRate)
             weightUp    *= (1 - min(1, prefRate + math.sqrt(prefRate_stat**2 + (self.rel_syst * prefRate)**2) ) )
@@ -73,8 +114,7 @@ class L1PrefireWeight:
             if i not in overlapIndices:
                 pt_g = photon['pt'] if photon['pt'] < self.maxPtG else self.maxPtG - 1.
                 if pt_g < 20: continue
-                prefRatePh          = self.phEff.GetBinContent(self.phEff.GetXaxis().FindBin(photon['eta']), self.phEff.GetYaxis().FindBin(pt_g))
-                prefRatePh_stat     = self.phEff.GetBinError(self.phEff.GetXaxis().FindBin(photon['eta']), self.phEff.GetYaxis().FindBin(pt_g))
+                prefRatePh, prefRatePh_stat = self.getPrefireRate(self.phEff, self.phEff_lookup, photon['eta'], pt_g)
                 
                 weight      *= (1 - prefRatePh )
                 weightUp    *= (1 - min(1, prefRatePh + math.sqrt(prefRatePh_stat**2 + (self.rel_syst * prefRatePh)**2) ) )
@@ -1,9 +1,10 @@
-import ROOT
 import os
 from math import sqrt
+import numpy as np
 
-from Analysis.Tools.helpers import getObjFromFile
-from Analysis.Tools.u_float import u_float
+from Analysis.Tools.u_float import u_float, u_array
+from Analysis.Tools.arrayHelpers import HistoLookup, jagged_prod
+import Analysis.Tools.SFCache as SFCache
 
 # 2016 Lumi Ratios
 lumiRatio2016_BCDEF = 19.695422959 / 35.921875595
@@ -82,16 +83,25 @@ keys_ele2018      = { "medium":[( "e2018_ElectronMedium.root", "EGamma_SF2D" )],
                       "tight": [( "e2018_ElectronTight.root", "EGamma_SF2D" )],
                     }
 
+def clamp_array( x, low, high, low_value, high_value ):
+    ''' Array version of 'if x >= high: x = high_value; if x <= low: x = low_value'
+    '''
+    return np.where( x >= high, high_value, np.where( x <= low, low_value, x ) )
 
-class LeptonSF:
+class LeptonSF(object):
 
     def __init__(self, year=2016, ID=None):
 
         if year not in [ 2016, 2017, 2018 ]:
             raise Exception("Lepton SF for year %i not known"%year)
 
+        # ROOT is only needed if the maps are not loaded from the cache
+        from Analysis.Tools.helpers import getObjFromFile
+
         self.dataDir = "$CMSSW_BASE/src/Analysis/Tools/data/leptonSFData"
         self.year    = year
+        self.ID      = ID
+        self.cached  = False
 
         if year == 2016:
 
@@ -114,6 +124,8 @@ class LeptonSF:
 
             for effMap in self.mu_BCDEF + self.mu_GH + self.ele + self.mu_BCDEF_stat + self.mu_BCDEF_syst + self.mu_GH_stat + self.mu_GH_syst: assert effMap
 
+            mapNames = [ "mu_BCDEF", "mu_GH", "mu_BCDEF_stat", "mu_GH_stat", "mu_BCDEF_syst", "mu_GH_syst", "ele" ]
+
         elif year == 2017:
 
             if not ID in keys_mu2017.keys():
@@ -129,6 +141,8 @@ class LeptonSF:
 
             for effMap in self.mu + self.ele + self.mu_stat + self.mu_syst: assert effMap
 
+            mapNames = [ "mu", "mu_stat", "mu_syst", "ele" ]
+
         elif year == 2018:
 
             if not ID in keys_mu2018.keys():
@@ -144,6 +158,30 @@ class LeptonSF:
 
             for effMap in self.ele + self.mu + self.mu_stat + self.mu_syst: assert effMap
 
+            mapNames = [ "mu", "mu_stat", "mu_syst", "ele" ]
+
+        # numpy copies of all maps for getSF_array
+        self.lookups = { name: [ HistoLookup.fromHisto( effMap ) for effMap in getattr( self, name ) ] for name in mapNames }
+
+    def toCache( self, filename = None ):
+        ''' Write all maps to an SF cache file
+        '''
+        SFCache.write( filename if filename is not None else SFCache.cache_file( 'LeptonSF', self.year, self.ID ), self.lookups, meta = { 'year':self.year, 'ID':self.ID } )
+
+    @classmethod
+    def fromCache( cls, year=2016, ID=None, filename = None ):
+        ''' Construct from an SF cache file without ROOT. getSF is evaluated with getSF_array.
+        '''
+        lookups, meta = SFCache.load( filename if filename is not None else SFCache.cache_file( 'LeptonSF', year, ID ) )
+        if meta['year'] != year or meta['ID'] != ID:
+            raise ValueError( "SF cache is for year %i and ID %s." % ( meta['year'], meta['ID'] ) )
+        self = cls.__new__( cls )
+        self.year    = year
+        self.ID      = ID
+        self.cached  = True
+        self.lookups = lookups
+        return self
+
     def getPartialSF( self, effMap, pt, eta, reversed=False ):
         x = eta if not reversed else pt
         y = pt  if not reversed else eta
@@ -158,6 +196,9 @@ class LeptonSF:
 
     def getSF(self, pdgId, pt, eta, sigma=0, unc="nominal"):
 
+        if self.cached:
+            return float( self.getSF_array( [pdgId], [pt], [eta], sigma=sigma, unc=unc )[0] )
+
         if abs(pdgId) not in [11,13]:
             raise Exception("Lepton SF for PdgId %i not known"%pdgId)
 
@@ -235,6 +276,73 @@ class LeptonSF:
 
         return (1+sf.sigma*sigma)*sf.val
 
+    def getPartialSF_array( self, lookups, pt, eta, reversed=False ):
+        ''' Product of the maps in lookups with u_float error propagation. Returns ( val, sigma ) arrays.
+        '''
+        x = eta if not reversed else pt
+        y = pt  if not reversed else eta
+        sf = u_array( lookups[0].evaluate( x, y ) )
+        for lookup in lookups[1:]:
+            sf = sf*u_array( lookup.evaluate( x, y ) )
+        return sf.val, sf.sigma
+
+    def getSF_array(self, pdgId, pt, eta, sigma=0, unc="nominal", offsets=None):
+        ''' Vectorized version of getSF for arrays of leptons.
+            If offsets (length nEvents+1) are given, pdgId, pt and eta are flat jagged arrays and the product of the lepton SFs per event is returned.
+        '''
+
+        pdgId = np.abs( np.asarray( pdgId, dtype=int ) )
+        pt    = np.asarray( pt,  dtype=float )
+        eta   = np.asarray( eta, dtype=float )
+
+        isMu  = pdgId == 13
+        isEle = pdgId == 11
+
+        unknown = ~(isMu | isEle)
+        if np.any( unknown ):
+            raise Exception("Lepton SF for PdgId %i not known"%pdgId[unknown][0])
+
+        if not unc in ["nominal", "stat", "syst"]:
+            raise Exception("Don't know uncertainty %s"%unc)
+
+        if np.any( isEle ) and unc != "nominal":
+            raise Exception("Stat and syst uncertainty only implemented for muons")
+
+        postfix = "" if unc == "nominal" else "_"+unc
+        sf      = np.ones( pt.shape )
+
+        if np.any( isMu ):
+            pt_mu  = clamp_array( pt[isMu], 20, 120, 21, 119 )
+            eta_mu = eta[isMu]
+
+            if self.year == 2016:
+                eta_mu = clamp_array( eta_mu, -2.4, 2.4, -2.39, 2.39 )
+
+                val_BCDEF, err_BCDEF = self.getPartialSF_array( self.lookups["mu_BCDEF"+postfix], pt_mu, eta_mu )
+                val_GH,    err_GH    = self.getPartialSF_array( self.lookups["mu_GH"+postfix],    pt_mu, eta_mu )
+                val = val_BCDEF*lumiRatio2016_BCDEF + val_GH*lumiRatio2016_GH
+                err = np.sqrt( (err_BCDEF*lumiRatio2016_BCDEF)**2 + (err_GH*lumiRatio2016_GH)**2 )
+
+            else:
+                absEta_mu = np.where( np.abs( eta_mu ) >= 2.4, 2.39, np.abs( eta_mu ) )
+
+                val, err = self.getPartialSF_array( self.lookups["mu"+postfix], pt_mu, absEta_mu, reversed=True )
+
+            sf[isMu] = (1+err*sigma)*val
+
+        if np.any( isEle ):
+            pt_ele  = clamp_array( pt[isEle],  10,   500,   11,   499 )
+            eta_ele = clamp_array( eta[isEle], -2.5, 2.5, -2.49, 2.49 )
+
+            val, err = self.getPartialSF_array( self.lookups["ele"], pt_ele, eta_ele )
+
+            sf[isEle] = (1+err*sigma)*val
+
+        if offsets is not None:
+            return jagged_prod( sf, offsets )
+
+        return sf
+
 
 if __name__ == "__main__":
 
@@ -1,18 +1,21 @@
-import ROOT
 import os, math
 from Analysis.Tools.u_float import *
-from Analysis.Tools.helpers import getObjFromFile
+from Analysis.Tools.arrayHelpers import HistoLookup
+import Analysis.Tools.SFCache as SFCache
 
 # Logging
 import logging
 logger = logging.getLogger(__name__)
 
-class LeptonTrackingEfficiency:
+class LeptonTrackingEfficiency(object):
     def __init__(self, year=2016):
 
         if year not in [ 2016, 2017, 2018 ]:
             raise Exception("Lepton Reconstruction Eff for year %i not known"%year)
 
+        # ROOT is only needed if the maps are not loaded from the cache
+        from Analysis.Tools.helpers import getObjFromFile
+
         self.dataDir = "$CMSSW_BASE/src/Analysis/Tools/data/leptonSFData/"
         self.year = year
 
@@ -48,9 +51,39 @@ class LeptonTrackingEfficiency:
         self.e_etaMax      = self.e_sf.GetXaxis().GetXmax()
         self.e_etaMin      = self.e_sf.GetXaxis().GetXmin()
 
+        self.e_sf_lookup       = HistoLookup.fromHisto( self.e_sf )
+        self.e_sf_lowEt_lookup = HistoLookup.fromHisto( self.e_sf_lowEt )
+
         ## Muons
         # SFs are 1. https://hypernews.cern.ch/HyperNews/CMS/get/muon/1425/1.html
         
+    def toCache( self, filename = None ):
+        ''' Write the maps to an SF cache file
+        '''
+        SFCache.write( filename if filename is not None else SFCache.cache_file( 'LeptonTrackingEfficiency', self.year ), { 'e_sf':[ self.e_sf_lookup ], 'e_sf_lowEt':[ self.e_sf_lowEt_lookup ] }, meta = { 'year':self.year } )
+
+    @classmethod
+    def fromCache( cls, year=2016, filename = None ):
+        ''' Construct from an SF cache file without ROOT
+        '''
+        maps, meta = SFCache.load( filename if filename is not None else SFCache.cache_file( 'LeptonTrackingEfficiency', year ) )
+        if meta['year'] != year:
+            raise ValueError( "SF cache is for year %i." % meta['year'] )
+        self = cls.__new__( cls )
+        self.year              = year
+        self.e_sf              = None
+        self.e_sf_lowEt        = None
+        self.e_sf_lookup       = maps['e_sf'][0]
+        self.e_sf_lowEt_lookup = maps['e_sf_lowEt'][0]
+
+        etaEdges, ptEdges  = self.e_sf_lookup.edges
+        self.e_ptMax       = ptEdges[-1]
+        self.e_ptMin       = ptEdges[0]
+        self.e_ptMin_lowEt = self.e_sf_lowEt_lookup.edges[1][0]
+        self.e_etaMax      = etaEdges[-1]
+        self.e_etaMin      = etaEdges[0]
+        return self
+
     def getSF(self, pdgId, pt, eta, sigma=0):
 
         if abs(pdgId) == 11:
@@ -65,11 +98,14 @@ class LeptonTrackingEfficiency:
             if   pt >= self.e_ptMax:       pt = self.e_ptMax - 1 
             elif pt <= self.e_ptMin_lowEt: pt = self.e_ptMin_lowEt + 1
 
-            if pt <= self.e_ptMin: sf_hist = self.e_sf_lowEt
-            else:                  sf_hist = self.e_sf
+            if pt <= self.e_ptMin: sf_hist, sf_lookup = self.e_sf_lowEt, self.e_sf_lowEt_lookup
+            else:                  sf_hist, sf_lookup = self.e_sf,       self.e_sf_lookup
 
-            val    = sf_hist.GetBinContent( sf_hist.FindBin(eta, pt) )
-            valErr = sf_hist.GetBinError(   sf_hist.FindBin(eta, pt) )
+            if sf_hist is not None:
+                val    = sf_hist.GetBinContent( sf_hist.FindBin(eta, pt) )
+                valErr = sf_hist.GetBinError(   sf_hist.FindBin(eta, pt) )
+            else:
+                val, valErr = map( float, sf_lookup.evaluate( eta, pt ) )
             
             return val + sigma*valErr
 
@@ -1,18 +1,25 @@
 ''' Implementation of a directory based results DB for CMS analyses
     Supports merging and does not destroy afs volumes.
 
+    Every process appends to its own journal 'journal_<uuid>' with an index file 'journal_<uuid>.idx' (see IndexedDirDB).
+    A lookup only reads the (small) index files and opens at most one journal.
+    merge() appends the entries of all journals that were not merged before to 'journal_merged' without unpickling them.
+    Pickled dictionaries written by the previous implementation ('tmp_*' and 'merged') are still read and are folded in by merge().
 '''
 
 # Standard imports
 import os
 import pickle
-import uuid
+
+# Analysis
+from Analysis.Tools.DirDB        import key_digest
+from Analysis.Tools.IndexedDirDB import IndexedDirDB, complete_lines, parse_index
 
 # Logger
 import logging
 logger = logging.getLogger(__name__)
 
-# Try to read a result from a single file. 
+# Try to read a result from a single file.
 def read_from_file( f, key = None, forgiving = True):
     if os.path.exists( f ):
         try:
@@ -25,176 +32,175 @@ def read_from_file( f, key = None, forgiving = True):
                 return res
         except IOError:# Nothing found
             logger.warning( "Warning! Ignoring IOError when reading %s", f)
-            pass 
+            pass
         except ValueError:# It can be that we're loading from a tmp file that's currently being written. This gives 'ValueError: insecure string pickle'
             logger.warning( "Warning! Ignoring ValueError when reading %s", f)
             pass
         except EOFError:#same
             logger.warning( "Warning! Ignoring EOFError when reading %s", f)
-            pass 
+            pass
         except Exception as e: #something else wrong?
             logger.error( "Error reading file %s", f )
             if not forgiving:
                 raise e
     return None
 
-class MergingDirDB:
+class MergingDirDB(IndexedDirDB):
+
+    prefix = 'journal_'
+
     def __init__( self, directory, init_on_start = True):
         '''
-        Will create the directory if it doesn't exist 
+        Will create the directory if it doesn't exist
         '''
-        # work directory
-        self.directory = directory
-        # dictinary where the instance stores its unique 
+        IndexedDirDB.__init__( self, directory )
 
-        # create directory
-        if not os.path.isdir( self.directory ):
-            os.makedirs( self.directory ) 
-
-        # new data
-        self.data_dict = {}
-        # read all files when starting?
+        # data from the old pickled dictionaries, read once when needed
+        self.legacy_data = None
+        # read all old files when starting?
         if init_on_start:
-            self.data_on_disk_dict = self.data_from_all_files()
-        else:
-            self.data_on_disk_dict = {}
-
-        # make a unique pkl file to write for this process
-        self.unique_tmp_file = 'tmp_'+str(uuid.uuid4()) 
-
-## Let's try WITHOUT done/tmp for the moment
-#    def flush( self ):
-#        # Rename the current tmp_file to 'done_...' and make a new tmp file
-#        tmp_file  = os.path.join( self.directory, self.unique_tmp_file )
-#        
-#        done_file = os.path.join( self.directory, 'done_' + self.unique_tmp_file.lstrip('tmp_') )
-#
-#        if os.path.exists( tmp_file ):
-#            os.rename( tmp_file, done_file )
-#        
-#        self.unique_tmp_file = 'tmp_'+str(uuid.uuid4()) 
+            self.legacy()
+
+    def legacy( self ):
+        if self.legacy_data is None:
+            self.legacy_data = self.data_from_all_files()
+        return self.legacy_data
 
     def data_from_all_files( self ):
-        '''Read from all files in increasing order of unix time.'''
-        files = self.tmp_files()
-        if os.path.exists( self.merged_file() ):
-            files.append( self.merged_file() )
-        files = [ (f, os.path.getmtime(f)) for f in files ]
-        files.sort( key = lambda r:r[1] )
-        data = {} 
-        for f, _ in files:
+        '''Read from all pickled dictionaries ('tmp_*' and 'merged') that are not yet merged in increasing order of unix time.'''
+        data = {}
+        for f, _ in self.legacy_files( unmerged_only = True ):
             _data = read_from_file( f )
             if _data:
                 data.update(_data)
-                
-        return data
 
-    def add(self, key, data, overwrite=False):
-
-        if not overwrite:
-            if self.read_from_all_files(key) is not None:
-                logger.warning( "Already found key %r . Do not store data.", key )
-                return data
-
-        # Add data to private dictinary and store the file
-        self.data_dict[key] = data 
-        try:
-            with open(os.path.join( self.directory, self.unique_tmp_file), 'w') as _f:
-                pickle.dump( self.data_dict, _f )
-        except Exception as e:
-            logger.error( "Something wrong with file %s",  os.path.join( self.directory, self.unique_tmp_file) )
-            raise e
-        logger.debug( "Added key %r to file %s", key, os.path.join( self.directory, self.unique_tmp_file) )
         return data
 
-    def get(self, key):
-        ''' Get all entries in the database matching the provided key.
-        '''
-
-        if self.data_on_disk_dict.has_key( key ): return self.data_on_disk_dict[ key ]
-        if self.data_dict.has_key( key ): return self.data_dict[ key ]
-        # if we don't alread have the key, load it from all files and remember it in case you're asked again:
-        return self.read_from_all_files(key)
+    def get_many( self, keys ):
+        results = IndexedDirDB.get_many( self, keys )
+        for i_key, key in enumerate( keys ):
+            if results[i_key] is None and len(self.legacy())>0:
+                results[i_key] = self.legacy_data.get( key )
+        return results
 
     def contains(self, key):
         ''' Get all entries in the database matching the provided key.
         '''
-        return self.get(key) is not None
+        return IndexedDirDB.contains( self, key ) or self.legacy().has_key( key )
 
-    # Here we collect all files from other processes. 
+    # Here we collect all files from other processes written by the previous implementation.
     def tmp_files( self ):
         return [ os.path.join( self.directory, f ) for f in os.listdir(self.directory) if f.startswith( 'tmp_') ]
 
-    # Here we find  all files that are already merged.
-    # Merging should happen while NO jobs are running (because they are reading the merge file) 
+    # Here we find  all files that are already merged by the previous implementation.
     def merged_file( self ):
         merged_file = os.path.join( self.directory, 'merged' )
         return merged_file
 
+    def legacy_files( self, unmerged_only = False ):
+        files = self.tmp_files()
+        if os.path.exists( self.merged_file() ):
+            files.append( self.merged_file() )
+        files = [ (f, os.path.getmtime(f)) for f in files ]
+        if unmerged_only:
+            merged_legacy = self.merge_state().get( 'legacy', {} )
+            files = [ (f, t) for f, t in files if merged_legacy.get( os.path.basename(f) ) != t ]
+        files.sort( key = lambda r:r[1] )
+        return files
+
+    # Number of index bytes of each journal and modification time of each old pickle file that are already merged.
+    def merge_state_file( self ):
+        return os.path.join( self.directory, self.prefix + 'merged.state' )
+
+    def merge_state( self ):
+        if os.path.exists( self.merge_state_file() ):
+            return read_from_file( self.merge_state_file(), forgiving = False )
+        return {}
+
     def read_from_all_files( self, key ):
-        '''Read from all files that could possibly contain
-           the result and return the newest according to unix modification time'''
-        results = [] 
-        for f in self.tmp_files() + [self.merged_file()]:
-            result =  read_from_file( f, key )
-            if result is not None:
-                results.append( [ result, os.path.getmtime( f ) ] )
-        if len(results)==0: return None
-        results.sort( key = lambda r:r[1] )
-        if len(results)>1:
-            logger.warning( "Found %i results with different timestamp for key %r . Return newest.", len(results), key )
-        return results[-1][0]
-        
+        '''Return the newest result for key'''
+        self.update_index()
+        return self.get( key )
+
+    # Merging should happen while NO jobs are running
     def merge( self, clear = False):
-        if len(self.tmp_files())==0:
-            logger.info( "No tmp files, nothing to do.")
+        merged_segment = self.prefix + 'merged'
+
+        state = self.merge_state()
+        journals = sorted( f[:-len('.idx')] for f in os.listdir( self.directory ) if f.startswith( self.prefix ) and f.endswith( '.idx' ) and f != merged_segment + '.idx' )
+        # old pickled dictionaries are merged once, remember them with their modification time
+        merged_legacy = state.setdefault( 'legacy', {} )
+        legacy_files  = self.legacy_files( unmerged_only = True )
+
+        if len(journals)==0 and len(legacy_files)==0:
+            logger.info( "No journals, nothing to do.")
             return
-        if os.path.exists( self.merged_file() ):
-            f = self.merged_file()
-            result = None
-            if os.path.exists(f):
-                try:
-                    with open(f) as _f:
-                        result = pickle.load(_f)
-                except IOError:
-                    pass
-                except Exception as e:
-                    logger.error( "Error reading file %s", f )
-                    raise e
-        else:
-            result = {}
-        logger.info( 'Found %i keys in merged file.', len(result.keys()) )
-        # result will be 'None' if loading from an existing merge file failed.
-        # That will result in an error below which is what we want, because in that case we don't want to write anything
-        results = []
-        for f in self.tmp_files():
-            results.append( (f, os.path.getmtime( f )) )
-        results.sort( key = lambda r:r[1] )
-        for _result, _ in results:
-            try:
-                with open(_result) as _f:
-                    result.update( pickle.load(_f) )
-            except Exception as e:
-                logger.error( "Something wrong with file %s", _result)
-                raise e
-        try:
-            with open(self.merged_file(), 'w') as _f:
-                pickle.dump(result, _f)
-        except Exception as e:
-            logger.error( "Something wrong with file %s", self.merged_file() )
-            raise e
-        logger.info( 'Wrote %i keys to merged file.', len(result.keys()) )
-        
-        if clear and os.path.exists( self.merged_file() ):
-            try:
-                with open(self.merged_file()) as _f:
-                    pickle.load(_f)
-            except:
-                logger.error( "Could not load merged pickle file %s. Will not delete tmp files.",  self.merged_file() )
-                return
-            logger.info( "Merged pkl file %s seems OK, will delete tmp files.", self.merged_file() )
-            for f in self.tmp_files():
-                os.remove( f )
+
+        n_keys = 0
+        index_lines = []
+        with open( self.segment_file( merged_segment ), 'ab' ) as merged:
+            merged.seek( 0, os.SEEK_END )
+
+            def append( digest, pdata, t ):
+                index_lines.append( "%s %i %i %r\n" % ( digest, merged.tell(), len(pdata), t ) )
+                merged.write( pdata )
+
+            # old pickled dictionaries first, their entries are older than all journal entries
+            for f, t in legacy_files:
+                _data = read_from_file( f, forgiving = False )
+                if _data is None:
+                    logger.error( "Could not load %s. Will not merge.", f )
+                    raise IOError( "Could not load %s" % f )
+                for key, data in _data.iteritems():
+                    append( key_digest( key ), pickle.dumps( data, pickle.HIGHEST_PROTOCOL ), 0. )
+                n_keys += len(_data)
+                merged_legacy[os.path.basename(f)] = t
+
+            # only the part of the journals that was not merged before
+            for journal in journals:
+                position = state.get( journal, 0 )
+                with open( self.index_file( journal ) ) as _f:
+                    _f.seek( position )
+                    lines = complete_lines( _f.read() )
+                if len(lines)==0: continue
+                with open( self.segment_file( journal ), 'rb' ) as _f:
+                    for digest, offset, length, t in parse_index( lines ):
+                        _f.seek( offset )
+                        pdata = _f.read( length )
+                        if len(pdata) != length:
+                            raise IOError( "Journal %s is truncated." % journal )
+                        append( digest, pdata, t )
+                        n_keys += 1
+                state[journal] = position + len(lines)
+
+            # write the data before the index, readers must not see incomplete entries
+            merged.flush()
+            os.fsync( merged.fileno() )
+
+        with open( self.index_file( merged_segment ), 'a' ) as _f:
+            _f.writelines( index_lines )
+
+        logger.info( 'Merged %i entries from %i journals and %i old files.', n_keys, len(journals), len(legacy_files) )
+
+        if clear:
+            for journal in journals:
+                for f in [ self.segment_file( journal ), self.index_file( journal ) ]:
+                    if os.path.exists( f ):
+                        os.remove( f )
+                state.pop( journal, None )
+            for f, t in self.legacy_files():
+                if merged_legacy.get( os.path.basename(f) ) == t:
+                    os.remove( f )
+                    merged_legacy.pop( os.path.basename(f) )
+
+        with open( self.merge_state_file(), 'w' ) as _f:
+            pickle.dump( state, _f )
+
+        # journals might be gone, merged old files are now in the index
+        self.legacy_data = None
+        self.index = {}
+        self.index_positions = {}
+        self.update_index()
         return True
 
 if __name__ == "__main__":
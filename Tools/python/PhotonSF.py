@@ -1,19 +1,22 @@
-import ROOT
 import os
 
-from Analysis.Tools.helpers import getObjFromFile
 from Analysis.Tools.u_float import u_float
+from Analysis.Tools.arrayHelpers import HistoLookup
+import Analysis.Tools.SFCache as SFCache
 
 # Logging
 import logging
 logger = logging.getLogger(__name__)
 
-class PhotonSF:
+class PhotonSF(object):
     def __init__(self, year=2016):
 
         if year not in [ 2016, 2017, 2018 ]:
             raise Exception("Lepton SF for year %i not known"%year)
 
+        # ROOT is only needed if the map is not loaded from the cache
+        from Analysis.Tools.helpers import getObjFromFile
+
         self.year    = year
         self.dataDir = "$CMSSW_BASE/src/Analysis/Tools/data/photonSFData/"
 
@@ -38,6 +41,30 @@ class PhotonSF:
         self.g_etaMax = self.g_sf.GetXaxis().GetXmax()
         self.g_etaMin = self.g_sf.GetXaxis().GetXmin()
 
+        self.g_sf_lookup = HistoLookup.fromHisto( self.g_sf )
+
+    def toCache( self, filename = None ):
+        ''' Write the map to an SF cache file
+        '''
+        SFCache.write( filename if filename is not None else SFCache.cache_file( 'PhotonSF', self.year ), { 'g_sf':[ self.g_sf_lookup ] }, meta = { 'year':self.year } )
+
+    @classmethod
+    def fromCache( cls, year=2016, filename = None ):
+        ''' Construct from an SF cache file without ROOT
+        '''
+        maps, meta = SFCache.load( filename if filename is not None else SFCache.cache_file( 'PhotonSF', year ) )
+        if meta['year'] != year:
+            raise ValueError( "SF cache is for year %i." % meta['year'] )
+        self = cls.__new__( cls )
+        self.year        = year
+        self.g_sf        = None
+        self.g_sf_lookup = maps['g_sf'][0]
+
+        etaEdges, ptEdges = self.g_sf_lookup.edges
+        self.g_ptMax, self.g_ptMin   = ptEdges[-1],  ptEdges[0]
+        self.g_etaMax, self.g_etaMin = etaEdges[-1], etaEdges[0]
+        return self
+
     def getSF(self, pt, eta, sigma=0):
         if eta >= self.g_etaMax:
             logger.warning( "Photon eta out of bounds: %3.2f (need %3.2f <= eta <=% 3.2f)", eta, self.g_etaMin, self.g_etaMax )
@@ -49,8 +76,11 @@ class PhotonSF:
         if   pt >= self.g_ptMax: pt = self.g_ptMax - 1
         elif pt <= self.g_ptMin: pt = self.g_ptMin + 1
 
-        val    = self.g_sf.GetBinContent( self.g_sf.FindBin(eta, pt) )
-        valErr = self.g_sf.GetBinError(   self.g_sf.FindBin(eta, pt) )
+        if self.g_sf is not None:
+            val    = self.g_sf.GetBinContent( self.g_sf.FindBin(eta, pt) )
+            valErr = self.g_sf.GetBinError(   self.g_sf.FindBin(eta, pt) )
+        else:
+            val, valErr = map( float, self.g_sf_lookup.evaluate( eta, pt ) )
 
         return val + sigma*valErr
 
@@ -6,6 +6,7 @@
 import ROOT
 import array
 import uuid
+import numpy as np
 
 # Logger
 import logging
@@ -51,6 +52,63 @@ def interpolate( h, x):
     else:
         return h.GetBinContent(i)
 
+class Interpolator:
+    ''' Array copy of a TH1 for the vectorized evaluation of interpolate
+    '''
+
+    def __init__( self, h ):
+        axis           = h.GetXaxis()
+        self.nbins     = h.GetNbinsX()
+        self.xmin      = axis.GetXmin()
+        self.xmax      = axis.GetXmax()
+        self.variable  = axis.GetXbins().GetSize() > 0
+        self.lowEdges  = np.array( [ h.GetBinLowEdge(i) for i in range( 1, self.nbins+2 ) ] )
+        self.widths    = np.array( [ h.GetBinWidth(i)   for i in range( 1, self.nbins+1 ) ] )
+        self.contents  = np.array( [ h.GetBinContent(i) for i in range( self.nbins+2 ) ] )
+
+    def findBin( self, x ):
+        ''' As TAxis::FindBin, including the TMath::BinarySearch for variable bins
+        '''
+        x   = np.asarray( x, dtype = float )
+        res = np.empty( x.shape, dtype = int )
+        if self.variable:
+            # TMath::BinarySearch returns as soon as it hits an edge, which matters for repeated edges
+            nbelow = np.zeros( x.shape, dtype = int )
+            nabove = np.full( x.shape, len(self.lowEdges)+1, dtype = int )
+            found  = np.zeros( x.shape, dtype = bool )
+            active = np.ones( x.shape, dtype = bool )
+            while np.any( active ):
+                middle = (nabove+nbelow)//2
+                value  = self.lowEdges[middle-1]
+                hit    = active & ( x == value )
+                res[hit]   = middle[hit]
+                found     |= hit
+                active    &= ~hit
+                below      = x < value
+                nabove     = np.where( active & below,  middle, nabove )
+                nbelow     = np.where( active & ~below, middle, nbelow )
+                active    &= nabove-nbelow > 1
+            res[~found] = nbelow[~found]
+        else:
+            with np.errstate( invalid = 'ignore' ):
+                res = 1 + ( self.nbins*(x-self.xmin)/(self.xmax-self.xmin) ).astype( int )
+        res = np.where( x < self.xmin, 0, res )
+        return np.where( ~( x < self.xmax ), self.nbins+1, res )
+
+    def __call__( self, x ):
+        ''' interpolate( h, x ) for an array x
+        '''
+        x     = np.asarray( x, dtype = float )
+        i     = self.findBin( x )
+        inner = ( i>0 ) & ( i<=self.nbins )
+        i_    = np.where( inner, i, 1 )
+        dx    = x - self.lowEdges[i_-1]
+        # bins of the inverse CDF can have zero width, they are only used for dx = 0
+        with np.errstate( divide = 'ignore', invalid = 'ignore' ):
+            res = np.where( dx > 0., self.contents[i_] + dx/self.widths[i_-1]*(self.contents[i_+1] - self.contents[i_]), self.contents[i_] )
+        res   = np.where( i==0, 0., res )
+        return np.where( i>self.nbins, 1., res )
+
 class QuantileMatcher:
 
     def __init__( self, h1, h2, maxAbsU = None):
@@ -69,6 +127,10 @@ class QuantileMatcher:
         self.h2_cdf = get_cumulative(self.h2)
         self.h2_cdf_inv = transpose( self.h2_cdf )
 
+        # array copies for predict_array
+        self.h1_cdf_interpolator     = Interpolator( self.h1_cdf )
+        self.h2_cdf_inv_interpolator = Interpolator( self.h2_cdf_inv )
+
     def predict( self, u ):
         if self.maxAbsU is not None and abs(u) > self.maxAbsU:
             x = self.maxAbsU if u>0 else -self.maxAbsU 
@@ -79,6 +141,19 @@ class QuantileMatcher:
 
         return u+delta
 
+    def predict_array( self, u ):
+        ''' predict for an array of u
+        '''
+        u = np.asarray( u, dtype = float )
+        if self.maxAbsU is not None:
+            x = np.where( np.abs(u) > self.maxAbsU, np.where( u>0, self.maxAbsU, -self.maxAbsU ), u )
+        else:
+            x = u
+
+        delta = self.h2_cdf_inv_interpolator( self.h1_cdf_interpolator( x ) ) - x
+
+        return u+delta
+
     def prediction_histo( self, n_bins, u_low, h_high ):
         name = str(uuid.uuid4())
         h = ROOT.TH1D(name, name,  n_bins, u_low, h_high)
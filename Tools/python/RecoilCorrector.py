@@ -5,6 +5,7 @@
 import ROOT
 import array
 import pickle
+import numpy as np
 
 # Analysis
 from Analysis.Tools.QuantileMatcher import QuantileMatcher
@@ -35,6 +36,10 @@ class RecoilCorrector:
         self.para_matcher = { var_bin: {qt_bin: QuantileMatcher(self.correction_data[var_bin][qt_bin]['para']['mc']['TH1F'], self.correction_data[var_bin][qt_bin]['para']['data']['TH1F']) for qt_bin in self.qt_bins} for var_bin in self.var_bins } 
         self.perp_matcher = { var_bin: {qt_bin: QuantileMatcher(self.correction_data[var_bin][qt_bin]['perp']['mc']['TH1F'], self.correction_data[var_bin][qt_bin]['perp']['data']['TH1F']) for qt_bin in self.qt_bins} for var_bin in self.var_bins } 
 
+        # interval boundaries for the array versions
+        self.var_bin_edges = ( np.array( [ iv[0] for iv in self.var_bins ], dtype = float ), np.array( [ iv[1] for iv in self.var_bins ], dtype = float ) )
+        self.qt_bin_edges  = ( np.array( [ iv[0] for iv in self.qt_bins ],  dtype = float ), np.array( [ iv[1] for iv in self.qt_bins ],  dtype = float ) )
+
         logger.info( "Constructed para and perp matchers: %i var bins and %i qt bins", len(self.var_bins), len(self.qt_bins) )
 
     def var_bin( self, var ):
@@ -64,6 +69,60 @@ class RecoilCorrector:
             if qt>=iv[0] and qt<iv[1]:
                 return iv
 
+    @staticmethod
+    def __bin_index( edges, values ):
+        ''' Index of the (sorted, non-overlapping) interval for each value, -1 if there is none
+        '''
+        lows, highs = edges
+        i = np.searchsorted( lows, values, side = 'right' ) - 1
+        i_ = np.maximum( i, 0 )
+        return np.where( ( i>=0 ) & ( values < highs[i_] ), i, -1 )
+
+    def var_bin_index( self, var ):
+        ''' var_bin for an array, returns indices into self.var_bins (-1 if no interval is found)
+        '''
+        var = np.asarray( var, dtype = float )
+        # too low var: don't return interval
+        if np.any( var<self.min_var ):
+            raise ValueError("Value too low.")
+        # too high var: return last interval
+        var = np.where( var>=self.max_var, self.max_var-10**-3, var )
+        return self.__bin_index( self.var_bin_edges, var )
+
+    def qt_bin_index( self, qt ):
+        ''' qt_bin for an array, returns indices into self.qt_bins (-1 if no interval is found)
+        '''
+        qt = np.asarray( qt, dtype = float )
+        # too low qt: don't return interval
+        if np.any( qt<self.min_qt ):
+            raise ValueError("Value too low.")
+        # too high qt: return last interval
+        qt = np.where( qt>=self.max_qt, self.max_qt-1, qt )
+        return self.__bin_index( self.qt_bin_edges, qt )
+
+    def __predict_array( self, matcher, var, qt, u ):
+        var, qt, u = np.broadcast_arrays( *[ np.asarray( x, dtype = float ) for x in ( var, qt, u ) ] )
+        i_var = self.var_bin_index( var )
+        i_qt  = self.qt_bin_index( qt )
+
+        # nan where predict_para/predict_perp return None
+        res   = np.full( u.shape, np.nan )
+        index = np.where( ( i_var>=0 ) & ( i_qt>=0 ), i_var*len(self.qt_bins) + i_qt, -1 )
+        for i in np.unique( index[index>=0] ):
+            sel = index==i
+            res[sel] = matcher[self.var_bins[i//len(self.qt_bins)]][self.qt_bins[i%len(self.qt_bins)]].predict_array( u[sel] )
+        return res
+
+    def predict_para_array(self, var, qt, u_para ):
+        ''' predict_para for arrays of var, qt and u_para
+        '''
+        return self.__predict_array( self.para_matcher, var, qt, u_para )
+
+    def predict_perp_array(self, var, qt, u_perp ):
+        ''' predict_perp for arrays of var, qt and u_perp
+        '''
+        return self.__predict_array( self.perp_matcher, var, qt, u_perp )
+
     def predict_para(self, var, qt, u_para ):
         var_bin   = self.var_bin( var )
         qt_bin = self.qt_bin( qt )
@@ -43,87 +43,126 @@ class DBopen(object):
         self.conn.close()
 
 class ResultsDB:
-    def __init__( self, database, tableName, columns ):
+    def __init__( self, database, tableName, columns, readOnly = False ):
         '''
         Will create a table with name tableName, with the provided columns (as a list) and two additional columns: value and time_stamp
+        An index over the key columns and the time_stamp is created together with the table.
+        A readOnly instance never creates or modifies anything, e.g. for batch jobs that only look up results.
         '''
         self.database_file = database
         self.tableName     = tableName
-        self.columns       = self.clean( columns )
-        self.columns       = self.columns + [ "value" ]
+        self.keyColumns    = self.clean( columns )
+        self.columns       = self.keyColumns + [ "value" ]
         self.columnString  = ", ".join([ s + " text" for s in self.columns ])
+        self.readOnly      = readOnly
+
+        # One connection per process, established when needed
+        self.conn     = None
+        self.conn_pid = None
+
+        if self.readOnly: return
 
-        self.connect()
         try:
-            with self.conn:
-                ''' Use context manager for connections. Closes the connection on exit.
+            conn = self.connection()
+            with conn:
+                ''' Use context manager for connections. Commits on exit.
                 '''
                 executeString = '''CREATE TABLE %s (%s, time_stamp real )'''%(self.tableName, self.columnString)
                 try:
-                    self.conn.execute( executeString )
+                    conn.execute( executeString )
                     # try to aviod database malform problems
-                    self.conn.execute('''PRAGMA journal_mode = DELETE''') # WAL doesn't work on network filesystems
-                    self.conn.execute('''PRAGMA synchronus = 2''')
+                    conn.execute('''PRAGMA journal_mode = DELETE''') # WAL doesn't work on network filesystems
+                    conn.execute('''PRAGMA synchronus = 2''')
                 except sqlite3.OperationalError:
                     # Doesn't really matter if that doesn't work.
                     logger.debug( "Table already exists." )
                 except sqlite3.DatabaseError:
                     logger.debug( "Concurrency problem. Table should already exist." )
+                # Also adds the index to tables that were created without it
+                try:
+                    conn.execute( '''CREATE INDEX IF NOT EXISTS %s_key ON %s (%s, time_stamp)'''%(self.tableName, self.tableName, ", ".join( self.keyColumns ) ) )
+                except sqlite3.DatabaseError:
+                    logger.debug( "Could not create index." )
         except:
             pass
-        self.close()
 
     def clean(self, columns):
         return [ c for c in columns ]
-    
+
+    def checkWritable(self):
+        if self.readOnly:
+            raise RuntimeError( "Database %s is opened read-only."%self.database_file )
+
     def dropTable(self):
+        self.checkWritable()
         executeString = '''DROP TABLE %s'''%self.tableName
-        self.connect()
-        with self.conn:
-            self.conn.execute(executeString)
+        conn = self.connection()
+        with conn:
+            conn.execute(executeString)
 
     def connect(self):
         ''' only establish the connection when needed, not when resultsDB object is created
         '''
-        self.conn = sqlite3.connect(self.database_file)
-    
+        self.conn     = sqlite3.connect(self.database_file)
+        self.conn_pid = os.getpid()
+        if self.readOnly:
+            self.conn.execute('''PRAGMA query_only = ON''')
+
+    def connection(self):
+        ''' The connection of the current process. Connections must not be shared with forked processes.
+        '''
+        if self.conn is None or self.conn_pid != os.getpid():
+            self.connect()
+        return self.conn
+
     def cursor(self):
         self.cursor = self.database.cursor()
 
     def close(self):
-        ''' Not really needed anymore if all connections are handled with context manager
+        if self.conn is not None and self.conn_pid == os.getpid():
+            self.conn.close()
+        self.conn = None
+
+    def transaction(self, function, what):
+        ''' Call function(conn) within a single transaction. Retries if the database is locked.
+            Returns None if the transaction did not succeed.
         '''
-        self.conn.close()
-        del self.conn
-        
-    def getObjects(self, key):
-        ''' Get all entries in the database matching the provided key.
+        for i in range(100):
+            try:
+                conn = self.connection()
+                with conn:
+                    return function(conn)
+            except sqlite3.OperationalError:
+                logger.debug("OE: Locked (%s).", what)
+            except sqlite3.DatabaseError:
+                logger.debug("DE: Locked (%s).", what)
+                # start over with a new connection
+                self.close()
+            time.sleep(0.01)
+        return None
+
+    def selection(self, key):
+        ''' WHERE clause with placeholders and the corresponding parameters.
+            Columns are ordered as in the table, hence the same statement is used for all keys with the same columns.
+            Values are compared as text, as they are stored.
         '''
-        columns = self.clean(key.keys()+["value", "time_stamp"])
-        selection = " AND ".join([ "%s = '%s'"%(k, key[k]) for k in key.keys() ])
+        columns = [ c for c in self.columns if c in key ] + sorted( c for c in key.keys() if c not in self.columns )
+        return " AND ".join([ "%s = ?"%c for c in columns ]), tuple( "%s"%key[c] for c in columns )
 
+    def select(self, conn, key):
+        selection, parameters = self.selection(key)
         selectionString = "SELECT * FROM {} ".format(self.tableName) + " WHERE {} ".format(selection) + " ORDER BY time_stamp"
+        return conn.execute(selectionString, parameters).fetchall()
 
+    def getObjects(self, key):
+        ''' Get all entries in the database matching the provided key.
+        '''
         logger.debug("Trying to read")
-        for i in range(100):
-            self.connect()
-            try:
-                with self.conn:
-                    try:
-                        obj = self.conn.execute(selectionString)
-                        objs = [o for o in obj]
-                        if len(objs) > 0:
-                            logger.debug("Reading successfull.")
-                        return objs
-                    except sqlite3.OperationalError:
-                        logger.debug("OE: Locked (reading).")
-                    except sqlite3.DatabaseError:
-                        logger.debug("DE: Locked (reading).")
-                time.sleep(0.01)
-            except:
-                pass
-            self.close()
-        return False
+        objs = self.transaction( lambda conn: self.select(conn, key), "reading" )
+        if objs is None: return False
+        if len(objs) > 0:
+            logger.debug("Reading successfull.")
+        return objs
 
     def getDicts(self, key):
         objs = self.getObjects(key)
@@ -168,135 +207,118 @@ class ResultsDB:
         except IndexError:
             return 0
 
-    def get(self, key, plain=False):
-        '''  Careful! This method only returns the newest entry in the database that's matching the key. This is not necessarily a unique match!
+    def decode(self, value, plain=False):
+        ''' Convert a stored value. Long values are pickled objects, short ones are u_floats.
         '''
-        logger.debug("Getting only the newest entry in the database matching the key. You should know what you're doing here.")
-        objs = self.getDicts(key)
-        if not plain:
-            if objs:
-                if len(objs[-1]["value"]) > 50:
-                    try:
-                        return cPickle.loads(objs[-1]["value"])
-                    except:
-                        return False
-                else:
-                    try:
-                        return u_float.fromString(objs[-1]["value"])
-                    except IndexError:
-                        return False
-            else:
+        value = str(value)
+        if plain:
+            return value
+        if len(value) > 50:
+            try:
+                return cPickle.loads(value)
+            except:
                 return False
         else:
             try:
-                return objs[-1]["value"]
-            except:
+                return u_float.fromString(value)
+            except IndexError:
                 return False
 
-    def addData(self, key, data, overwrite):
-        ''' add binary data to a databse as blob
+    def get(self, key, plain=False):
+        '''  Careful! This method only returns the newest entry in the database that's matching the key. This is not necessarily a unique match!
         '''
-        if overwrite and self.contains(key):
-            self.removeObjects(key)
+        logger.debug("Getting only the newest entry in the database matching the key. You should know what you're doing here.")
+        objs = self.getDicts(key)
+        if not objs:
+            return False
+        return self.decode(objs[-1]["value"], plain=plain)
 
+    def getMany(self, keys, plain=False):
+        ''' Like get for a list of keys, read within a single transaction. Returns False for keys that are not found.
+        '''
+        objs = self.transaction( lambda conn: [ self.select(conn, key) for key in keys ], "reading" )
+        if objs is None:
+            return [ False for key in keys ]
+        return [ self.decode(o[-1][self.columns.index("value")], plain=plain) if o else False for o in objs ]
+
+    def insertion(self, key, value):
+        ''' INSERT statement with placeholders and the corresponding parameters.
+        '''
         columns = self.clean(key.keys()+["value"])
         if not sorted(columns) == sorted(self.columns):
             raise(ValueError("The columns don't match the table. Use the following: %s"%", ".join(self.columns)))
-        
-        columns += ["time_stamp"]
-        pdata = cPickle.dumps(data, cPickle.HIGHEST_PROTOCOL)
-        values  = key.values()
-        
+
         # check if number of columns matches. By default, there is no error if not, but better be save than sorry.
         if len(key.keys())+1 < len(self.columns):
             raise(ValueError("The length of the given key doesn't match the number of columns in the table. The following columns (excluding value and time_stamp) are part of the table: %s"%", ".join(self.columns)))
-        
-        selectionString = "INSERT INTO {} ".format(self.tableName) + " ({}) ".format(", ".join( columns )) + " VALUES ({}".format(", ".join([ "'%s'"%i for i in values ])) + ", :data, '%s')"%time.time()
-        
-        for i in range(100):
-            self.connect()
-            try:
-                with self.conn:
-                    try:
-                        self.conn.execute(selectionString, (sqlite3.Binary(pdata),))
-                        logger.info("Added data to database.")
-                        return data
-                    except sqlite3.OperationalError:
-                        logger.debug("OE: Locked (writing data).")
-                    except sqlite3.DatabaseError:
-                        logger.debug("DE: Locked (writing data).")
-                time.sleep(0.01)
-            except:
-                pass
-            self.close()
+
+        columns = self.columns + ["time_stamp"]
+        selectionString = "INSERT INTO {} ".format(self.tableName) + " ({}) ".format(", ".join( columns )) + " VALUES ({})".format(", ".join( "?" for c in columns ))
+        return selectionString, tuple( "%s"%key[c] for c in self.keyColumns ) + ( value, time.time() )
+
+    def remove(self, conn, key):
+        selection, parameters = self.selection(key)
+        conn.execute("DELETE FROM {} ".format(self.tableName) + " WHERE {} ".format(selection), parameters)
+
+    def addData(self, key, data, overwrite):
+        ''' add binary data to a databse as blob
+        '''
+        self.checkWritable()
+        selectionString, parameters = self.insertion(key, sqlite3.Binary(cPickle.dumps(data, cPickle.HIGHEST_PROTOCOL)))
+
+        def write(conn):
+            if overwrite:
+                self.remove(conn, key)
+            conn.execute(selectionString, parameters)
+            return True
+
+        if self.transaction( write, "writing data" ):
+            logger.info("Added data to database.")
+            return data
 
     def add(self, key, value, overwrite, overwriteOldest=False):
         ''' new DB structure. key needs to be a python dictionary. Overwrite removes all previous entries found under the key.
         '''
+        self.checkWritable()
+        logger.debug("Trying to write")
+        selectionString, parameters = self.insertion(key, str(value))
 
-        if overwrite and self.contains(key):
-            logger.info("Overwriting old result.")
-            self.removeObjects(key)
+        def write(conn):
+            if overwrite:
+                self.remove(conn, key)
+            conn.execute(selectionString, parameters)
+            return True
 
-        logger.debug("Trying to write")
-        columns = self.clean(key.keys()+["value"])
-        if not sorted(columns) == sorted(self.columns):
-            raise(ValueError("The columns don't match the table. Use the following: %s"%", ".join(self.columns)))
-        
-        columns += ["time_stamp"]
-        values  = key.values()+[str(value), time.time()]
-        
-        # check if number of columns matches. By default, there is no error if not, but better be save than sorry.
-        if len(key.keys())+1 < len(self.columns):
-            raise(ValueError("The length of the given key doesn't match the number of columns in the table. The following columns (excluding value and time_stamp) are part of the table: %s"%", ".join(self.columns)))
+        if self.transaction( write, "writing" ):
+            logger.info("Added value %s to database",value)
+            return value
+
+    def addMany(self, entries, overwrite):
+        ''' Add a list of (key, value) within a single transaction. Values are stored like in add.
+        '''
+        self.checkWritable()
+        insertions = [ (key, self.insertion(key, str(value))) for key, value in entries ]
 
-        selectionString = "INSERT INTO {} ".format(self.tableName) + " ({}) ".format(", ".join( columns )) + " VALUES ({})".format(", ".join([ "'%s'"%i for i in values ]))
+        def write(conn):
+            for key, (selectionString, parameters) in insertions:
+                if overwrite:
+                    self.remove(conn, key)
+                conn.execute(selectionString, parameters)
+            return True
 
-        for i in range(100):
-            self.connect()
-            try:
-                with self.conn:
-                    try:
-                        self.conn.execute(selectionString)
-                        logger.info("Added value %s to database",value)
-                        return value
-                    except sqlite3.OperationalError:
-                        logger.debug("OE: Locked (writing).")
-                    except sqlite3.DatabaseError:
-                        logger.debug("DE: Locked (writing).")
-                time.sleep(0.01)
-            except:
-                pass
-#            return value
-            self.close()
-                
+        if self.transaction( write, "writing" ):
+            logger.info("Added %i values to database", len(insertions))
+            return [ value for key, value in entries ]
 
     def removeObjects(self, key):
         ''' Remove entries matching the key. Careful when not all columns are specified!
         '''
-        selection = " AND ".join([ "%s = '%s'"%(k, key[k]) for k in key.keys() ])
-
-        selectionString = "DELETE FROM {} ".format(self.tableName) + " WHERE {} ".format(selection)
-        for i in range(100):
-            self.connect()
-            try:
-                with self.conn:
-                    try:
-                        self.conn.execute(selectionString)
-                        return
-                    except sqlite3.OperationalError:
-                        logger.debug("OE: Locked (removing).")
-                    except sqlite3.DatabaseError:
-                        logger.debug("DE: Locked (removing).")
-                time.sleep(0.01)
-            except:
-                pass
-            self.close()
-        return False
-
+        self.checkWritable()
+        if self.transaction( lambda conn: self.remove(conn, key) or True, "removing" ) is None:
+            return False
 
     def resetDatabase(self):
+        self.close()
         if os.path.isfile(self.database_file):
             os.remove(self.database_file)
-        self.__init__(self.database_file)
-
+        self.__init__(self.database_file, self.tableName, self.keyColumns, readOnly = self.readOnly)
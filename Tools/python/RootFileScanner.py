@@ -0,0 +1,225 @@
+''' Parallel and incremental integrity check of ROOT files.
+
+The checks of helpers.checkRootFile, helpers.deepCheckRootFile and helpers.deepCheckWeight run in a few long lived worker processes.
+ROOT is loaded once per worker instead of once per file. A file that crashes its worker is reported as broken and the worker is restarted.
+A worker that does not finish a file within the timeout is killed and restarted, the file is reported as broken ("timeout") but not stored in the ledger.
+Results are stored in a ledger (IndexedDirDB) keyed by path, size and modification time; unchanged files are not checked again.
+Remote files (e.g. root://) have no size and modification time and are only identified by their path.
+
+Usage:
+    scanner = RootFileScanner( ledger = '/path/to/ledger', nJobs = 8 )
+    for filename, good, reason in scanner.scan( files ):
+        ...
+'''
+
+# Standard imports
+import os
+import sys
+import json
+import select
+import tempfile
+import threading
+import subprocess
+import Queue
+
+# Analysis
+from Analysis.Tools.IndexedDirDB import IndexedDirDB
+
+# Logging
+import logging
+logger = logging.getLogger(__name__)
+
+# all checks in the order they are applied
+all_checks = [ 'open', 'map', 'weight' ]
+
+def file_key( filename, treeName, checks ):
+    ''' Ledger key: path, size and modification time
+    '''
+    if os.path.exists( filename ):
+        stat = os.stat( filename )
+        return ( os.path.abspath( filename ), stat.st_size, stat.st_mtime, treeName, tuple( checks ) )
+    return ( filename, None, None, treeName, tuple( checks ) )
+
+def check_file( filename, treeName = "Events", checks = all_checks, mapLog = os.devnull ):
+    ''' Run the checks on a single file. Returns ( good, reason ).
+        Loads ROOT, hence should run in a worker process.
+        As for helpers.deepCheckWeight, a file without weight branch is not good ("no weight").
+    '''
+    import ROOT
+    from math import isnan
+
+    rf = ROOT.TFile.Open( filename )
+    if not rf:
+        return False, "open"
+    try:
+        if rf.IsZombie() or rf.TestBit(ROOT.TFile.kRecovered):
+            return False, "open"
+        if treeName is not None and not rf.GetListOfKeys().Contains( treeName ):
+            return False, "no %s" % treeName
+
+        if 'map' in checks:
+            # TFile::Map prints the keys, a corrupt basket stops the printout before the KeysList
+            start = os.path.getsize( mapLog ) if os.path.exists( mapLog ) else 0
+            ROOT.gSystem.RedirectOutput( mapLog, "a" )
+            rf.Map()
+            ROOT.gSystem.RedirectOutput( 0 )
+            with open( mapLog ) as f:
+                f.seek( start )
+                if "KeysList" not in f.read():
+                    return False, "map"
+
+        if 'weight' in checks:
+            tree = rf.Get( treeName )
+            if not tree.GetBranch( "weight" ):
+                return False, "no weight"
+            h = ROOT.TH1D( "h_weight", "h_weight", 1, 0, 2 )
+            tree.Draw( "1>>h_weight", "weight", "goff" )
+            val = h.GetSumOfWeights()
+            h.Delete()
+            if isnan( val ):
+                return False, "weight is nan"
+    finally:
+        rf.Close()
+
+    return True, ""
+
+def map_log( pid, mapLogDir ):
+    return os.path.join( mapLogDir, 'rootFileScanner_%i.log' % pid )
+
+def worker( treeName, checks, mapLogDir ):
+    ''' Check the files read from stdin, write one json line per file.
+        Anything else ROOT prints is sent to stderr.
+    '''
+    results = os.fdopen( os.dup( sys.stdout.fileno() ), 'w' )
+    os.dup2( sys.stderr.fileno(), sys.stdout.fileno() )
+
+    mapLog = map_log( os.getpid(), mapLogDir )
+    try:
+        for line in iter( sys.stdin.readline, '' ):
+            filename = line.rstrip('\n')
+            try:
+                good, reason = check_file( filename, treeName = treeName, checks = checks, mapLog = mapLog )
+            except Exception as e:
+                good, reason = False, "exception: %s" % e
+            results.write( json.dumps( [ filename, good, reason ] ) + '\n' )
+            results.flush()
+            # do not let the log grow
+            if os.path.exists( mapLog ) and os.path.getsize( mapLog ) > 10**7:
+                os.remove( mapLog )
+    finally:
+        if os.path.exists( mapLog ):
+            os.remove( mapLog )
+
+class RootFileScanner:
+
+    def __init__( self, ledger = None, nJobs = 4, treeName = "Events", checks = all_checks, timeout = 600, mapLogDir = None ):
+        '''
+        ledger:    directory of the ledger. No ledger if None.
+        nJobs:     number of worker processes
+        treeName:  tree that must be present in the files
+        checks:    subset of 'open', 'map', 'weight'
+        timeout:   time in seconds a worker may spend on a single file. No timeout if None.
+        mapLogDir: directory of the temporary output of TFile::Map, default is the system temporary directory
+        '''
+        for check in checks:
+            if check not in all_checks:
+                raise ValueError( "Unknown check %s. Use %s." % ( check, ", ".join( all_checks ) ) )
+        self.ledger    = IndexedDirDB( ledger ) if ledger is not None else None
+        self.nJobs     = nJobs
+        self.treeName  = treeName
+        self.checks    = [ check for check in all_checks if check in checks ]
+        self.timeout   = timeout
+        self.mapLogDir = mapLogDir if mapLogDir is not None else tempfile.gettempdir()
+
+    def start_worker( self ):
+        cmd = [ sys.executable, '-c', 'from Analysis.Tools.RootFileScanner import worker; worker(%r, %r, %r)' % ( self.treeName, self.checks, self.mapLogDir ) ]
+        return subprocess.Popen( cmd, stdin = subprocess.PIPE, stdout = subprocess.PIPE, stderr = open( os.devnull, 'w' ) )
+
+    def stop_worker( self, proc, kill = False ):
+        if kill:
+            if proc.poll() is None: proc.kill()
+        else:
+            proc.stdin.close()
+        proc.wait()
+        if os.path.exists( map_log( proc.pid, self.mapLogDir ) ):
+            os.remove( map_log( proc.pid, self.mapLogDir ) )
+
+    def read_result( self, proc ):
+        ''' Result line of the worker, None after the timeout
+        '''
+        if self.timeout is not None:
+            ready, _, _ = select.select( [ proc.stdout ], [], [], self.timeout )
+            if not ready: return None
+        return proc.stdout.readline()
+
+    def run_worker( self, files, results ):
+        ''' Feed files to a worker process, restart it if it dies.
+        '''
+        proc = None
+        while True:
+            try:
+                filename = files.get_nowait()
+            except Queue.Empty:
+                break
+            if proc is None:
+                proc = self.start_worker()
+            try:
+                proc.stdin.write( filename + '\n' )
+                proc.stdin.flush()
+                line = self.read_result( proc )
+            except IOError:
+                line = ''
+            if line is None:
+                # the worker hangs on this file
+                results.put( ( filename, False, "timeout" ) )
+                self.stop_worker( proc, kill = True )
+                proc = None
+            elif line:
+                results.put( tuple( json.loads( line ) ) )
+            else:
+                # the worker crashed on this file
+                results.put( ( filename, False, "crash" ) )
+                self.stop_worker( proc, kill = True )
+                proc = None
+        if proc is not None:
+            self.stop_worker( proc )
+
+    def scan( self, filenames, recheck = False ):
+        ''' Yield ( filename, good, reason ) for all files. Results from the ledger come first, the others as they are available.
+        '''
+        files    = Queue.Queue()
+        keys     = {}
+        n_queued = 0
+        for filename in filenames:
+            key = file_key( filename, self.treeName, self.checks )
+            if self.ledger is not None and not recheck and self.ledger.contains( key ):
+                good, reason = self.ledger.get( key )
+                yield filename, good, reason
+            else:
+                keys[filename] = key
+                files.put( filename )
+                n_queued += 1
+
+        if n_queued == 0: return
+        logger.info( "Checking %i files in %i processes.", n_queued, self.nJobs )
+
+        results = Queue.Queue()
+        threads = [ threading.Thread( target = self.run_worker, args = ( files, results ) ) for i in range( min( self.nJobs, n_queued ) ) ]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        for i in range( n_queued ):
+            filename, good, reason = results.get()
+            # exceptions and timeouts can be temporary, e.g. for remote files
+            if self.ledger is not None and not ( reason.startswith( "exception" ) or reason == "timeout" ):
+                self.ledger.add( keys[filename], ( good, reason ), overwrite = True )
+            yield filename, good, reason
+
+        for thread in threads:
+            thread.join()
+
+    def broken( self, filenames, recheck = False ):
+        ''' List of ( filename, reason ) of the broken files
+        '''
+        return [ ( filename, reason ) for filename, good, reason in self.scan( filenames, recheck = recheck ) if not good ]
@@ -0,0 +1,107 @@
+''' Binary cache of scale factor maps for fast, ROOT-free construction of the SF classes.
+
+A cache file holds named lists of HistoLookups (bin edges, contents and errors) and plain arrays, plus a small json header.
+The data are stored as float64 at aligned offsets and are memory mapped on load, i.e. all jobs on a node share the same pages.
+Files are written once with the toCache methods of the SF classes (see Tools/scripts/compileSFCache.py) and loaded with fromCache.
+
+File layout:
+    MAGIC | header length (8 bytes, little endian) | json header | padding | float64 data
+'''
+
+# Standard imports
+import os
+import json
+import uuid
+import struct
+import numpy as np
+
+# Analysis
+from Analysis.Tools.arrayHelpers import HistoLookup
+
+# Logging
+import logging
+logger = logging.getLogger(__name__)
+
+MAGIC = 'SFCACHE1'
+# data offsets are multiples of the alignment (in bytes)
+alignment = 64
+
+defaultDirectory = "$CMSSW_BASE/src/Analysis/Tools/data/sfCache/"
+
+def cache_file( name, *args ):
+    ''' Default file name of the cache of an SF class, e.g. cache_file( 'LeptonSF', 2016, 'tight' )
+    '''
+    return os.path.expandvars( os.path.join( defaultDirectory, '_'.join( map( str, ( name, ) + args ) ) + '.sfc' ) )
+
+def write( filename, maps, meta = None ):
+    ''' Write maps { name: [ HistoLookup or np.ndarray, ... ] } and a json serializable meta dictionary.
+    '''
+    blocks = []
+    def add( array ):
+        array = np.ascontiguousarray( array, dtype = '<f8' )
+        offset = sum( len( b ) for b in blocks )
+        blocks.append( array.tostring() )
+        # pad each block to the alignment
+        blocks.append( '\0'*( -len( blocks[-1] ) % alignment ) )
+        return [ offset, list( array.shape ) ]
+
+    header = { 'meta': meta if meta is not None else {}, 'maps': {} }
+    for name, entries in maps.iteritems():
+        header['maps'][name] = []
+        for entry in entries:
+            if isinstance( entry, HistoLookup ):
+                header['maps'][name].append( { 'type':'histo', 'edges':[ add( e ) for e in entry.edges ], 'contents':add( entry.contents ), 'errors':add( entry.errors ) } )
+            else:
+                header['maps'][name].append( { 'type':'array', 'data':add( entry ) } )
+
+    header = json.dumps( header )
+    start  = len( MAGIC ) + 8 + len( header )
+    start += -start % alignment
+
+    directory = os.path.dirname( filename )
+    if directory and not os.path.isdir( directory ):
+        os.makedirs( directory )
+
+    # write to a temporary file and move, jobs must not read incomplete files
+    tmp_filename = filename + '.' + str(uuid.uuid4())
+    with open( tmp_filename, 'wb' ) as f:
+        f.write( MAGIC )
+        f.write( struct.pack( '<Q', len( header ) ) )
+        f.write( header )
+        f.write( '\0'*( start - len( MAGIC ) - 8 - len( header ) ) )
+        for block in blocks:
+            f.write( block )
+    os.rename( tmp_filename, filename )
+    logger.info( "Written SF cache %s", filename )
+
+# files loaded in this process
+_loaded = {}
+
+def load( filename ):
+    ''' Returns ( maps, meta ). The arrays are read only views of a memory map of the file.
+    '''
+    filename = os.path.abspath( os.path.expandvars( filename ) )
+    stat = os.stat( filename )
+    key  = ( filename, stat.st_mtime, stat.st_size )
+    if key in _loaded:
+        return _loaded[key]
+
+    with open( filename, 'rb' ) as f:
+        if f.read( len( MAGIC ) ) != MAGIC:
+            raise ValueError( "%s is not an SF cache file." % filename )
+        length = struct.unpack( '<Q', f.read( 8 ) )[0]
+        header = json.loads( f.read( length ) )
+    start  = len( MAGIC ) + 8 + length
+    start += -start % alignment
+
+    data = np.memmap( filename, dtype = '<f8', mode = 'r', offset = start )
+    def get( entry ):
+        offset, shape = entry
+        return data[ offset//8 : offset//8 + int( np.prod( shape ) ) ].reshape( shape )
+
+    maps = {}
+    for name, entries in header['maps'].iteritems():
+        maps[str(name)] = [ HistoLookup( [ get( e ) for e in entry['edges'] ], get( entry['contents'] ), get( entry['errors'] ) ) if entry['type'] == 'histo' else get( entry['data'] ) for entry in entries ]
+
+    _loaded[key] = ( maps, header['meta'] )
+    return _loaded[key]
@@ -209,6 +209,39 @@ class WeightInfo:
 
         return coeffs
 
+    # Get the coefficients from sample by looping over events as array
+    @staticmethod
+    def getCoeffArrayFromEvents( sample, selectionString = None, weightFunction = None ):
+        ''' Create an array of shape ( nEvents, max(np) ) of the p_C coefficients of each event, padded with zeros.
+        '''
+        # RootTools
+        from RootTools.core.standard             import TreeVariable, VectorTreeVariable
+
+        sample.setSelectionString( selectionString ) 
+
+        variables = map( TreeVariable.fromString, [ "np/I", "ref_lumiweight1fb/F", "lumiweight1fb/F" ] )
+        variables.append( VectorTreeVariable.fromString('p[C/F]', nMax=1000) )
+
+        reader = sample.treeReader( variables = variables )
+        reader.start()
+
+        rows    = []
+        weights = []
+        while reader.run():
+            n = reader.event.np
+            rows.append( np.fromiter( ( reader.event.p_C[i] for i in xrange(n) ), dtype = float, count = n ) )
+            if weightFunction is not None:
+                weights.append( weightFunction( reader.event, sample ) )
+
+        coeffs = np.zeros( ( len(rows), max( map( len, rows ) ) if len(rows)>0 else 0 ) )
+        for i_row, row in enumerate( rows ):
+            coeffs[i_row, :len(row)] = row
+
+        if weightFunction is not None:
+            coeffs *= np.array( weights )[:, np.newaxis]
+
+        return coeffs
+
     # getFisherInformationHisto is still in testing phase!!!!
     def getFisherInformationHisto( self, sample, variableString, binning, selectionString = None, weightString = None, variables = None, nEventsThresh = 0, **kwargs ):
         ''' Create a histogram showing the fisher information for each bin of the given kinematic distribution
@@ -373,6 +406,42 @@ class WeightInfo:
 
         return lambda event, sample: sum( event.p_C[term[0]]*term[1] for term in terms )
 
+    def get_weight_matrix( self, points, var = () ):
+        ''' Return the matrix of shape ( nPoints, nCoeff ) such that its product with the p_C coefficients 
+            gives the weights (or the derivatives wrt var, which can be a variable or a tuple of variables) at all points.
+            Points are given as a list of kwargs (WC) dictionaries.
+        '''
+        if type(var)==type(""): var = (var,)
+        for v in var:
+            if v not in self.variables:
+                raise ValueError( "Variable %s not in gridpack: %r" % ( v, self.variables ) ) 
+
+        # coordinates wrt to the ref-point, shape ( nPoints, nvar )
+        coordinates = np.empty( ( len(points), self.nvar ) )
+        for i_point, point in enumerate( points ):
+            kwargs = dict( point )
+            self.set_default_args( kwargs )
+            coordinates[i_point] = [ float(kwargs[v]) - self.ref_point_coordinates[v] for v in self.variables ]
+
+        matrix = np.zeros( ( len(points), len(self.combinations) ) )
+        for i_comb, comb in enumerate( self.combinations ):
+            prefac, diff_comb = WeightInfo.differentiate( comb, var )
+            if prefac == 0: continue
+            matrix[:, i_comb] = prefac*np.prod( coordinates[:, [ self.variables.index( v ) for v in diff_comb ]], axis = 1 )
+
+        return matrix
+
+    def get_weight_array( self, coeffs, points, var = () ):
+        ''' Compute the weights (or derivatives wrt var) for an array of p_C coefficients of shape ( nEvents, nCoeff ) at all points (list of kwargs).
+            Returns an array of shape ( nEvents, nPoints ).
+        '''
+        coeffs = np.asarray( coeffs, dtype = float )
+        ncomb  = len(self.combinations)
+        if coeffs.shape[-1] < ncomb:
+            raise ValueError( "Need at least %i coefficients. Got %i." % ( ncomb, coeffs.shape[-1] ) )
+        # coefficients of higher order than self.order are ignored
+        return np.dot( coeffs[..., :ncomb], self.get_weight_matrix( points, var = var ).T )
+
     def get_total_weight_yield( self, coeffLists, **kwargs ):
         '''compute yield from a list of coefficients (in the usual order of p_C) using the kwargs as WC
         '''
@@ -466,14 +535,77 @@ class WeightInfo:
 
         return variables, fi_matrix
 
-    def get_total_fisherInformation_matrix( self, coeffLists, variables = None, **kwargs ):
+    def get_total_fisherInformation_matrix( self, coeffLists, variables = None, chunk_size = None, **kwargs ):
         ''' return the full fisher information matrix, sum the FI matrices over all coefflists
         '''
 
-        fi_matrix = np.sum( [ self.get_fisherInformation_matrix( coeffList, variables, **kwargs )[1] for coeffList in coeffLists if not all([ v == 0 for v in coeffList ]) ], 0 )
+        # If no argument given, provide all
+        if variables is None: variables = self.variables
+
+        coeffs = coeff_array( coeffLists, len(self.combinations) )
+        f, d1, d2 = self.get_derivative_tensors( variables, **kwargs )
+
+        fi_matrix = np.zeros( ( len(variables), len(variables) ) )
+        for chunk in chunks( coeffs, chunk_size ):
+            weight_yield      = np.dot( chunk, f )
+            diff_weight_yield = np.dot( chunk, d1.T )
+            inverse           = inverse_or_zero( weight_yield )
+            fi_matrix += np.einsum( 'n,ni,nj->ij', inverse, diff_weight_yield, diff_weight_yield )
 
         return variables, fi_matrix
 
+    def get_derivative_tensors( self, variables, **kwargs ):
+        ''' Return the coefficient vector of the weight (nCoeff), its first derivatives wrt variables (nVar, nCoeff) 
+            and its second derivatives (nVar, nVar, nCoeff) at the point specified by kwargs.
+            Contracting with the p_C coefficients gives the weight yield and its derivatives.
+        '''
+        prefac0, exp0, prefac1, exp1, prefac2, exp2 = self.derivative_exponents( tuple( variables ) )
+
+        # add the arguments from the ref-point 
+        self.set_default_args( kwargs )
+        coordinates = np.array( [ float(kwargs[v]) - self.ref_point_coordinates[v] for v in self.variables ] )
+
+        # monomials prefac * prod_v coordinate_v**exponent_v; 0**0 = 1
+        return tuple( prefac*np.prod( coordinates**exponents, axis = -1 ) for prefac, exponents in [ (prefac0, exp0), (prefac1, exp1), (prefac2, exp2) ] )
+
+    def derivative_exponents( self, variables ):
+        ''' Prefactors and exponents of all variables of the weight coefficients and their first and second derivatives wrt variables. 
+            Computed once per set of variables.
+        '''
+        if not hasattr( self, "_derivative_exponents" ):
+            self._derivative_exponents = {}
+        if variables in self._derivative_exponents:
+            return self._derivative_exponents[variables]
+
+        for var in variables:
+            if var not in self.variables:
+                raise ValueError( "Variable %s not in gridpack: %r" % ( var, self.variables ) ) 
+
+        def exponents( diff ):
+            prefac    = np.zeros( len(self.combinations) )
+            exponents = np.zeros( ( len(self.combinations), self.nvar ) )
+            for i_comb, comb in enumerate( self.combinations ):
+                prefac[i_comb], diff_comb = WeightInfo.differentiate( comb, diff )
+                if prefac[i_comb] == 0: continue
+                exponents[i_comb] = [ diff_comb.count( v ) for v in self.variables ]
+            return prefac, exponents
+
+        nvar = len(variables)
+        prefac0, exp0 = exponents( () )
+        prefac1 = np.zeros( ( nvar, len(self.combinations) ) )
+        exp1    = np.zeros( ( nvar, len(self.combinations), self.nvar ) )
+        prefac2 = np.zeros( ( nvar, nvar, len(self.combinations) ) )
+        exp2    = np.zeros( ( nvar, nvar, len(self.combinations), self.nvar ) )
+        for i, var_i in enumerate( variables ):
+            prefac1[i], exp1[i] = exponents( (var_i,) )
+            for j, var_j in enumerate( variables ):
+                if j < i:
+                    prefac2[i,j], exp2[i,j] = prefac2[j,i], exp2[j,i]
+                else:
+                    prefac2[i,j], exp2[i,j] = exponents( (var_i, var_j) )
+
+        self._derivative_exponents[variables] = ( prefac0, exp0, prefac1, exp1, prefac2, exp2 )
+        return self._derivative_exponents[variables]
 
     def matrix_to_string( self, variables, matrix ):
         ''' return the matrix in a terminal visualization string (print)
@@ -521,7 +653,7 @@ class WeightInfo:
 #        return variables, fi_matrix
 
 
-    def get_christoffels( self, coeffLists, variables = None): 
+    def get_christoffels( self, coeffLists, variables = None, chunk_size = None): 
         ''' Compute christoffel symbols Gamma^i_jk for coefflist in 
             subspace spanned by variables at the point specified by kwargs
 
@@ -531,41 +663,67 @@ class WeightInfo:
         # Restrict to subspace
         _variables = self.variables if variables is None else variables
 
+        coeffs = coeff_array( coeffLists, len(self.combinations) )
+
         # Define a function that accepts an index and a position
         def christoffel_symbols( index, position ):
             ''' Compute christoffel i at position in parameter space'''
-            # Metric and Metric-inverse in subspace
-            ## Make kwargs dict from position
-            kwargs_        = {_variables[i_p]:p for i_p,p in enumerate(position)} 
-            metric         = self.get_total_fisherInformation_matrix( coeffLists, variables = _variables, **kwargs_ ) [1]
-            metric_inverse = scipy.linalg.inv( metric ) 
-
-            # 3D zeros
-            christoffel = np.zeros( (len(_variables), len(_variables) ) )
-
-            for coeffList in coeffLists:
-                weight_yield       = self.get_weight_yield( coeffList, **kwargs_ )
-                if weight_yield == 0.: continue
-                #print "weight_yield", weight_yield
-                diff_weight_yield  =  { i_var:self.get_diff_weight_yield( var, coeffList, **kwargs_ ) for i_var, var in enumerate(_variables) }
-                diff2_weight_yield = { (i_var_1, i_var_2):self.get_diff_weight_yield( (var_1, var_2), coeffList, **kwargs_ ) for i_var_1, var_1 in enumerate(_variables) for i_var_2, var_2 in enumerate(_variables) }
-                for l in xrange(len(_variables)):
-                    gil = metric_inverse[index][l]
-                    #print "i,l,gil",i,l,gil
-                    if gil==0.: continue
-                    #print index, gil, dg[index] 
-                    for j in range(len(_variables)):
-                        for k in range(len(_variables)):
-                            d_christoffel_jk = gil*( -0.5/weight_yield**2*diff_weight_yield[l]*diff_weight_yield[j]*diff_weight_yield[k] + 1./weight_yield*diff_weight_yield[l]*diff2_weight_yield[(j,k)] )
-                            if j==k:
-                                christoffel[j][k] += d_christoffel_jk 
-                            elif j>k:
-                                christoffel[j][k] += d_christoffel_jk 
-                                christoffel[k][j] += d_christoffel_jk
-
-            return christoffel
+            return self.get_christoffel_tensor( coeffs, _variables, position, chunk_size = chunk_size )[index]
+
         return christoffel_symbols 
 
+    def get_christoffel_tensor( self, coeffs, variables, position, chunk_size = None ):
+        ''' Compute all christoffel symbols Gamma^i_jk as array of shape ( nVar, nVar, nVar ) at position in the subspace spanned by variables
+            for an array of coefficients of shape ( nEvents, nCoeff )
+        '''
+        ## Make kwargs dict from position
+        kwargs_ = {variables[i_p]:p for i_p,p in enumerate(position)} 
+        f, d1, d2 = self.get_derivative_tensors( variables, **kwargs_ )
+
+        nvar   = len(variables)
+        metric = np.zeros( ( nvar, nvar ) )
+        # Sum over events of -0.5/lambda^2 (dl lambda)(dj lambda)(dk lambda) + 1/lambda (dl lambda)(dj dk lambda)
+        connection = np.zeros( ( nvar, nvar, nvar ) )
+        for chunk in chunks( coeff_array( coeffs, len(self.combinations) ), chunk_size ):
+            weight_yield       = np.dot( chunk, f )
+            diff_weight_yield  = np.dot( chunk, d1.T )
+            diff2_weight_yield = np.einsum( 'nc,jkc->njk', chunk, d2 )
+            inverse            = inverse_or_zero( weight_yield )
+
+            metric     += np.einsum( 'n,ni,nj->ij', inverse, diff_weight_yield, diff_weight_yield )
+            connection += -0.5*np.einsum( 'n,nl,nj,nk->ljk', inverse**2, diff_weight_yield, diff_weight_yield, diff_weight_yield ) 
+            connection += np.einsum( 'n,nl,njk->ljk', inverse, diff_weight_yield, diff2_weight_yield )
+
+        # Metric-inverse in subspace
+        metric_inverse = scipy.linalg.inv( metric ) 
+
+        return np.einsum( 'il,ljk->ijk', metric_inverse, connection )
+
+# Array of shape ( nEvents, ncomb ) from a list or array of coefficient lists. Higher orders are ignored, missing coefficients are zero. 
+def coeff_array( coeffLists, ncomb ):
+    if isinstance( coeffLists, np.ndarray ) and coeffLists.ndim == 2:
+        if coeffLists.shape[1] >= ncomb:
+            return coeffLists[:, :ncomb]
+    res = np.zeros( ( len(coeffLists), ncomb ) )
+    for i_coeffList, coeffList in enumerate( coeffLists ):
+        n = min( ncomb, len(coeffList) )
+        res[i_coeffList, :n] = coeffList[:n]
+    return res
+
+# Iterate over chunks of chunk_size rows (all at once if chunk_size is None)
+def chunks( array, chunk_size = None ):
+    if chunk_size is None:
+        yield array
+    else:
+        for start in xrange( 0, len(array), chunk_size ):
+            yield array[start:start+chunk_size]
+
+# 1/x, zero where x is zero
+def inverse_or_zero( x ):
+    res = np.zeros_like( x )
+    np.divide( 1., x, out = res, where = x!=0 )
+    return res
+
 # Make a list from the bin contents from a histogram that resulted from a 'Draw' of p_C 
 def histo_to_list( histo ):
     return [ histo.GetBinContent(i) for i in range( 1, histo.GetNbinsX() + 1 ) ]
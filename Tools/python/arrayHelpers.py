@@ -0,0 +1,82 @@
+''' Numpy helpers for columnar evaluation of histogram based weights.
+    Does not import ROOT. Histograms are only accessed through their methods when converted.
+'''
+
+# Standard imports
+import numpy as np
+
+# Logging
+import logging
+logger = logging.getLogger(__name__)
+
+def histo_to_arrays( histo ):
+    ''' Extract bin edges, contents and errors of a TH1/TH2 including under- and overflow bins.
+        Returns ( edges, contents, errors ) where edges is a tuple with one array per axis.
+    '''
+    axes = [ histo.GetXaxis() ]
+    if histo.GetDimension() == 2:
+        axes.append( histo.GetYaxis() )
+    elif histo.GetDimension() != 1:
+        raise ValueError( "Only 1D and 2D histograms are supported. Got %i dimensions." % histo.GetDimension() )
+
+    edges = tuple( np.array( [ axis.GetBinLowEdge(i) for i in range( 1, axis.GetNbins() + 2 ) ] ) for axis in axes )
+    shape = tuple( axis.GetNbins() + 2 for axis in axes )
+
+    contents = np.empty( shape )
+    errors   = np.empty( shape )
+    for index in np.ndindex( *shape ):
+        contents[index] = histo.GetBinContent( *index )
+        errors[index]   = histo.GetBinError( *index )
+
+    return edges, contents, errors
+
+class HistoLookup:
+    ''' Array copy of a TH1/TH2 for vectorized bin lookups.
+        Bin numbering follows TH1::FindBin, i.e. 0 is the underflow and nbins+1 the overflow bin.
+    '''
+
+    def __init__( self, edges, contents, errors = None ):
+        self.edges    = tuple( np.asarray( e, dtype = float ) for e in edges )
+        self.contents = np.asarray( contents, dtype = float )
+        self.errors   = np.asarray( errors, dtype = float ) if errors is not None else np.zeros_like( self.contents )
+
+        if self.contents.shape != tuple( len(e) + 1 for e in self.edges ):
+            raise ValueError( "Contents of shape %r do not match %i bin edges (including under- and overflow)." % ( self.contents.shape, len(self.edges) ) )
+
+    @classmethod
+    def fromHisto( cls, histo ):
+        return cls( *histo_to_arrays( histo ) )
+
+    def findBin( self, *coordinates ):
+        ''' Return a tuple with the bin index along each axis
+        '''
+        if len(coordinates) != len(self.edges):
+            raise ValueError( "Histogram has %i dimensions. Got %i coordinates." % ( len(self.edges), len(coordinates) ) )
+        return tuple( np.searchsorted( e, np.asarray( x, dtype = float ), side = 'right' ) for e, x in zip( self.edges, coordinates ) )
+
+    def getBinContent( self, *coordinates ):
+        return self.contents[ self.findBin( *coordinates ) ]
+
+    def getBinError( self, *coordinates ):
+        return self.errors[ self.findBin( *coordinates ) ]
+
+    def evaluate( self, *coordinates ):
+        ''' Return ( contents, errors ) for arrays of coordinates
+        '''
+        index = self.findBin( *coordinates )
+        return self.contents[index], self.errors[index]
+
+def jagged_prod( values, offsets ):
+    ''' Product of values per event for a flat array with event offsets of length nEvents+1.
+        Events without entries get 1.
+    '''
+    values  = np.asarray( values )
+    offsets = np.asarray( offsets, dtype = int )
+    if offsets[-1] != len(values):
+        raise ValueError( "Last offset %i does not match length of values %i." % ( offsets[-1], len(values) ) )
+
+    res      = np.ones( len(offsets) - 1, dtype = values.dtype if values.dtype.kind == 'f' else float )
+    nonEmpty = np.diff( offsets ) > 0
+    if np.any( nonEmpty ):
+        res[nonEmpty] = np.multiply.reduceat( values, offsets[:-1][nonEmpty] )
+    return res
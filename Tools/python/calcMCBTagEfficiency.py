@@ -4,100 +4,123 @@ import ROOT
 import pickle
 import time
 import hashlib
+import numpy as np
 
 # Analysis Imports
 from Analysis.Tools.BTagEfficiency import *
 
-def getBTagMCTruthEfficiencies( c, cut="(1)", overwrite=False, btagVar='Jet_btagCSVV2', btagWP='0.8484', etaBins=[] ):
-    print c, cut
-
-    etaBorders = sorted( list( set( sum( etaBins, [] ) ) ) )
-
-    mceff = {}
-    commoncf = cut + "&&"
-
-    for ptBin in ptBins:
-        mceff[ tuple(ptBin) ] = {}
-        for etaBin in etaBins:
-            mceff[ tuple(ptBin) ][ tuple(etaBin) ] = {}
-            etaCut = "abs(Jet_eta)>" + str(etaBin[0]) + "&&abs(Jet_eta)<" + str(etaBin[1])
-            ptCut  = "Jet_pt>" + str(ptBin[0])
-
-            if ptBin[1]>0:
-                ptCut += "&&Jet_pt<"+str(ptBin[1])
-            c.Draw(commoncf+"("+btagVar+">"+str(btagWP)+")>>hbQuark(100,-1,2)",commoncf+"abs(Jet_hadronFlavour)==5&&                     "+etaCut+"&&"+ptCut)
-            c.Draw(commoncf+"("+btagVar+">"+str(btagWP)+")>>hcQuark(100,-1,2)",commoncf+"abs(Jet_hadronFlavour)==4&&                     "+etaCut+"&&"+ptCut)
-            c.Draw(commoncf+"("+btagVar+">"+str(btagWP)+")>>hOther(100,-1,2)" ,commoncf+"(abs(Jet_hadronFlavour) < 4  || abs(Jet_hadronFlavour) > 5)&&  "+etaCut+"&&"+ptCut)
-            hbQuark = ROOT.gDirectory.Get("hbQuark")
-            hcQuark = ROOT.gDirectory.Get("hcQuark")
-            hOther = ROOT.gDirectory.Get("hOther")
-            mceff[tuple(ptBin)][tuple(etaBin)]["b"]     = hbQuark.GetMean()
-            mceff[tuple(ptBin)][tuple(etaBin)]["c"]     = hcQuark.GetMean()
-            mceff[tuple(ptBin)][tuple(etaBin)]["other"] = hOther.GetMean()
-
-            print "Eta",etaBin,etaCut,"Pt",ptBin,ptCut,"Found b/c/other", mceff[tuple(ptBin)][tuple(etaBin)]["b"], mceff[tuple(ptBin)][tuple(etaBin)]["c"], mceff[tuple(ptBin)][tuple(etaBin)]["other"]
-
-            del hbQuark, hcQuark, hOther
-
-    if overwrite: pickle.dump( mceff, file(bTagEffFile, 'w') )
+def getBTagMCTruthEfficiencies( c, cut="(1)", overwrite=False, btagVar='Jet_btagCSVV2', btagWP='0.8484', etaBins=[], bTagEffFile=None, nJobs=1 ):
+    ''' Efficiencies of a single tagger, same as getBTagMCTruthEfficiencies2D. Written to bTagEffFile if overwrite is set.
+    '''
+    mceff = getBTagMCTruthEfficiencies2D( c, cut=cut, btagVar=btagVar, btagWP=btagWP, etaBins=etaBins, nJobs=nJobs )
+    if overwrite:
+        if bTagEffFile is None:
+            raise ValueError( "No bTagEffFile to write the efficiencies to." )
+        pickle.dump( mceff, file( bTagEffFile, 'w' ) )
     return mceff
 
-def getBTagMCTruthEfficiencies2D( c, cut="(1)", overwrite=False, btagVar='Jet_btagCSVV2', btagWP='0.8484', etaBins=[] ):
-
-    from array import array
+def getBTagMCTruthEfficiencies2D( c, cut="(1)", overwrite=False, btagVar='Jet_btagCSVV2', btagWP='0.8484', etaBins=[], nJobs=1 ):
+    return getBTagMCTruthEfficienciesMulti( c, cut=cut, taggers={btagVar:(btagVar, btagWP)}, etaBins=etaBins, nJobs=nJobs )[btagVar]
+
+flavors = ['b', 'c', 'other']
+
+def getFlavorIndex( hadronFlavour ):
+    ''' b -> 0, c -> 1, other -> 2
+    '''
+    hadronFlavour = np.abs( hadronFlavour )
+    return np.where( hadronFlavour==5, 0, np.where( hadronFlavour==4, 1, 2 ) )
+
+def getDrawArray( tree, i, n ):
+    v = getattr( tree, "GetV%i"%i )()
+    v.SetSize( n )
+    return np.frombuffer( v, dtype=np.float64, count=n ).copy()
+
+def fillBTagCounts( args ):
+    ''' Count jets in bins of flavor, pt and abs(eta) for a single file. Underflow and overflow bins are included.
+        Returns passed counts of shape ( nTaggers, nFlavors, nPt+1, nEta+1 ) and total counts of shape ( nFlavors, nPt+1, nEta+1 ).
+        All taggers are evaluated in the same TTree::Draw, their decisions are packed in the bits of a single column.
+    '''
+    filename, treeName, cut, btagCuts, etaBorders, chunkSize = args
+
+    passed = np.zeros( ( len(btagCuts), len(flavors), len(ptBorders)+1, len(etaBorders)+1 ) )
+    total  = np.zeros( ( len(flavors), len(ptBorders)+1, len(etaBorders)+1 ) )
+
+    f = ROOT.TFile.Open( filename )
+    if not f or f.IsZombie():
+        raise IOError( "Could not open %s" % filename )
+    tree = f.Get( treeName )
+
+    bits      = "+".join( "%i*(%s>%s)"%( 2**i_tagger, btagVar, btagWP ) for i_tagger, (btagVar, btagWP) in enumerate( btagCuts ) )
+    varexp    = "Jet_pt:abs(Jet_eta):Jet_hadronFlavour:%s"%bits
+    selection = ' && '.join("(%s)"%x for x in [cut, "Jet_jetId>0"])
+
+    # one row per jet, read the events in chunks to bound the memory
+    maxJets = max( 1, int( tree.GetMaximum("nJet") ) )
+    tree.SetEstimate( chunkSize*maxJets + 1 )
+    for firstEntry in xrange( 0, tree.GetEntries(), chunkSize ):
+        n = tree.Draw( varexp, selection, "goff", chunkSize, firstEntry )
+        if n <= 0: continue
+        pt, eta, hadronFlavour, tagged = [ getDrawArray( tree, i, n ) for i in range(1,5) ]
+
+        flavor = getFlavorIndex( hadronFlavour )
+        ptBin  = np.searchsorted( ptBorders, pt, side='right' )
+        etaBin = np.searchsorted( etaBorders, eta, side='right' )
+        np.add.at( total, ( flavor, ptBin, etaBin ), 1 )
+        tagged = tagged.astype( np.int64 )
+        for i_tagger in range( len(btagCuts) ):
+            isTagged = ( ( tagged >> i_tagger ) & 1 ) == 1
+            np.add.at( passed[i_tagger], ( flavor[isTagged], ptBin[isTagged], etaBin[isTagged] ), 1 )
+
+    f.Close()
+    return passed, total
+
+def getBTagMCTruthEfficienciesMulti( c, cut="(1)", taggers={}, etaBins=[], nJobs=1, chunkSize=100000 ):
+    ''' Efficiencies for all flavors and all taggers in a single pass over the events.
+        taggers is a dictionary { name:( btagVar, btagWP ) }, returns { name:mceff }.
+        The files of the chain are processed in nJobs processes.
+    '''
 
     etaBorders = sorted( list( set( sum( etaBins, [] ) ) ) )
 
-    mceff = {}
-    c.SetEventList(0)
-
-    if cut and cut.replace(" ","")!= "(1)":
-        print "Setting Event List with cut: %s"%cut
-        eListName = "eList_%s"%hashlib.md5("%s"%time.time()).hexdigest()
-        print eListName
-        print cut
-        c.Draw(">>%s"%eListName,cut)
-        c.SetEventList( getattr(ROOT,eListName))
-
-    passed_hists = {}
-    total_hists = {}
-    ratios = {}
-
-    btag_var = btagVar
-    btag_wp  = btagWP
-
-    jet_quality_cut = "Jet_jetId>0"
-    
-    flavor_cuts = {
-                        'b':'abs(Jet_hadronFlavour)==5', 
-                        'c':'abs(Jet_hadronFlavour)==4',      
-                        'other':'(abs(Jet_hadronFlavour) < 4  || abs(Jet_hadronFlavour) > 5)', 
-                   }
-   
-    flavors = flavor_cuts.keys()
- 
-    for flavor in flavors:
-        print "flavor", flavor
-        passed_name = 'passed_%s'%flavor
-        passed_hists[flavor] = ROOT.TH2D( passed_name, passed_name , len(ptBorders)-1, array('d',ptBorders), len(etaBorders)-1, array('d', etaBorders) )
-        total_name = 'total_%s'%flavor
-        total_hists[flavor] = ROOT.TH2D( total_name, total_name , len(ptBorders)-1, array('d',ptBorders), len(etaBorders)-1, array('d', etaBorders) )
-        c.Draw("abs(Jet_eta):Jet_pt>>%s"%passed_name, ' && '.join("(%s)"%x for x in [cut,jet_quality_cut, flavor_cuts[flavor], '%s>%s'%(btag_var, btag_wp)]))
-        c.Draw("abs(Jet_eta):Jet_pt>>%s"%total_name, ' && '.join("(%s)"%x for x in [cut,jet_quality_cut, flavor_cuts[flavor] ]))
-        ratios[flavor] = passed_hists[flavor].Clone("ratio_%s"%flavor)
-        ratios[flavor].Divide( total_hists[flavor]) 
-
-    for ipt, ptBin in enumerate( ptBins ,1):
-        print "ptBin", ipt
-        mceff[tuple(ptBin)]={}
-        for jeta, etaBin in enumerate( etaBins ,1):
-            mceff[tuple(ptBin)][tuple(etaBin)] = {}
-            for flavor in flavors:
-                mceff[tuple(ptBin)][tuple(etaBin)][flavor] = ratios[flavor].GetBinContent(ipt, jeta)
-
-            print "Eta",etaBin,"Pt",ptBin,"Found b/c/other", mceff[tuple(ptBin)][tuple(etaBin)]["b"], mceff[tuple(ptBin)][tuple(etaBin)]["c"], mceff[tuple(ptBin)][tuple(etaBin)]["other"]
-
-    return mceff
+    names    = taggers.keys()
+    btagCuts = [ taggers[name] for name in names ]
+
+    filenames = [ f.GetTitle() for f in c.GetListOfFiles() ]
+    if len(filenames) == 0:
+        raise ValueError( "No files in chain %s, can't compute b-tag efficiencies." % c.GetName() )
+    jobs = [ ( filename, c.GetName(), cut, btagCuts, etaBorders, chunkSize ) for filename in filenames ]
+    print "Counting jets in %i files for %s" % ( len(filenames), ", ".join( names ) )
+
+    if nJobs > 1:
+        from multiprocessing import Pool
+        pool = Pool( processes = nJobs )
+        results = pool.map( fillBTagCounts, jobs )
+        pool.close()
+        pool.join()
+    else:
+        results = map( fillBTagCounts, jobs )
+
+    passed = sum( r[0] for r in results )
+    total  = sum( r[1] for r in results )
+
+    # zero for empty bins, like TH1::Divide
+    ratios = np.zeros_like( passed )
+    np.divide( passed, total[np.newaxis], out = ratios, where = total[np.newaxis]!=0 )
+
+    res = {}
+    for i_tagger, name in enumerate( names ):
+        mceff = {}
+        for ipt, ptBin in enumerate( ptBins ,1):
+            mceff[tuple(ptBin)]={}
+            for jeta, etaBin in enumerate( etaBins ,1):
+                mceff[tuple(ptBin)][tuple(etaBin)] = {}
+                for i_flavor, flavor in enumerate( flavors ):
+                    mceff[tuple(ptBin)][tuple(etaBin)][flavor] = ratios[i_tagger, i_flavor, ipt, jeta]
+
+                print name, "Eta",etaBin,"Pt",ptBin,"Found b/c/other", mceff[tuple(ptBin)][tuple(etaBin)]["b"], mceff[tuple(ptBin)][tuple(etaBin)]["c"], mceff[tuple(ptBin)][tuple(etaBin)]["other"]
+        res[name] = mceff
+
+    return res
 
 def writeToFile( mcEff, filename ):
     print "write to file: ", filename
@@ -113,7 +136,9 @@ if __name__ == "__main__":
         import argparse
         argParser = argparse.ArgumentParser(description = "Argument parser")
         argParser.add_argument('--overwrite', action='store_true',                                help="Overwrite existing output files")
-        argParser.add_argument('--year',      action='store', type=int, choices=[2016,2017,2018], help="Overwrite existing output files")
+        argParser.add_argument('--year',      action='store', type=int, choices=[2016,2017,2018], default=[2016,2017,2018], nargs='+', help="Which years?")
+        argParser.add_argument('--taggers',   action='store', choices=['CSVv2', 'DeepB', 'DeepFlavB'], default=['DeepFlavB'], nargs='+', help="Which taggers?")
+        argParser.add_argument('--nJobs',     action='store', type=int, default=1, help="Number of processes")
         return argParser
 
     options = get_parser().parse_args()
@@ -125,65 +150,27 @@ if __name__ == "__main__":
     from Samples.Tools.config import redirector_global, redirector
     redirector = redirector
 
-
-    if options.year == 2016:
-    # 2016
-        from Samples.nanoAOD.Summer16_private_legacy_v1 import TTLep_pow as tt16
-        #res = getBTagMCTruthEfficiencies2D( tt16.chain, cut=preSel, overwrite=options.overwrite, btagVar='Jet_btagCSVV2', btagWP='0.8484', etaBins=etaBins2016 )
-        #print "Efficiencies 2016:"
-        #print res
-        #print
-        #writeToFile ( res, "TTLep_pow_2016_2j_2l_CSVv2_eta" )
-
-        #res = getBTagMCTruthEfficiencies2D( tt16.chain, cut=preSel, overwrite=options.overwrite, btagVar='Jet_btagDeepB', btagWP='0.6324', etaBins=etaBins2016 )
-        #print "Efficiencies 2016:"
-        #print res
-        #print
-        #writeToFile ( res, "TTLep_pow_2016_2j_2l_DeepB_eta_v2" )
-
-        res = getBTagMCTruthEfficiencies2D( tt16.chain, cut=preSel, overwrite=options.overwrite, btagVar='Jet_btagDeepFlavB', btagWP='0.3093', etaBins=etaBins2016 )
-        print "Efficiencies 2016:"
-        print res
-        print
-        writeToFile ( res, "TTLep_pow_2016_2j_2l_DeepFlavB_eta_v2" )
-
-    elif options.year == 2017:
-    # 2017
-        from Samples.nanoAOD.Fall17_14Dec2018   import TTLep_pow as tt17
-        #res = getBTagMCTruthEfficiencies2D( tt17.chain, cut=preSel, overwrite=options.overwrite, btagVar='Jet_btagCSVV2', btagWP='0.8838', etaBins=etaBins2017 )
-        #print "Efficiencies 2017:"
-        #print res
-        #print
-        #writeToFile ( res, "TTLep_pow_2017_2j_2l_CSVv2_eta" )
-
-        #res = getBTagMCTruthEfficiencies2D( tt17.chain, cut=preSel, overwrite=options.overwrite, btagVar='Jet_btagDeepB', btagWP='0.4941', etaBins=etaBins2017 )
-        #print "Efficiencies 2017:"
-        #print res
-        #print
-        #writeToFile ( res, "TTLep_pow_2017_2j_2l_DeepB_eta_v2" )
-
-        res = getBTagMCTruthEfficiencies2D( tt17.chain, cut=preSel, overwrite=options.overwrite, btagVar='Jet_btagDeepFlavB', btagWP='0.3033', etaBins=etaBins2017 )
-        print "Efficiencies 2017:"
-        print res
-        print
-        writeToFile ( res, "TTLep_pow_2017_2j_2l_DeepFlavB_eta_v2" )
-
-    elif options.year == 2018:
-    # 2018
-        from Samples.nanoAOD.Autumn18 import TTLep_pow as tt18
-        #res = getBTagMCTruthEfficiencies2D( tt18.chain, cut=preSel, overwrite=options.overwrite, btagVar='Jet_btagCSVV2', btagWP='0.8838', etaBins=etaBins2017 )
-        #print "Efficiencies 2018:"
-        #print res
-        #writeToFile ( res, "TTLep_pow_2018_2j_2l_CSVv2_eta" )
-
-        #res = getBTagMCTruthEfficiencies2D( tt18.chain, cut=preSel, overwrite=options.overwrite, btagVar='Jet_btagDeepB', btagWP='0.4184', etaBins=etaBins2018 )
-        #print "Efficiencies 2018:"
-        #print res
-        #print
-        #writeToFile ( res, "TTLep_pow_2018_2j_2l_DeepB_eta_v2" )
-
-        res = getBTagMCTruthEfficiencies2D( tt18.chain, cut=preSel, overwrite=options.overwrite, btagVar='Jet_btagDeepFlavB', btagWP='0.2770', etaBins=etaBins2018 )
-        print "Efficiencies 2018:"
-        print res
-        print
-        writeToFile ( res, "TTLep_pow_2018_2j_2l_DeepFlavB_eta_v2" )
+    # tagger: ( btagVar, WP per year, file name )
+    taggers = {
+        'CSVv2':     ( 'Jet_btagCSVV2',     {2016:'0.8484', 2017:'0.8838', 2018:'0.8838'}, "TTLep_pow_%i_2j_2l_CSVv2_eta" ),
+        'DeepB':     ( 'Jet_btagDeepB',     {2016:'0.6324', 2017:'0.4941', 2018:'0.4184'}, "TTLep_pow_%i_2j_2l_DeepB_eta_v2" ),
+        'DeepFlavB': ( 'Jet_btagDeepFlavB', {2016:'0.3093', 2017:'0.3033', 2018:'0.2770'}, "TTLep_pow_%i_2j_2l_DeepFlavB_eta_v2" ),
+    }
+
+    for year in options.year:
+        if year == 2016:
+            from Samples.nanoAOD.Summer16_private_legacy_v1 import TTLep_pow as tt
+            etaBins = etaBins2016
+        elif year == 2017:
+            from Samples.nanoAOD.Fall17_14Dec2018   import TTLep_pow as tt
+            etaBins = etaBins2017
+        elif year == 2018:
+            from Samples.nanoAOD.Autumn18 import TTLep_pow as tt
+            etaBins = etaBins2018
+
+        res = getBTagMCTruthEfficienciesMulti( tt.chain, cut=preSel, taggers={ tagger:( taggers[tagger][0], taggers[tagger][1][year] ) for tagger in options.taggers }, etaBins=etaBins, nJobs=options.nJobs )
+        for tagger in options.taggers:
+            print "Efficiencies %i %s:"%( year, tagger )
+            print res[tagger]
+            print
+            writeToFile ( res[tagger], taggers[tagger][2]%year )
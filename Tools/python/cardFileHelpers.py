@@ -1,5 +1,6 @@
 import math
 import os, copy, shutil, uuid
+import numpy as np
 
 from Analysis.Tools.CardFileWriter  import CardFileWriter
 from Analysis.Tools.u_float import u_float
@@ -7,27 +8,186 @@ from Analysis.Tools.u_float import u_float
 import logging
 logger = logging.getLogger(__name__)
 
+def _file_key( filename ):
+    filename = os.path.abspath( filename )
+    stat = os.stat( filename )
+    return ( filename, stat.st_mtime, stat.st_size )
+
+class Datacard(object):
+    ''' A datacard parsed once: bins, processes, rates and the uncertainty matrix.
+        Columns are the ( bin, process ) pairs of the card. The dense arrays are indexed by ( bin, process ) and ( uncertainty, bin, process ),
+        missing processes have rate and uncertainty 0. Uncertainties are stored relative, i.e. the card value - 1, and are 0 for '-' and gmN lines.
+        Use Datacard.read to get the cached instance of a card.
+    '''
+
+    # cards read in this process, keyed by path, modification time and size
+    _cache = {}
+
+    @classmethod
+    def read( cls, cardFile ):
+        key = _file_key( cardFile )
+        if key not in cls._cache:
+            cls._cache[key] = cls( cardFile )
+        return cls._cache[key]
+
+    def __init__( self, cardFile ):
+        self.cardFile = cardFile
+
+        self.bins            = None
+        self.observation     = None
+        self.columnBins      = None
+        self.columnProcesses = None
+        self.processIDs      = None
+        self.columnRates     = None
+        self.uncertainties   = []
+        self.uncertaintyTypes= []
+        columnUnc            = []
+
+        afterRate = False
+        with open( cardFile ) as f:
+            for line in f:
+                tokens = line.split()
+                if len(tokens)==0 or tokens[0].startswith('#'): continue
+                if not afterRate:
+                    if tokens[0].lower() == "bin":
+                        if self.bins is None: self.bins       = tokens[1:]
+                        else:                 self.columnBins = tokens[1:]
+                    elif tokens[0] == "observation":
+                        self.observation = np.array( [ toFloat( v ) for v in tokens[1:] ] )
+                    elif tokens[0] == "process":
+                        if self.columnProcesses is None: self.columnProcesses = tokens[1:]
+                        else:                            self.processIDs      = tokens[1:]
+                    elif tokens[0] == "rate":
+                        self.columnRates = np.array( [ toFloat( v ) for v in tokens[1:] ] )
+                        afterRate = True
+                    continue
+                # uncertainty lines: name, type (gmN has the number of events in addition) and one value per column
+                values = tokens[3:] if len(tokens)>1 and tokens[1] == 'gmN' else tokens[2:]
+                if len(values) != len(self.columnBins): continue
+                self.uncertainties.append( tokens[0] )
+                self.uncertaintyTypes.append( tokens[1] )
+                # gmN values are event weights, not relative uncertainties
+                if tokens[1] == 'gmN': columnUnc.append( [ 0. ]*len(values) )
+                else:                  columnUnc.append( [ toFloat( v, offset = -1 ) for v in values ] )
+
+        if self.columnBins is None or self.columnProcesses is None or self.columnRates is None:
+            raise ValueError( "Could not parse bins, processes and rates of datacard %s" % cardFile )
+
+        # index of the first occurence
+        self.columns          = {}
+        for i_column, column in enumerate( zip( self.columnBins, self.columnProcesses ) ):
+            self.columns.setdefault( column, i_column )
+        self.uncertaintyIndex = {}
+        for i_unc, unc in enumerate( self.uncertainties ):
+            self.uncertaintyIndex.setdefault( unc, i_unc )
+
+        self.processes = []
+        for process in self.columnProcesses:
+            if process not in self.processes: self.processes.append( process )
+        for b in self.columnBins:
+            if b not in self.bins: self.bins.append( b )
+        self.binIndex     = { b:i for i, b in reversed( list( enumerate( self.bins ) ) ) }
+        self.processIndex = { p:i for i, p in enumerate( self.processes ) }
+
+        self.columnUnc = np.array( columnUnc ).reshape( len(self.uncertainties), len(self.columnBins) )
+
+        # dense ( bin, process ) arrays, first occurence of a column wins
+        i_column   = np.array( sorted( self.columns.values() ), dtype = int )
+        i_bin      = np.array( [ self.binIndex[self.columnBins[i]] for i in i_column ], dtype = int )
+        i_process  = np.array( [ self.processIndex[self.columnProcesses[i]] for i in i_column ], dtype = int )
+        self.hasProcess = np.zeros( ( len(self.bins), len(self.processes) ), dtype = bool )
+        self.hasProcess[i_bin, i_process] = True
+        self.rates = np.zeros( ( len(self.bins), len(self.processes) ) )
+        self.rates[i_bin, i_process] = self.columnRates[i_column]
+        self.relUnc = np.zeros( ( len(self.uncertainties), len(self.bins), len(self.processes) ) )
+        self.relUnc[:, i_bin, i_process] = self.columnUnc[:, i_column]
+
+    def column( self, binName, estimateName ):
+        return self.columns.get( ( binName, estimateName ) )
+
+    def preFitUnc( self, estimateName, uncName, binName ):
+        ''' Relative uncertainty, 0 if the uncertainty or the process in the bin is not in the card
+        '''
+        i_column = self.column( binName, estimateName )
+        i_unc    = self.uncertaintyIndex.get( uncName )
+        if i_column is None or i_unc is None: return 0.
+        return float( self.columnUnc[i_unc, i_column] )
+
+    def estimate( self, estimateName, binName, postfix='' ):
+        ''' Rate with the uncertainty from the Stat_<bin>_<process><postfix> line
+        '''
+        i_column = self.column( binName, estimateName )
+        if i_column is None: return u_float(0)
+        val = float( self.columnRates[i_column] )
+        return u_float( val, self.preFitUnc( estimateName, 'Stat_' + binName + '_' + estimateName+postfix, binName )*val )
+
+    def observationIn( self, binName ):
+        if self.observation is None or self.binIndex.get( binName, len(self.observation) ) >= len(self.observation): return u_float(0)
+        return u_float( float( self.observation[self.binIndex[binName]] ) )
+
+    def nuisances( self, postfix = '_nuisances_full.txt' ):
+        ''' The nuisance file of the card, e.g. postfix='_nuisances_r1_full.txt'
+        '''
+        return NuisanceFile.read( self.cardFile.replace('.txt', postfix) )
+
+class NuisanceFile(object):
+    ''' Pulls and constraints of a nuisance file (output of diffNuisances), parsed once.
+        Use NuisanceFile.read to get the cached instance of a file.
+    '''
+
+    # files read in this process, keyed by path, modification time and size
+    _cache = {}
+
+    @classmethod
+    def read( cls, nuisanceFile ):
+        key = _file_key( nuisanceFile )
+        if key not in cls._cache:
+            cls._cache[key] = cls( nuisanceFile )
+        return cls._cache[key]
+
+    def __init__( self, nuisanceFile ):
+        self.nuisanceFile = nuisanceFile
+        self.pulls        = {}
+        self.constraints  = {}
+        with open( nuisanceFile ) as f:
+            for line in f:
+                tokens = line.split()
+                if len(tokens)==0 or tokens[0] in self.pulls: continue
+                try:
+                    pull       = float(line.split(',')[0].split()[-1])
+                    constraint = float(line.split(',')[1].split()[0].replace('*','').replace('!',''))
+                except ( ValueError, IndexError ):
+                    # header and other lines
+                    continue
+                self.pulls[tokens[0]]       = pull
+                self.constraints[tokens[0]] = constraint
+
+    def pull( self, name ):
+        # Sometimes a bin is not found in the nuisance file because its yield is 0
+        return self.pulls.get( name, 0 )
+
+    def constraint( self, name ):
+        return self.constraints.get( name, 0 )
+
+    def pull_array( self, names ):
+        return np.array( [ self.pull( name ) for name in names ], dtype = float )
+
+def toFloat( value, offset = 0 ):
+    ''' float( value ) + offset, 0 for '-' and other non-numbers (e.g. asymmetric lnN)
+    '''
+    try:    return float( value ) + offset
+    except ValueError:
+        return 0.
+
 
 def getPull(nuisanceFile, name):
-    with open(nuisanceFile) as f:
-      for line in f:
-        if name != line.split()[0]: continue
-        return float(line.split(',')[0].split()[-1])
-    return 0 # Sometimes a bin is not found in the nuisance file because its yield is 0
+    return NuisanceFile.read(nuisanceFile).pull(name)
 
 def getConstrain(nuisanceFile, name):
-    with open(nuisanceFile) as f:
-      for line in f:
-        if name != line.split()[0]: continue
-        return float(line.split(',')[1].split()[0].replace('*','').replace('!',''))
-    return 0 # Sometimes a bin is not found in the nuisance file because its yield is 0
+    return NuisanceFile.read(nuisanceFile).constraint(name)
 
 def getFittedUncertainty(nuisanceFile, name):
-    with open(nuisanceFile) as f:
-      for line in f:
-        if name != line.split()[0]: continue
-        return float(line.split(',')[1].split()[0].replace('!','').replace('*',''))
-    return 0 # Sometimes a bin is not found in the nuisance file because its yield is 0
+    return NuisanceFile.read(nuisanceFile).constraint(name)
 
 
 def getPostFitUncFromCard(cardFile, estimateName, uncName, binName):
@@ -35,63 +195,26 @@ def getPostFitUncFromCard(cardFile, estimateName, uncName, binName):
     return getFittedUncertainty(nuisanceFile, estimateName)*getPreFitUncFromCard(cardFile, estimateName, uncName, binName)
 
 def getPreFitUncFromCard(cardFile, estimateName, uncName, binName):
-    with open(cardFile) as f:
-      binList = False
-      estimateList = False
-      for line in f:
-        if len(line.split())==0: continue
-        if line.split()[0] == "bin":
-          if not binList: binList = True
-          else:           binList = line.split()[1:]
-        if line.split()[0] == "process":
-          if not estimateList: estimateList = line.split()[1:]
-        if line.split()[0] != uncName: continue
-        for i in range(len(binList)):
-          if binList[i] == binName and estimateList[i]==estimateName:
-            try:    return float(line.split()[2:][i])-1
-            except: 
-              return 0. # muted bin has -, cannot be converted to float
-      return 0.
-      #raise Warning('No uncertainty ' + uncName + ' for ' + estimateName + ' ' + binName)
+    return Datacard.read(cardFile).preFitUnc(estimateName, uncName, binName)
 
 def getTotalPostFitUncertainty(cardFile, binName):
-    with open(cardFile) as f:
-      binList = False
-      estimateList = False
-      ind = []
-      uncertainties = False
-      uncDict = {}
-      totalUnc = {}
-      for line in f:
-        if len(line.split())==0: continue
-        if line.split()[0] == "bin":
-          if not binList: binList = True
-          else:
-            binList = line.split()[1:]
-            for i,b in enumerate(binList):
-                if b == binName:
-                    ind.append(i) 
-        if line.split()[0] == "process":
-          if not estimateList:
-            estimateList = line.split()[1:]
-            estimateList = estimateList[ind[1]:ind[-1]+1]
-        if line.split()[0] == "rate":
-          estimates = line.split()[1:]
-          estimates = [float(a) for a in estimates[ind[1]:ind[-1]+1]]
-        if line.split()[0] == 'PU': uncertainties = True
-        if uncertainties:
-            uncDict[line.split()[0]] = [ 0 if a =='-' else float(a)-1 for a in line.split()[2:][ind[1]:ind[-1]+1] ]
+    card = Datacard.read(cardFile)
+    # all columns of the bin except the first one
+    ind           = [ i for i, b in enumerate(card.columnBins) if b == binName ][1:]
+    estimateList  = [ card.columnProcesses[i] for i in ind ]
+    estimates     = card.columnRates[ind]
+    # uncertainties from PU on
+    first         = card.uncertaintyIndex.get('PU', len(card.uncertainties))
+    uncertainties = card.uncertainties[first:]
+    uncMatrix     = card.columnUnc[first:][:,ind]
+
     nuisanceFile = cardFile.replace('.txt','_nuisances_full.txt')
-    for unc in uncDict.keys():
-        totalUnc[unc] = 0
-        for i in range(len(estimates)):
-            #totalUnc[unc] += uncDict[unc][i] * estimates[i] * ( 1 + getPull(nuisanceFile,unc)*uncDict[unc][i] ) #* getConstrain(nuisanceFile, unc)
-            totalUnc[unc] += uncDict[unc][i] * estimates[i] * math.exp( getPull(nuisanceFile,unc)*uncDict[unc][i] )
-            #totalUnc[unc] += (uncDict[unc][i] * estimates[i] * math.exp( getPull(nuisanceFile,unc)*uncDict[unc][i] ))**2
-        #totalUnc[unc] = math.sqrt(totalUnc[unc])
-    total = 0
-    for unc in totalUnc.keys():
-        total += totalUnc[unc]**2
+    pulls        = NuisanceFile.read(nuisanceFile).pull_array(uncertainties)
+    totalUnc     = ( uncMatrix * estimates * np.exp( pulls[:,np.newaxis]*uncMatrix ) ).sum( axis=1 )
+    # lines of the same uncertainty are not added, the last one is used
+    totalUnc     = { unc:totalUnc[i] for i, unc in enumerate( uncertainties ) }
+    total = sum( unc**2 for unc in totalUnc.values() )
+
     estimatesPostFit = []
     for e in estimateList:
         res = getEstimateFromCard(cardFile, e, binName)
@@ -99,50 +222,12 @@ def getTotalPostFitUncertainty(cardFile, binName):
         estimatesPostFit.append(res.val)
     estimatePostFit = sum(estimatesPostFit)
     return u_float(estimatePostFit,math.sqrt(total))
-    #return uncDict, totalUnc
-          #else: 
 
 def getEstimateFromCard(cardFile, estimateName, binName, postfix=''):
-    res = u_float(0)
-    uncName = 'Stat_' + binName + '_' + estimateName+postfix
-    with open(cardFile) as f:
-      binList = False
-      estimateList = False
-      for line in f:
-        if len(line.split())==0: continue
-        if line.split()[0] == "bin":
-          if not binList: binList = True
-          else:           binList = line.split()[1:]
-        if line.split()[0] == "process":
-          if not estimateList: estimateList = line.split()[1:]
-        if line.split()[0] == "rate":
-            for i in range(len(binList)):
-              if binList[i] == binName and estimateList[i]==estimateName:
-                try: res.val = float(line.split()[1:][i])
-                except: res.val = 0
-                #return float(line.split()[1:][i])
-        if line.split()[0] != uncName: continue
-        for i in range(len(binList)):
-          if binList[i] == binName and estimateList[i]==estimateName:
-            try:    res.sigma = (float(line.split()[2:][i])-1)*res.val
-            except: res.sigma = 0.
-    return res
+    return Datacard.read(cardFile).estimate(estimateName, binName, postfix=postfix)
 
 def getObservationFromCard(cardFile, binName):
-    res = u_float(0)
-    with open(cardFile) as f:
-      binList = False
-      estimateList = False
-      for line in f:
-        if len(line.split())==0: continue
-        if line.split()[0] == "bin":
-            binList = line.split()[1:]
-        if line.split()[0] == "observation":
-            for i in range(len(binList)):
-              if binList[i] == binName:# and estimateList[i]==estimateName:
-                try: res.val = float(line.split()[1:][i])
-                except: res.val = 0
-    return res
+    return Datacard.read(cardFile).observationIn(binName)
 
 def applyNuisance(cardFile, estimate, res, binName):
     if not estimate.name in ['DY','multiBoson','TTZ']: return res
@@ -152,7 +237,7 @@ def applyNuisance(cardFile, estimate, res, binName):
     scaledRes2   = scaledRes*(1+res.sigma/res.val*getPull(nuisanceFile, 'Stat_' + binName + '_' + estimate.name)) if scaledRes.val > 0 else scaledRes
     return scaledRes2
 
-def applyAllNuisances(cardFile, estimate, res, binName, nuisances):
+def applyAllNuisances(cardFile, estimate, res, binName, nuisances=()):
     if not estimate in ['signal', 'WZ', 'TTX', 'TTW', 'TZQ', 'rare', 'nonprompt', 'ZZ','ZG']: return res
     if estimate == "WZ":
         uncName = estimate+'_xsec'
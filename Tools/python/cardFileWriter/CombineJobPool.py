@@ -0,0 +1,203 @@
+''' Run combine for many cards in a bounded pool of processes.
+
+Results are cached in a DirDB, keyed by a content hash of the card, the shape files referenced by the card, the method and the options.
+Re-running a scan therefore only runs combine for cards that changed.
+Results are yielded as soon as they are available, cached results first.
+The method 'nuisances' runs FitDiagnostics and returns the arrays of the fit results (see FitDiagnostics.getArrays),
+the nuisance tables of diffNuisances.py are only written by cardFileWriter.calcNuisances.
+
+Usage:
+    pool = CombineJobPool( nJobs = 8, cacheDir = '/path/to/cache' )
+    for job, res in pool.run( [ CombineJob( card, 'limit', options = '--run blind' ) for card in cards ] ):
+        print job.card, res
+'''
+
+# Standard imports
+import os
+import shutil
+import uuid
+import hashlib
+import subprocess
+from multiprocessing.pool import ThreadPool
+
+# Analysis
+from Analysis.Tools.DirDB import DirDB
+
+# Logging
+import logging
+logger = logging.getLogger(__name__)
+
+def read_limit_file( fname ):
+    ''' Read the limits per quantile from the combine output (AsymptoticLimits, ProfileLikelihood), see cardFileWriter.readResFile
+    '''
+    # cardFileWriter loads ROOT, import it only when results are read
+    from Analysis.Tools.cardFileWriter.cardFileWriter import cardFileWriter
+    return cardFileWriter().readResFile( fname )
+
+def read_nll_file( fname ):
+    ''' Read the NLL from the combine output (MultiDimFit with --saveNLL), see cardFileWriter.readNLLFile
+    '''
+    from Analysis.Tools.cardFileWriter.cardFileWriter import cardFileWriter
+    nll = cardFileWriter().readNLLFile( fname )
+    nll["bestfit"] = nll["nll"]
+    return nll
+
+def read_fitDiagnostics_file( fname ):
+    ''' Arrays of the fit results fit_s and fit_b from the FitDiagnostics output, see FitDiagnostics.getArrays
+    '''
+    from Analysis.Tools.cardFileWriter.FitDiagnostics import FitDiagnostics
+    fitDiagnostics = FitDiagnostics( fname, sidecar = False )
+    res = {}
+    for fit in [ "fit_s", "fit_b" ]:
+        try:
+            res[fit] = fitDiagnostics.getArrays( fit = fit )
+        except ValueError as e:
+            logger.warning( "%s", e )
+    if len(res) == 0:
+        raise ValueError( "No fit result in %s" % fname )
+    return res
+
+# method: ( combine arguments, output file, reader )
+methods = {
+    'limit':  ( "--saveWorkspace -M AsymptoticLimits", "higgsCombineTest.AsymptoticLimits.mH120.root", read_limit_file ),
+    'signif': ( "--saveWorkspace -M ProfileLikelihood --uncapped 1 --significance --rMin -5", "higgsCombineTest.ProfileLikelihood.mH120.root", read_limit_file ),
+    'nll':    ( "-M MultiDimFit -n Nominal --saveNLL --forceRecreateNLL --freezeParameters r", "higgsCombineNominal.MultiDimFit.mH120.root", read_nll_file ),
+    'nuisances': ( "--robustHesse 1 --forceRecreateNLL -M FitDiagnostics --saveShapes --saveNormalizations --saveOverall --saveWithUncertainties", "fitDiagnostics.root", read_fitDiagnostics_file ),
+}
+
+# name of the kept output, <card><postfix>. The FitDiagnostics output is <card>_FD.root as in cardFileWriter.calcNuisances.
+outputPostfix = {
+    'limit':     '.root',
+    'nuisances': '_FD.root',
+}
+
+def shape_files( card ):
+    ''' Files referenced in the 'shapes' lines of a text card, relative paths are wrt the card
+    '''
+    files = []
+    if card.endswith( '.root' ): return files
+    with open( card ) as f:
+        for line in f:
+            tokens = line.split()
+            if len(tokens) >= 4 and tokens[0] == 'shapes' and tokens[3] != 'FAKE':
+                fname = os.path.join( os.path.dirname( card ), tokens[3] )
+                if fname not in files:
+                    files.append( fname )
+    return files
+
+def content_hash( card, method, options ):
+    ''' md5 of the card, its shape files, the method and the options
+    '''
+    md5 = hashlib.md5()
+    md5.update( "%s %s\n" % ( method, options ) )
+    for fname in [ card ] + shape_files( card ):
+        md5.update( os.path.basename( fname ) + "\n" )
+        if not os.path.exists( fname ):
+            logger.warning( "File %s not found, hash only depends on its name.", fname )
+            continue
+        with open( fname, 'rb' ) as f:
+            for block in iter( lambda: f.read( 1024*1024 ), '' ):
+                md5.update( block )
+    return md5.hexdigest()
+
+class CombineJob:
+
+    def __init__( self, card, method = 'limit', options = "" ):
+        if method not in methods:
+            raise ValueError( "Unknown method %s. Use one of %s" % ( method, ", ".join( methods.keys() ) ) )
+        self.card    = os.path.abspath( card )
+        self.method  = method
+        self.options = options
+
+        if not os.path.exists( self.card ):
+            raise IOError( "File not found: %s" % self.card )
+
+    def command( self, combine = "combine" ):
+        return "%s %s %s %s" % ( combine, methods[self.method][0], self.options, self.card )
+
+    def output( self ):
+        return methods[self.method][1]
+
+    def read( self, fname ):
+        return methods[self.method][2]( fname )
+
+    def __repr__( self ):
+        return "CombineJob( %r, %r, options = %r )" % ( self.card, self.method, self.options )
+
+class CombineJobPool:
+
+    def __init__( self, nJobs = 4, cacheDir = None, combine = "combine", workDir = '.', keepOutput = False ):
+        '''
+        nJobs:      number of combine processes running at the same time
+        cacheDir:   directory of the DirDB with the results. No caching if None.
+        combine:    combine executable
+        workDir:    combine runs in a unique directory in workDir
+        keepOutput: copy the combine output to <card>.root, <card>_FD.root for nuisances and <card>_<method>.root for the other methods
+        '''
+        self.nJobs      = nJobs
+        self.cache      = DirDB( cacheDir ) if cacheDir is not None else None
+        self.combine    = combine
+        self.workDir    = os.path.abspath( workDir )
+        self.keepOutput = keepOutput
+
+    def execute( self, job ):
+        ''' Run combine for a single job in a unique directory. Runs in a thread of the pool, does not touch ROOT.
+        '''
+        uniqueDirname = os.path.join( self.workDir, str(uuid.uuid4()) )
+        os.makedirs( uniqueDirname )
+        logger.debug( "Running %s in %s", job.command( self.combine ), uniqueDirname )
+        with open( os.path.join( uniqueDirname, 'combine.log' ), 'w' ) as log:
+            returncode = subprocess.call( job.command( self.combine ), shell = True, cwd = uniqueDirname, stdout = log, stderr = subprocess.STDOUT )
+        return job, uniqueDirname, returncode
+
+    def result( self, job, uniqueDirname, returncode ):
+        ''' Read the output of a job and clean up
+        '''
+        tempResFile = os.path.join( uniqueDirname, job.output() )
+        try:
+            res = job.read( tempResFile )
+        except Exception as e:
+            logger.warning( "Did not succeed reading result of %r (return code %i): %s", job, returncode, e )
+            res = None
+
+        if res is not None and self.keepOutput:
+            resultFilename = job.card.replace('.txt','') + outputPostfix.get( job.method, '_%s.root' % job.method )
+            shutil.copyfile( tempResFile, resultFilename )
+
+        shutil.rmtree( uniqueDirname )
+        return res
+
+    def run( self, jobs, overwrite = False ):
+        ''' Yield ( job, result ) as results become available. Cached results are yielded first.
+            The result is None if combine did not succeed; failures are not cached.
+        '''
+        to_run = []
+        for job in jobs:
+            key = content_hash( job.card, job.method, job.options )
+            if not overwrite and self.cache is not None and self.cache.contains( key ):
+                logger.debug( "Found cached result for %r", job )
+                yield job, self.cache.get( key )
+            else:
+                to_run.append( ( job, key ) )
+
+        if len(to_run) == 0: return
+
+        keys = { id(job):key for job, key in to_run }
+        logger.info( "Running combine for %i jobs in %i processes.", len(to_run), self.nJobs )
+        pool = ThreadPool( processes = self.nJobs )
+        try:
+            for job, uniqueDirname, returncode in pool.imap_unordered( self.execute, [ job for job, key in to_run ] ):
+                res = self.result( job, uniqueDirname, returncode )
+                if res is not None and self.cache is not None:
+                    self.cache.add( keys[id(job)], res, overwrite = True )
+                yield job, res
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def runAll( self, jobs, overwrite = False ):
+        ''' Results in the order of the jobs
+        '''
+        jobs    = list( jobs )
+        results = { id(job):res for job, res in self.run( jobs, overwrite = overwrite ) }
+        return [ results[id(job)] for job in jobs ]
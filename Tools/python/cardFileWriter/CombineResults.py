@@ -21,8 +21,12 @@ import math
 import copy
 import shutil
 import uuid
+import numpy as np
 
 from Analysis.Tools.u_float import u_float
+from Analysis.Tools.cardFileHelpers import Datacard
+from Analysis.Tools.cardFileWriter.FitDiagnostics import FitDiagnostics, fitObjects
+from Analysis.Tools.cardFileWriter.ImpactRunner   import ImpactRunner
 
 from RootTools.core.standard import *
 from RootTools.plot.helpers  import copyIndexPHP
@@ -87,12 +91,11 @@ class CombineResults:
 
         # set some defaults. If a method gets some of these variables, they will be filled
         # this safes some time if they are used multiple times
-        self.tRootFile           = None # needed otherwise python looses the pointer to the root file
+        self.fitDiagnostics      = None # lazy reader of the fit result root file
         self.binList             = None
         self.binLabels           = None
         self.processes           = None
         self.processList         = None
-        self.fitResults          = None
         self.fittedUncertainties = None
         self.constrain           = None
         self.nuisances           = None
@@ -100,6 +103,8 @@ class CombineResults:
         self.rateParameter       = {"preFit":None, "postFit":None}
         self.estimates           = {"preFit":None, "postFit":None}
         self.uncertainties       = {"preFit":None, "postFit":None}
+        self.uncertaintyArrays   = {"preFit":None, "postFit":None}
+        self.nuisanceYields      = {"preFit":None, "postFit":None}
         self.pulls               = {"preFit":None, "postFit":None}
         self.covarianceHistos    = {"preFit":None, "postFit":None}
         self.regionHistos        = {"preFit":{"all":None}, "postFit":{"all":None}}
@@ -109,28 +114,23 @@ class CombineResults:
 #    def __private( self ):
 #    def public( self ):
 
-    def __getFitObject( self, key=None ):
-        """ get the fit objects
+    def __getFitDiagnostics( self ):
+        """ get the reader of the fit result root file
         """
-        # return safed fitResult if available
-        if self.fitResults:
-            if key and key in self.fitResults.keys(): return self.fitResults[key]
-            elif not key:                             return self.fitResults
-
         if not self.rootFile:
             raise ValueError( "Root file of fit result not found! Running in limited mode, thus cannot get the object needed!" )
 
-        if not self.tRootFile:
-            self.tRootFile = ROOT.TFile( self.rootFile, "READ")
+        if not self.fitDiagnostics:
+            self.fitDiagnostics = FitDiagnostics( self.rootFile )
 
-        fits   = ["fit_b", "fit_s", "norm_prefit", "norm_fit_s", "norm_fit_b", "nuisances_prefit", "nuisances_prefit_res", "shapes_prefit", "shapes_fit_b", "shapes_fit_s", "overall_total_covar", "process_covar", "process_corr"]
-        result = {}
-        for fit in fits:
-            result[fit] = copy.copy( self.tRootFile.Get(fit) )
-        self.fitResults = result
+        return self.fitDiagnostics
 
-        if key: return self.fitResults[key]
-        else:   return self.fitResults
+    def __getFitObject( self, key=None ):
+        """ get the fit objects, only the requested ones are read from the root file
+        """
+        fitDiagnostics = self.__getFitDiagnostics()
+        if key: return fitDiagnostics.get( key )
+        else:   return { fit:fitDiagnostics.get( fit ) for fit in fitObjects }
 
     def __rewriteRebinnedFile( self, rootFile, copyDataFrom=None, postfit=False, nBins=None ):
         """ rewrite the rootfile from rebinning in the style of the combine output
@@ -268,23 +268,8 @@ class CombineResults:
         toHist.LabelsOption("v","X")
 
     def __getUncertaintiesFromCard( self, estimate, nuisance, bin, postFit=False ):
-        binList   = self.getBinList( unique=False )
-        estimates = self.getProcessList( unique=False )
         pull      = self.getPulls( nuisance=nuisance, postFit=postFit )
-        unc       = 0
-        with open( self.cardFile ) as f:
-            for line in f:
-                if not line.split():            continue
-                if line.split()[0] != nuisance: continue
-                for i_bin, _bin in enumerate(binList):
-                    if _bin != bin: continue
-                    if estimates[i_bin] != estimate: continue
-                    try:
-                        unc = float(line.split()[2:][i_bin])-1
-                        break
-                    except:
-                        return 0. # muted bin or -, cannot be converted to float
-        
+        unc       = Datacard.read( self.cardFile ).preFitUnc( estimate, nuisance, bin ) # 0 for muted bin or -
         return pull.val * unc if postFit else unc
 
     def __getRateParameterFromCard( self ):
@@ -306,31 +291,62 @@ class CombineResults:
         return subkey
 
     def getNuisanceYields( self, nuisance, postFit=False ):
-        return { b:self.__getNuisanceBinYield( nuisance=nuisance, bin=b, postFit=postFit ) for b in self.getBinList( unique=True ) }
-
-    def __getNuisanceBinYield( self, nuisance, bin, postFit=False ):
-        yields    = self.getEstimates( postFit=postFit, directory=None )
-        processes = self.getProcessesPerBin( bin=bin )[bin]
-        unc       = self.getUncertainties(   bin=bin, postFit=postFit, systOnly=False )[bin]
-
-        del yields["total"]
-        for key, y in yields.iteritems():
-            if bin in y.keys():
-                yields = y[bin]
-                break
-
-        #if nuisance not in unc["total_signal"].keys():
-        #    raise ValueError("Nuisance not in cardfile: %s. Use one of [%s]"%(nuisance, ", ".join(unc["total_signal"].keys())))
-
-        y, yup, ydown = 0, 0, 0
-        for p in processes:
-            if p.count('signal') and self.isSearch: continue
-            yproc  = yields[p].val if p in yields.keys() else 0 # yield is 0 when it is not in the results? or throw an error? FIXME
-            uproc  = unc[p][nuisance]
-            y     += yproc
-            yup   += yproc*(1+uproc)
-            ydown += yproc*(1-uproc)
-        return {"up":yup, "down":ydown, "relUp":yup/y if y else 0, "relDown":ydown/y if y else 0, "yield":y}
+        # view of getNuisanceYieldArrays for a single nuisance
+        arrays = self.getNuisanceYieldArrays( postFit=postFit )
+        if nuisance not in arrays["nuisanceIndex"].keys():
+            raise ValueError("Nuisance not in cardfile: %s. Use one of [%s]"%(nuisance, ", ".join(arrays["nuisanceIndex"].keys())))
+        i_n = arrays["nuisanceIndex"][nuisance]
+        return { b:{ "up":float(arrays["up"][i_b,i_n]), "down":float(arrays["down"][i_b,i_n]), "relUp":float(arrays["relUp"][i_b,i_n]), "relDown":float(arrays["relDown"][i_b,i_n]), "yield":float(arrays["yield"][i_b]) } for i_b, b in enumerate( arrays["bins"] ) }
+
+    def getNuisanceYieldArrays( self, postFit=False ):
+        """ yields of all bins shifted up and down by the uncertainty of each nuisance
+            returns a dict with the arrays "up", "down", "relUp", "relDown" ( bins x nuisances ), "yield" ( bins ) and the index maps of getUncertaintyArrays
+        """
+        key = "postFit" if postFit else "preFit"
+        if self.nuisanceYields[key]: return self.nuisanceYields[key]
+
+        arrays    = self.getUncertaintyArrays( postFit=postFit )
+        unc       = arrays["unc"]
+        estimates = self.getEstimates( postFit=postFit, directory=None )
+        processes = self.getProcessesPerBin( bin=None )
+        del estimates["total"]
+
+        # yields and processes (in the order of the cardfile, padded with -1) per bin
+        yields = np.zeros( unc.shape[:2] )
+        order  = -np.ones( ( unc.shape[0], max( [ len(procs) for procs in processes.values() ] + [0] ) ), dtype=int )
+        for bin, i_bin in arrays["binIndex"].iteritems():
+            binYields = {}
+            for y in estimates.values():
+                if bin in y.keys():
+                    binYields = y[bin]
+                    break
+            i_proc = 0
+            for p in processes[bin]:
+                if p.count('signal') and self.isSearch: continue
+                # yield is 0 when it is not in the results? or throw an error? FIXME
+                if p in binYields.keys(): yields[i_bin, arrays["processIndex"][p]] = binYields[p].val
+                order[i_bin, i_proc] = arrays["processIndex"][p]
+                i_proc += 1
+
+        y     = np.zeros( unc.shape[0] )
+        yup   = np.zeros( ( unc.shape[0], unc.shape[2] ) )
+        ydown = np.zeros( ( unc.shape[0], unc.shape[2] ) )
+        for i_proc in range( order.shape[1] ):
+            sel    = order[:,i_proc] >= 0
+            yproc  = yields[sel, order[sel,i_proc]]
+            uproc  = unc[sel, order[sel,i_proc], :]
+            y[sel]     += yproc
+            yup[sel]   += yproc[:,np.newaxis]*(1+uproc)
+            ydown[sel] += yproc[:,np.newaxis]*(1-uproc)
+
+        with np.errstate( divide="ignore", invalid="ignore" ):
+            relUp   = np.where( y[:,np.newaxis] != 0, yup/y[:,np.newaxis],   0 )
+            relDown = np.where( y[:,np.newaxis] != 0, ydown/y[:,np.newaxis], 0 )
+
+        res = { "up":yup, "down":ydown, "relUp":relUp, "relDown":relDown, "yield":y }
+        res.update( { k:arrays[k] for k in [ "bins", "nuisances", "binIndex", "nuisanceIndex" ] } )
+        self.nuisanceYields[key] = res
+        return res
 
     def getBinList( self, unique=True ):
         # get either the bin names for each process according to the cardfile ( Bin0 Bin0 Bin0 ... Bin1 Bin1 ...)
@@ -408,18 +424,8 @@ class CombineResults:
                         return self.nuisances[:i]
             return self.nuisances
 
-        fit       = self.__getFitObject( key="fit_b" if self.bkgOnly else "fit_s" )
-        nuisance  = fit.floatParsInit()
-        nuisances = []
-        iter  = nuisance.createIterator()
-        var   = iter.Next()
-
-        while var:
-            if var.GetName() != "r":
-                nuisances.append( var.GetName() )
-            var = iter.Next()
-
-        self.nuisances = nuisances
+        names, values, errors = self.__getFitDiagnostics().getParameters( fit="fit_b" if self.bkgOnly else "fit_s", final=False )
+        self.nuisances = [ name for name in names if name != "r" ]
 
         if systOnly:
             for i, n in enumerate(self.nuisances):
@@ -500,16 +506,8 @@ class CombineResults:
             if nuisance: return self.pulls[key][nuisance]
             else:        return self.pulls[key]
 
-        fit   = self.__getFitObject( key="fit_b" if self.bkgOnly else "fit_s" )
-        pull  = fit.floatParsFinal() if postFit else fit.floatParsInit()
-        pulls = {}
-        iter  = pull.createIterator()
-        var   = iter.Next()
-
-        while var:
-            pulls.update( { var.GetName():u_float(var.getValV(), var.getError()) } )
-            var = iter.Next()
-        self.pulls[key] = pulls
+        names, values, errors = self.__getFitDiagnostics().getParameters( fit="fit_b" if self.bkgOnly else "fit_s", final=postFit )
+        self.pulls[key] = { name:u_float( float(val), float(err) ) for name, val, err in zip( names, values, errors ) }
         if nuisance: return self.pulls[key][nuisance]
         else:        return self.pulls[key]
 
@@ -539,28 +537,13 @@ class CombineResults:
             else:
                 return self.uncertainties[key]
 
+        # dictionary view of the uncertainty arrays
+        arrays        = self.getUncertaintyArrays( postFit=postFit )
         allUnc        = self.getNuisancesList( systOnly=systOnly )
-        allEst        = self.getProcessList( unique=False )
-        rateParams    = self.getRateParameter()
-        pulls         = self.getPulls( postFit=postFit )
-        binList       = self.getBinList( unique=False )
+        nuisances     = [ ( i_n, n ) for i_n, n in enumerate( arrays["nuisances"] ) if n in allUnc ]
         uncertainties = {}
-
-        with open( self.cardFile ) as f:
-            for line in f:
-                if not line.split(): continue
-                unc = line.split()[0] 
-                if unc not in allUnc: continue
-                if unc in rateParams.keys(): continue # remove rate parameters as they would be 0 anyway
-                for i_bin, _bin in enumerate(binList):
-                    est = allEst[i_bin]
-                    if not _bin in uncertainties.keys(): uncertainties[_bin] = {}
-                    if not est in uncertainties[_bin].keys(): uncertainties[_bin][est] = {}
-                    try:
-                        uncertainties[_bin][est][unc] = float(line.split()[2:][i_bin])-1
-                        if postFit: uncertainties[_bin][est][unc] *= pulls[unc].sigma
-                    except:
-                        uncertainties[_bin][est][unc] = 0
+        for i_bin, i_est in zip( *np.nonzero( arrays["hasProcess"] ) ):
+            uncertainties.setdefault( arrays["bins"][i_bin], {} )[arrays["processes"][i_est]] = { n:float( arrays["unc"][i_bin, i_est, i_n] ) for i_n, n in nuisances }
 
         self.uncertainties[key] = uncertainties
 
@@ -569,6 +552,48 @@ class CombineResults:
         else:
             return self.uncertainties[key]
 
+    def getUncertaintyArrays( self, postFit=False ):
+        """ relative uncertainties of the cardfile as array ( bins x processes x nuisances ), post-fit scaled with the fitted uncertainty of the nuisance
+            returns a dict with the array "unc", the names "bins", "processes", "nuisances", the name->index maps and the mask "hasProcess" ( bins x processes )
+            bins and processes are sorted as in getBinList and getProcessList, nuisances are those of the fit which are in the cardfile
+        """
+        key = "postFit" if postFit else "preFit"
+        if self.uncertaintyArrays[key]: return self.uncertaintyArrays[key]
+
+        card       = Datacard.read( self.cardFile )
+        allUnc     = self.getNuisancesList( systOnly=False )
+        rateParams = self.getRateParameter()
+        pulls      = self.getPulls( postFit=postFit )
+        bins       = self.getBinList( unique=True )
+        processes  = self.getProcessList( unique=True )
+
+        # remove rate parameters as they would be 0 anyway
+        nuisances = []
+        for unc in card.uncertainties:
+            if unc in allUnc and unc not in rateParams.keys() and unc not in nuisances:
+                nuisances.append( unc )
+
+        binIndex      = { b:i for i, b in enumerate( bins ) }
+        processIndex  = { p:i for i, p in enumerate( processes ) }
+        nuisanceIndex = { n:i for i, n in enumerate( nuisances ) }
+
+        i_bin  = np.array( [ binIndex[b]     for b in card.columnBins ],      dtype=int )
+        i_proc = np.array( [ processIndex[p] for p in card.columnProcesses ], dtype=int )
+        hasProcess = np.zeros( ( len(bins), len(processes) ), dtype=bool )
+        hasProcess[i_bin, i_proc] = True
+
+        # relative uncertainties, 0 for muted bins or -
+        unc = np.zeros( ( len(bins), len(processes), len(nuisances) ) )
+        for i_unc, n in enumerate( card.uncertainties ):
+            if n in nuisanceIndex.keys():
+                unc[i_bin, i_proc, nuisanceIndex[n]] = card.columnUnc[i_unc]
+        if postFit:
+            unc *= np.array( [ pulls[n].sigma for n in nuisances ] )
+
+        self.uncertaintyArrays[key] = { "unc":unc, "hasProcess":hasProcess, "bins":bins, "processes":processes, "nuisances":nuisances,
+                                        "binIndex":binIndex, "processIndex":processIndex, "nuisanceIndex":nuisanceIndex }
+        return self.uncertaintyArrays[key]
+
     def getObservation( self, bin=None, directory="total" ):
         return {dir:{ b:b_dict["data"] for b, b_dict in o.iteritems() } for dir, o in self.getEstimates( postFit=False, bin=bin, estimate="data", directory=directory ).iteritems()}
 
@@ -938,60 +963,64 @@ class CombineResults:
     def setPlotDirectory( self, plotDirectory ):
         self.plotDirectory = plotDirectory
 
-    def getImpactPlot( self, expected=False, printPNG=False, cores=1 ):
+    def getImpactPlot( self, expected=False, printPNG=False, cores=1, submitter=None, keepFits=False ):
+        # the fits of the nuisances run in cores local processes or are submitted with submitter (e.g. submitBatch.py)
+        # finished fits are kept on disk, calling again after an interruption or after the batch jobs are done only runs the missing fits
+        # the workspace is shared by the expected and observed impacts
 
-        cardName      = self.cardFile.split("/")[-1].split(".")[0]
-        shapeName     = self.shapeFile.split("/")[-1]
-        if self.year != "combined":
-            shapeRootName = self.shapeRootFile.split("/")[-1]
-        rootCardName  = self.rootCardFile.split("/")[-1]
+        cardName = self.cardFile.split("/")[-1].split(".")[0]
 
         # assuming you have combine in the same release!!! #FIXME
         combineReleaseLocation = os.path.join( os.environ["CMSSW_BASE"], "src" )
-        combineDirname = os.path.join( combineReleaseLocation, str(self.year), cardName, "expected" if expected else "observed" )
-        if not os.path.isdir(combineDirname): os.makedirs(combineDirname)
-
-        newShapeFilePath     = os.path.join( combineDirname, shapeName )
-        shutil.copyfile( self.shapeFile,     newShapeFilePath )
-        if self.year != "combined":
-            newShapeRootFilePath = os.path.join( combineDirname, shapeRootName )
-            shutil.copyfile( self.shapeRootFile, newShapeRootFilePath )
+        combineDirname = os.path.join( combineReleaseLocation, str(self.year), cardName )
 
         # use scram if combineReleaseLocation is a different release than current working directory
-        # echo is just a placeholder
-        if os.environ["CMSSW_BASE"] in combineReleaseLocation: scram = "echo ''"
+        if os.environ["CMSSW_BASE"] in combineReleaseLocation: scram = None
         else:                                                  scram = "eval `scramv1 runtime -sh`"
 
         if self.bkgOnly:
-            prepWorkspace = "text2workspace.py %s --X-allow-no-signal -m 125"%shapeName
-            if self.isSearch:
-                robustFit  = "combineTool.py -M Impacts -d %s -m 125 --expectSignal 0 --doInitialFit --robustFit 1 --rMin -0.01 --rMax 0.01"%rootCardName
-                impactFits = "combineTool.py -M Impacts -d %s -m 125 --expectSignal 0 --robustFit 1 --doFits --parallel %i --rMin -0.01 --rMax 0.01"%( rootCardName, cores )
-            else:
-                robustFit  = "combineTool.py -M Impacts -d %s -m 125 --expectSignal 1 --doInitialFit --robustFit 1 --rMin 0.99 --rMax 1.01"%rootCardName
-                impactFits = "combineTool.py -M Impacts -d %s -m 125 --expectSignal 1 --robustFit 1 --doFits --parallel %i --rMin 0.99 --rMax 1.01"%( rootCardName, cores )
+            workspaceOptions = "--X-allow-no-signal"
+            if self.isSearch: options = "--expectSignal 0 --robustFit 1 --rMin -0.01 --rMax 0.01"
+            else:             options = "--expectSignal 1 --robustFit 1 --rMin 0.99 --rMax 1.01"
         else:
-            prepWorkspace = "text2workspace.py %s -m 125"%shapeName
-            robustFit     = "combineTool.py -M Impacts -d %s -m 125 --doInitialFit --robustFit 1 --rMin 0 --rMax 2"%rootCardName
-            impactFits    = "combineTool.py -M Impacts -d %s -m 125 --robustFit 1 --doFits --parallel %s --rMin 0 --rMax 2"%( rootCardName, cores )
+            workspaceOptions = ""
+            options          = "--robustFit 1 --rMin 0 --rMax 2"
+
+        # without fit result all fits run in a single combineTool job
+        nuisances = self.getNuisancesList() if self.rootFile else None
 
-        extractImpact  = "combineTool.py -M Impacts -d %s -m 125 -o impacts.json"%rootCardName
-        plotImpacts    = "plotImpacts.py -i impacts.json -o impacts"
-        combineCommand = ";".join( [ "cd %s"%combineDirname, scram, prepWorkspace, robustFit, impactFits, extractImpact, plotImpacts ] )
+        run    = "expected" if expected else "observed"
+        runner = ImpactRunner( self.shapeFile, combineDirname, nuisances=nuisances, options=options, workspaceOptions=workspaceOptions, setup=scram )
 
-        os.system(combineCommand)
+        if submitter:
+            nJobs = runner.submit( run, submitter=submitter )
+            if nJobs:
+                logger.info( "Submitted %i impact fits, call again when the jobs are done."%nJobs )
+                return
+        else:
+            failed = runner.run( run, nJobs=cores )
+            if failed:
+                logger.warning( "Impact fits failed for %s, see %s. Call again to rerun the missing fits."%( ", ".join( map( str, failed ) ), runner.fitDir( run ) ) )
+                return
+
+        pdf = runner.plot( run )
 
         plotName = "impacts"
         if self.bkgOnly: plotName += "_bkgOnly"
         if expected:     plotName += "_expected"
 
-        shutil.copyfile( combineDirname+"/impacts.pdf", "%s/%s.pdf"%(self.plotDirectory, plotName) )
+        shutil.copyfile( pdf, "%s/%s.pdf"%(self.plotDirectory, plotName) )
         if printPNG: # useful to get a visible plot in the www directory, for nothing else
             os.system("convert -trim %s/%s.pdf -density 150 -verbose -quality 100 -flatten -sharpen 0x1.0 -geometry 1600x1600 %s/%s.png"%( self.plotDirectory, plotName, self.plotDirectory, plotName) )
             copyIndexPHP( self.plotDirectory )
 
         logger.info("Impact plot created at %s/%s.pdf"%(self.plotDirectory, plotName) )
-        shutil.rmtree( combineDirname )
+        if not keepFits:
+            runner.clean( run )
+
+    def getCorrelationMatrix( self ):
+        # names of the fitted parameters and their correlation matrix as array
+        return self.__getFitDiagnostics().getCorrelationMatrix( fit="fit_b" if self.bkgOnly else "fit_s" )
 
     def getCorrelationHisto( self, systOnly=False ):
 
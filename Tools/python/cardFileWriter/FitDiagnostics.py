@@ -0,0 +1,151 @@
+''' Lazy reader of the combine FitDiagnostics output (*_shapeCard_FD.root).
+
+Objects are read from the ROOT file only when they are requested.
+The parameters (names, initial and final values and errors) and the correlation and covariance matrices of the
+RooFitResults fit_s and fit_b are converted to numpy arrays once and stored in a sidecar file next to the ROOT file
+(<rootFile>.fitResults.npz). The sidecar is valid as long as modification time and size of the ROOT file are unchanged,
+reading the fit results from it does not need ROOT.
+'''
+
+# Standard imports
+import os
+import copy
+import uuid
+import numpy as np
+
+# Logging
+import logging
+logger = logging.getLogger(__name__)
+
+# top level objects of the FitDiagnostics output
+fitObjects  = ["fit_b", "fit_s", "norm_prefit", "norm_fit_s", "norm_fit_b", "nuisances_prefit", "nuisances_prefit_res", "shapes_prefit", "shapes_fit_b", "shapes_fit_s", "overall_total_covar", "process_covar", "process_corr"]
+# RooFitResults that are converted to arrays
+fitResults  = ["fit_b", "fit_s"]
+
+def sidecar_file( rootFile ):
+    return rootFile + ".fitResults.npz"
+
+def source_key( rootFile ):
+    stat = os.stat( rootFile )
+    return np.array( [ stat.st_mtime, stat.st_size ], dtype=float )
+
+def argList_to_arrays( argList ):
+    ''' names, values and errors of the parameters of a RooArgList
+    '''
+    names, values, errors = [], [], []
+    for i in range( argList.getSize() ):
+        var = argList.at(i)
+        names.append( var.GetName() )
+        values.append( var.getValV() )
+        errors.append( var.getError() )
+    return np.array( names, dtype=str ), np.array( values, dtype=float ), np.array( errors, dtype=float )
+
+def matrix_to_array( matrix ):
+    ''' TMatrixDSym as ( n x n ) array
+    '''
+    n = matrix.GetNrows()
+    return np.array( [ [ matrix(i, j) for j in range(n) ] for i in range(n) ], dtype=float )
+
+def fitResult_to_arrays( fitResult ):
+    ''' Arrays of a RooFitResult. The matrices are in the order of the final parameters.
+    '''
+    res = {}
+    res["init_names"],  res["init_val"],  res["init_err"]  = argList_to_arrays( fitResult.floatParsInit() )
+    res["final_names"], res["final_val"], res["final_err"] = argList_to_arrays( fitResult.floatParsFinal() )
+    res["correlation"] = matrix_to_array( fitResult.correlationMatrix() )
+    res["covariance"]  = matrix_to_array( fitResult.covarianceMatrix() )
+    res["status"]      = np.array( [ fitResult.status(), fitResult.covQual(), fitResult.minNll() ], dtype=float )
+    return res
+
+class FitDiagnostics:
+
+    def __init__( self, rootFile, sidecar=True ):
+        '''
+        rootFile: FitDiagnostics output
+        sidecar:  read and write the fit results from/to the sidecar file
+        '''
+        if not os.path.exists( rootFile ):
+            raise ValueError( "FitDiagnostics file not found: %s" % rootFile )
+        self.rootFile  = rootFile
+        self.sidecar   = sidecar_file( rootFile ) if sidecar else None
+        self.tRootFile = None # keeps the pointer to the root file
+        self.objects   = {}
+        self.arrays    = {}
+
+        if self.sidecar and os.path.exists( self.sidecar ):
+            self.__loadSidecar()
+
+    def __loadSidecar( self ):
+        try:
+            with np.load( self.sidecar ) as f:
+                if not np.array_equal( f["source"], source_key( self.rootFile ) ):
+                    logger.debug( "Sidecar %s is outdated.", self.sidecar )
+                    return
+                for key in f.files:
+                    if key == "source": continue
+                    fit, name = key.split(":")
+                    self.arrays.setdefault( fit, {} )[name] = f[key]
+        except ( IOError, ValueError, KeyError ) as e:
+            logger.warning( "Could not read sidecar %s: %s", self.sidecar, e )
+            self.arrays = {}
+
+    def __writeSidecar( self ):
+        data = { "%s:%s" % ( fit, name ):array for fit, arrays in self.arrays.iteritems() for name, array in arrays.iteritems() }
+        data["source"] = source_key( self.rootFile )
+        # write to a temporary file and move, other processes must not read incomplete files
+        tmp_filename = self.sidecar + "." + str(uuid.uuid4()) + ".npz"
+        try:
+            np.savez( tmp_filename, **data )
+            os.rename( tmp_filename, self.sidecar )
+        except ( IOError, OSError ) as e:
+            logger.warning( "Could not write sidecar %s: %s", self.sidecar, e )
+            if os.path.exists( tmp_filename ):
+                os.remove( tmp_filename )
+
+    def get( self, key ):
+        ''' ROOT object of the FitDiagnostics output, read on first access
+        '''
+        if key in self.objects:
+            return self.objects[key]
+
+        import ROOT
+        if not self.tRootFile:
+            self.tRootFile = ROOT.TFile( self.rootFile, "READ" )
+
+        self.objects[key] = copy.copy( self.tRootFile.Get(key) )
+        return self.objects[key]
+
+    def getArrays( self, fit="fit_s" ):
+        ''' Arrays of the RooFitResult fit ( fit_s or fit_b ), from the sidecar if available
+        '''
+        if fit not in fitResults:
+            raise ValueError( "Unknown fit result %s. Use one of %s" % ( fit, ", ".join( fitResults ) ) )
+        if fit in self.arrays:
+            return self.arrays[fit]
+
+        fitResult = self.get( fit )
+        if not fitResult:
+            raise ValueError( "Fit result %s not found in %s" % ( fit, self.rootFile ) )
+        self.arrays[fit] = fitResult_to_arrays( fitResult )
+        if self.sidecar:
+            self.__writeSidecar()
+        return self.arrays[fit]
+
+    def getParameters( self, fit="fit_s", final=True ):
+        ''' names, values and errors of the initial or final parameters
+        '''
+        arrays = self.getArrays( fit=fit )
+        key    = "final" if final else "init"
+        return map( str, arrays[key+"_names"] ), arrays[key+"_val"], arrays[key+"_err"]
+
+    def getCorrelationMatrix( self, fit="fit_s" ):
+        ''' names of the final parameters and the correlation matrix
+        '''
+        arrays = self.getArrays( fit=fit )
+        return map( str, arrays["final_names"] ), arrays["correlation"]
+
+    def getCovarianceMatrix( self, fit="fit_s" ):
+        ''' names of the final parameters and the covariance matrix
+        '''
+        arrays = self.getArrays( fit=fit )
+        return map( str, arrays["final_names"] ), arrays["covariance"]
@@ -0,0 +1,221 @@
+''' Impact fits (combineTool.py -M Impacts) with resumable state.
+
+The workspace is compiled once per card and shared by all runs (e.g. expected and observed). It is only recompiled if the card or its shape files change.
+The fits of the nuisances are run one by one in a local pool of processes or are submitted with the batch submitters in Tools/scripts (submitBatch.py, submitCondor.py).
+Every successful fit leaves a marker file, an interrupted run or a run after batch jobs failed only repeats the missing fits.
+
+Usage:
+    runner = ImpactRunner( shapeCard, baseDir, nuisances = nuisances, options = "--robustFit 1 --rMin 0 --rMax 2" )
+    runner.run( "observed", nJobs = 8 )    # or runner.submit( "observed" ) and runner.run( "observed" ) once the jobs are done
+    pdf = runner.plot( "observed" )
+'''
+
+# Standard imports
+import os
+import shutil
+import subprocess
+from multiprocessing.pool import ThreadPool
+
+# Analysis
+from Analysis.Tools.cardFileWriter.CombineJobPool import content_hash
+
+# Logging
+import logging
+logger = logging.getLogger(__name__)
+
+def read_file( filename ):
+    if not os.path.exists( filename ): return None
+    with open( filename ) as f:
+        return f.read()
+
+class ImpactRunner:
+
+    def __init__( self, shapeCard, baseDir, nuisances = None, options = "", workspaceOptions = "", mass = 125, setup = None,
+                  combineTool = "combineTool.py", text2workspace = "text2workspace.py", plotImpacts = "plotImpacts.py" ):
+        '''
+        shapeCard:        shape card the workspace is made of, the shape files are copied with it
+        baseDir:          the workspace is in baseDir/workspace, the fits of a run in baseDir/<run>
+        nuisances:        parameters to run the fits for. If None, combineTool runs all fits in a single job (without resuming).
+        options:          options of the initial fit and the nuisance fits, e.g. "--robustFit 1 --rMin 0 --rMax 2"
+        workspaceOptions: options of text2workspace, e.g. "--X-allow-no-signal"
+        setup:            command executed before each command, e.g. "eval `scramv1 runtime -sh`"
+        combineTool, text2workspace, plotImpacts: executables
+        '''
+        self.shapeCard        = os.path.abspath( shapeCard )
+        self.baseDir          = os.path.abspath( baseDir )
+        self.nuisances        = list( nuisances ) if nuisances is not None else None
+        self.options          = options
+        self.workspaceOptions = workspaceOptions
+        self.mass             = mass
+        self.setup            = setup
+        self.combineTool      = combineTool
+        self.text2workspace   = text2workspace
+        self.plotImpacts      = plotImpacts
+
+        self.workspaceDir     = os.path.join( self.baseDir, "workspace" )
+        self.workspaceFile    = os.path.join( self.workspaceDir, os.path.basename( self.shapeCard ).replace( ".txt", ".root" ) )
+
+    def __command( self, command, directory ):
+        return ";".join( [ "cd %s" % directory ] + ( [ self.setup ] if self.setup else [] ) + [ command ] )
+
+    def __execute( self, command, logFile ):
+        with open( logFile, "a" ) as log:
+            return subprocess.call( command, shell = True, stdout = log, stderr = subprocess.STDOUT )
+
+    def __impacts( self, args ):
+        return "%s -M Impacts -d %s -m %s %s" % ( self.combineTool, self.workspaceFile, self.mass, args )
+
+    def fitDir( self, run ):
+        return os.path.join( self.baseDir, run )
+
+    def __marker( self, run, name ):
+        return os.path.join( self.fitDir( run ), ".done", name )
+
+    def workspace( self ):
+        ''' Compile the workspace if it does not exist or the card or its shape files changed. Returns the hash of the workspace.
+        '''
+        key      = content_hash( self.shapeCard, "text2workspace", "%s -m %s" % ( self.workspaceOptions, self.mass ) )
+        hashFile = os.path.join( self.workspaceDir, "workspace.hash" )
+        if os.path.exists( self.workspaceFile ) and read_file( hashFile ) == key:
+            logger.debug( "Using workspace %s", self.workspaceFile )
+            return key
+
+        if not os.path.isdir( self.workspaceDir ):
+            os.makedirs( self.workspaceDir )
+        if os.path.exists( hashFile ):
+            os.remove( hashFile )
+
+        # copy the card and the shape files with relative paths
+        shutil.copyfile( self.shapeCard, os.path.join( self.workspaceDir, os.path.basename( self.shapeCard ) ) )
+        with open( self.shapeCard ) as f:
+            for line in f:
+                tokens = line.split()
+                if len(tokens) < 4 or tokens[0] != "shapes" or tokens[3] == "FAKE" or os.path.isabs( tokens[3] ): continue
+                source = os.path.join( os.path.dirname( self.shapeCard ), tokens[3] )
+                if not os.path.exists( source ):
+                    logger.warning( "Shape file %s not found, text2workspace will fail if it is needed.", source )
+                    continue
+                target = os.path.join( self.workspaceDir, tokens[3] )
+                if os.path.exists( target ) and os.path.samefile( source, target ): continue
+                if not os.path.isdir( os.path.dirname( target ) ):
+                    os.makedirs( os.path.dirname( target ) )
+                shutil.copyfile( source, target )
+
+        logger.info( "Compiling workspace %s", self.workspaceFile )
+        command = "%s %s %s -m %s" % ( self.text2workspace, os.path.basename( self.shapeCard ), self.workspaceOptions, self.mass )
+        if self.__execute( self.__command( command, self.workspaceDir ), os.path.join( self.workspaceDir, "text2workspace.log" ) ) != 0 or not os.path.exists( self.workspaceFile ):
+            raise RuntimeError( "text2workspace failed, see %s" % os.path.join( self.workspaceDir, "text2workspace.log" ) )
+
+        with open( hashFile, "w" ) as f:
+            f.write( key )
+        return key
+
+    # combineTool does not always return the exit status of combine, a fit is successful if it wrote its output.
+    # The output is removed before the fit, such that an output of an earlier fit is not taken for a success.
+    def initialFitCommand( self, run ):
+        output = "higgsCombine_initialFit_Test.MultiDimFit.mH%s.root" % self.mass
+        return self.__command( "rm -f %s && %s && test -f %s && touch %s" % ( output, self.__impacts( "%s --doInitialFit" % self.options ), output, self.__marker( run, "initialFit" ) ), self.fitDir( run ) )
+
+    def fitCommand( self, run, nuisance, nJobs = 1 ):
+        ''' Fit of a single nuisance. If nuisances is None, all fits run in a single job with nJobs processes.
+        '''
+        if nuisance is None:
+            output = "higgsCombine_paramFit_Test_*.MultiDimFit.mH%s.root" % self.mass
+            return self.__command( "rm -f %s && %s && touch %s" % ( output, self.__impacts( "%s --doFits --parallel %i" % ( self.options, nJobs ) ), self.__marker( run, "allFits" ) ), self.fitDir( run ) )
+        output = "higgsCombine_paramFit_Test_%s.MultiDimFit.mH%s.root" % ( nuisance, self.mass )
+        return self.__command( "rm -f %s && %s && test -f %s && touch %s" % ( output, self.__impacts( "%s --doFits --named %s" % ( self.options, nuisance ) ), output, self.__marker( run, "paramFit_" + nuisance ) ), self.fitDir( run ) )
+
+    def pending( self, run ):
+        ''' Nuisances without successful fit, [None] if the fits of all nuisances run in a single job and did not succeed
+        '''
+        if self.nuisances is None:
+            return [] if os.path.exists( self.__marker( run, "allFits" ) ) else [ None ]
+        return [ nuisance for nuisance in self.nuisances if not os.path.exists( self.__marker( run, "paramFit_" + nuisance ) ) ]
+
+    def done( self, run ):
+        return os.path.exists( self.__marker( run, "initialFit" ) ) and len( self.pending( run ) ) == 0
+
+    def __prepare( self, run ):
+        ''' Workspace and initial fit, the initial fit is needed by all other fits
+        '''
+        key      = self.workspace()
+        doneDir  = os.path.join( self.fitDir( run ), ".done" )
+        hashFile = os.path.join( doneDir, "workspace.hash" )
+        if read_file( hashFile ) != key:
+            # fits of another workspace are not valid, neither their markers nor their outputs
+            if os.path.isdir( self.fitDir( run ) ):
+                logger.info( "Workspace changed, removing the fits of %s", run )
+                shutil.rmtree( self.fitDir( run ) )
+            os.makedirs( doneDir )
+            with open( hashFile, "w" ) as f:
+                f.write( key )
+
+        if not os.path.exists( self.__marker( run, "initialFit" ) ):
+            logger.info( "Running initial fit for %s", run )
+            self.__execute( self.initialFitCommand( run ), os.path.join( self.fitDir( run ), "initialFit.log" ) )
+            if not os.path.exists( self.__marker( run, "initialFit" ) ):
+                raise RuntimeError( "Initial fit failed, see %s" % os.path.join( self.fitDir( run ), "initialFit.log" ) )
+
+    def run( self, run, nJobs = 1 ):
+        ''' Run the missing fits in nJobs local processes. Returns the nuisances whose fit failed.
+        '''
+        self.__prepare( run )
+        pending = self.pending( run )
+        if len( pending ) == 0: return []
+
+        logger.info( "Running %i impact fits for %s in %i processes.", len( pending ), run, nJobs )
+        def execute( nuisance ):
+            logFile = os.path.join( self.fitDir( run ), "paramFit_%s.log" % nuisance if nuisance is not None else "fits.log" )
+            self.__execute( self.fitCommand( run, nuisance, nJobs = nJobs ), logFile )
+            return nuisance
+
+        pool = ThreadPool( processes = nJobs if self.nuisances is not None else 1 )
+        try:
+            for i_fit, nuisance in enumerate( pool.imap_unordered( execute, pending ) ):
+                logger.debug( "Finished fit %i/%i (%s)", i_fit+1, len( pending ), nuisance )
+        finally:
+            pool.terminate()
+            pool.join()
+
+        failed = self.pending( run )
+        if failed:
+            logger.warning( "%i impact fits failed for %s: %s", len( failed ), run, ", ".join( map( str, failed ) ) )
+        return failed
+
+    def submit( self, run, submitter = "submitBatch.py", submitterOptions = "" ):
+        ''' Run the initial fit and submit the missing fits with submitter, one job per fit. Returns the number of submitted jobs.
+        '''
+        self.__prepare( run )
+        pending = self.pending( run )
+        if len( pending ) == 0: return 0
+
+        commandFile = os.path.join( self.fitDir( run ), "impactFits.sh" )
+        with open( commandFile, "w" ) as f:
+            for nuisance in pending:
+                f.write( self.fitCommand( run, nuisance ) + "\n" )
+
+        logger.info( "Submitting %i impact fits for %s with %s", len( pending ), run, submitter )
+        subprocess.call( "%s %s %s" % ( submitter, submitterOptions, commandFile ), shell = True )
+        return len( pending )
+
+    def plot( self, run, name = "impacts" ):
+        ''' Collect the fits in <name>.json and plot them. Returns the path of <name>.pdf
+        '''
+        self.__prepare( run )
+        if not self.done( run ):
+            raise RuntimeError( "Impact fits for %s are not complete, missing: %s" % ( run, ", ".join( map( str, self.pending( run ) ) ) ) )
+
+        named   = " --named %s" % ",".join( self.nuisances ) if self.nuisances is not None else ""
+        command = " && ".join( [ self.__impacts( "-o %s.json%s" % ( name, named ) ), "%s -i %s.json -o %s" % ( self.plotImpacts, name, name ) ] )
+        self.__execute( self.__command( command, self.fitDir( run ) ), os.path.join( self.fitDir( run ), "plot.log" ) )
+
+        pdf = os.path.join( self.fitDir( run ), name + ".pdf" )
+        if not os.path.exists( pdf ):
+            raise RuntimeError( "Impact plot failed, see %s" % os.path.join( self.fitDir( run ), "plot.log" ) )
+        return pdf
+
+    def clean( self, run ):
+        ''' Remove the fits of a run, the workspace is kept
+        '''
+        if os.path.isdir( self.fitDir( run ) ):
+            shutil.rmtree( self.fitDir( run ) )
@@ -501,6 +501,15 @@ class cardFileWriter:
         return
 
 
+    def calcMany(self, fnames, method="limit", options="", nJobs=4, cacheDir=None):
+        ''' Run combine for many already written cards in parallel.
+            Yields ( fname, result ) as results become available, see CombineJobPool
+        '''
+        from Analysis.Tools.cardFileWriter.CombineJobPool import CombineJobPool, CombineJob
+        pool = CombineJobPool( nJobs=nJobs, cacheDir=cacheDir, workDir=self.releaseLocation, keepOutput=True )
+        for job, res in pool.run( [ CombineJob( fname, method, options=options ) for fname in fnames ] ):
+            yield job.card, res
+
     def calcSignif(self, fname="", options=""):
         import uuid, os
         ustr          = str(uuid.uuid4())
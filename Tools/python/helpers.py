@@ -92,17 +92,26 @@ def getSortedZCandidates(leptons):
             bestCandidates.append(m)
     return bestCandidates
 
-def getChain(sampleList, histname='', maxN=-1, treeName="Events"):
+def getChain(sampleList, histname='', maxN=-1, treeName="Events", scanner=None):
+    ''' scanner: optional RootFileScanner, checks the files in parallel and remembers the results in its ledger
+    '''
     if not type(sampleList)==type([]):
         sampleList_ = [sampleList]
     else:
         sampleList_= sampleList
+    def goodFiles(files):
+        if scanner is None:
+            return set(f for f in files if checkRootFile(f, checkForObjects=[treeName]))
+        good = {filename:valid for filename, valid, reason in scanner.scan(files)}
+        return set(f for f in files if good[f])
     c = ROOT.TChain(treeName)
     i=0
     for s in sampleList_:
         if type(s)==type(""):
-            for f in getFileList(s, histname, maxN):
-                if checkRootFile(f, checkForObjects=[treeName]):
+            files = getFileList(s, histname, maxN)
+            good  = goodFiles(files)
+            for f in files:
+                if f in good:
                     i+=1
                     c.Add(f)
                 else:
@@ -116,8 +125,10 @@ def getChain(sampleList, histname='', maxN=-1, treeName="Events"):
             if s.has_key('bins'):
                 for b in s['bins']:
                     dir = s['dirname'] if s.has_key('dirname') else s['dir']
-                    for f in getFileList(dir+'/'+b, histname, maxN):
-                        if checkRootFile(f, checkForObjects=[treeName]):
+                    files = getFileList(dir+'/'+b, histname, maxN)
+                    good  = goodFiles(files)
+                    for f in files:
+                        if f in good:
                             i+=1
                             c.Add(f)
                         else:
@@ -233,8 +244,29 @@ def getObjDict(c, prefix, variables, i):
 def getCollection(c, prefix, variables, counter_variable):
     return [getObjDict(c, prefix+'_', variables, i) for i in range(int(getVarValue(c, counter_variable)))]
 
-def getCutYieldFromChain(c, cutString = "(1)", cutFunc = None, weight = "weight", weightFunc = None, returnVar=False):
+# Cache for the Draw results of the yield and plot helpers, see setDrawCache
+drawCache = None
+
+def setDrawCache( directory ):
+    ''' Cache the results of getCutYieldFromChain, getYieldFromChain and getPlotFromChain in directory. No caching if None.
+    '''
+    global drawCache
+    if directory is None:
+        drawCache = None
+    else:
+        from Analysis.Tools.DrawCache import DrawCache
+        drawCache = DrawCache( directory )
+    return drawCache
+
+def getCutYieldFromChain(c, cutString = "(1)", cutFunc = None, weight = "weight", weightFunc = None, returnVar=False, cache=None):
+    cache = cache if cache is not None else drawCache
+    entryList = cache.getEntryList(c, cutString) if cache is not None else None
+    if entryList is not None:
+        # only read the events of the cached selection
+        c.SetEntryList(entryList)
     c.Draw(">>eList", cutString)
+    if entryList is not None:
+        c.SetEntryList(0)
     elist = ROOT.gDirectory.Get("eList")
     number_events = elist.GetN()
     res = 0.
@@ -255,31 +287,45 @@ def getCutYieldFromChain(c, cutString = "(1)", cutFunc = None, weight = "weight"
         return res, resVar
     return res
 
-def getYieldFromChain(c, cutString = "(1)", weight = "weight", returnError=False):
-    h = ROOT.TH1D('h_tmp', 'h_tmp', 1,0,2)
-    h.Sumw2()
-    c.Draw("1>>h_tmp", "("+weight+")*("+cutString+")", 'goff')
-    res = h.GetBinContent(1)
-    resErr = h.GetBinError(1)
+def getYieldFromChain(c, cutString = "(1)", weight = "weight", returnError=False, cache=None):
+    def draw():
+        h = ROOT.TH1D('h_tmp', 'h_tmp', 1,0,2)
+        h.Sumw2()
+        c.Draw("1>>h_tmp", "("+weight+")*("+cutString+")", 'goff')
+        res = h.GetBinContent(1)
+        resErr = h.GetBinError(1)
+        del h
+        return res, resErr
+    cache = cache if cache is not None else drawCache
+    if cache is not None:
+        res, resErr = cache.get(c, cutString, ('yield', weight), draw)
+    else:
+        res, resErr = draw()
 #  print "1>>h_tmp", weight+"*("+cutString+")",res,resErr
-    del h
     if returnError:
         return res, resErr
     return res
 
-def getPlotFromChain(c, var, binning, cutString = "(1)", weight = "weight", binningIsExplicit=False, addOverFlowBin=''):
-    if binningIsExplicit:
-        h = ROOT.TH1D('h_tmp', 'h_tmp', len(binning)-1, array('d', binning))
-#    h.SetBins(len(binning), array('d', binning))
-    else:
-        if len(binning)==6:
-            h = ROOT.TH2D('h_tmp', 'h_tmp', *binning)
+def getPlotFromChain(c, var, binning, cutString = "(1)", weight = "weight", binningIsExplicit=False, addOverFlowBin='', cache=None):
+    def draw():
+        if binningIsExplicit:
+            h = ROOT.TH1D('h_tmp', 'h_tmp', len(binning)-1, array('d', binning))
+#        h.SetBins(len(binning), array('d', binning))
         else:
-            h = ROOT.TH1D('h_tmp', 'h_tmp', *binning)
-    c.Draw(var+">>h_tmp", weight+"*("+cutString+")", 'goff')
-    res = h.Clone()
-    h.Delete()
-    del h
+            if len(binning)==6:
+                h = ROOT.TH2D('h_tmp', 'h_tmp', *binning)
+            else:
+                h = ROOT.TH1D('h_tmp', 'h_tmp', *binning)
+        c.Draw(var+">>h_tmp", weight+"*("+cutString+")", 'goff')
+        res = h.Clone()
+        h.Delete()
+        del h
+        return res
+    cache = cache if cache is not None else drawCache
+    if cache is not None:
+        res = cache.get(c, cutString, ('plot', var, tuple(binning), binningIsExplicit, weight), draw)
+    else:
+        res = draw()
     if addOverFlowBin.lower() == "upper" or addOverFlowBin.lower() == "both":
         nbins = res.GetNbinsX()
 #    print "Adding", res.GetBinContent(nbins + 1), res.GetBinError(nbins + 1)
@@ -0,0 +1,102 @@
+''' Vectorized Delta R cone queries on eta/phi/pt arrays.
+
+Single events: arrays of the objects of one event, results are matrices ( n1, n2 ).
+Batches of events: flat arrays of the objects of all events with offsets of length nEvents+1 (as in arrayHelpers.jagged_prod),
+only pairs within the same event are considered.
+Delta phi is computed as in helpers.deltaPhi, hence the results are identical to helpers.deltaR.
+'''
+
+# Standard imports
+from math import pi
+import numpy as np
+
+# Logging
+import logging
+logger = logging.getLogger(__name__)
+
+def to_arrays( objects, keys = ( 'eta', 'phi' ) ):
+    ''' Arrays of the values of a list of dicts (e.g. from helpers.getCollection)
+    '''
+    return tuple( np.array( [ o[key] for o in objects ], dtype = float ) for key in keys )
+
+def delta_phi( phi1, phi2 ):
+    ''' |phi2 - phi1| wrapped to [0, pi]
+    '''
+    dphi = np.asarray( phi2, dtype = float ) - np.asarray( phi1, dtype = float )
+    dphi = np.where( dphi >   pi, dphi - 2.0*pi, dphi )
+    dphi = np.where( dphi <= -pi, dphi + 2.0*pi, dphi )
+    return np.abs( dphi )
+
+def delta_r2_matrix( eta1, phi1, eta2, phi2 ):
+    ''' Delta R^2 between all objects of the first and the second collection, shape ( n1, n2 )
+    '''
+    eta1, phi1 = np.asarray( eta1, dtype = float )[:, np.newaxis], np.asarray( phi1, dtype = float )[:, np.newaxis]
+    eta2, phi2 = np.asarray( eta2, dtype = float )[np.newaxis, :], np.asarray( phi2, dtype = float )[np.newaxis, :]
+    return delta_phi( phi1, phi2 )**2 + ( eta1 - eta2 )**2
+
+def delta_r_matrix( eta1, phi1, eta2, phi2 ):
+    return np.sqrt( delta_r2_matrix( eta1, phi1, eta2, phi2 ) )
+
+def cone_sum( eta1, phi1, eta2, phi2, pt2, coneSize ):
+    ''' Sum of pt2 of the objects of the second collection with Delta R < coneSize for each object of the first collection
+    '''
+    inCone = delta_r2_matrix( eta1, phi1, eta2, phi2 ) < coneSize**2
+    return np.dot( inCone, np.asarray( pt2, dtype = float ) )
+
+def best_match( eta1, phi1, eta2, phi2, maxDeltaR = None ):
+    ''' Index of the closest object of the second collection for each object of the first collection.
+        -1 if the second collection is empty or the closest object is not within maxDeltaR.
+    '''
+    dr2 = delta_r2_matrix( eta1, phi1, eta2, phi2 )
+    if dr2.shape[1] == 0:
+        return -np.ones( dr2.shape[0], dtype = int )
+    res = np.argmin( dr2, axis = 1 )
+    if maxDeltaR is not None:
+        res[ dr2[ np.arange( dr2.shape[0] ), res ] >= maxDeltaR**2 ] = -1
+    return res
+
+def event_pairs( offsets1, offsets2 ):
+    ''' Flat indices ( i1, i2 ) of all pairs of objects of the first and the second collection in the same event
+    '''
+    offsets1 = np.asarray( offsets1, dtype = int )
+    offsets2 = np.asarray( offsets2, dtype = int )
+    n1 = np.diff( offsets1 )
+    n2 = np.diff( offsets2 )
+
+    # every object of the first collection is paired with all objects of the second collection of its event
+    event1 = np.repeat( np.arange( len(n1) ), n1 )
+    i1     = np.repeat( np.arange( offsets1[-1] ), n2[event1] )
+    # position of each pair within the block of its object
+    starts = np.repeat( np.cumsum( n2[event1] ) - n2[event1], n2[event1] )
+    i2     = offsets2[:-1][ event1[i1] ] + np.arange( len(i1) ) - starts
+    return i1, i2
+
+def delta_r2_pairs( eta1, phi1, offsets1, eta2, phi2, offsets2 ):
+    ''' ( i1, i2, Delta R^2 ) for all pairs of objects in the same event
+    '''
+    i1, i2 = event_pairs( offsets1, offsets2 )
+    dr2 = delta_phi( np.asarray( phi1, dtype = float )[i1], np.asarray( phi2, dtype = float )[i2] )**2 + ( np.asarray( eta1, dtype = float )[i1] - np.asarray( eta2, dtype = float )[i2] )**2
+    return i1, i2, dr2
+
+def cone_sum_jagged( eta1, phi1, offsets1, eta2, phi2, pt2, offsets2, coneSize ):
+    ''' cone_sum for a batch of events, returns a flat array like eta1
+    '''
+    i1, i2, dr2 = delta_r2_pairs( eta1, phi1, offsets1, eta2, phi2, offsets2 )
+    inCone = dr2 < coneSize**2
+    return np.bincount( i1[inCone], weights = np.asarray( pt2, dtype = float )[i2[inCone]], minlength = len(eta1) )
+
+def best_match_jagged( eta1, phi1, offsets1, eta2, phi2, offsets2, maxDeltaR = None ):
+    ''' best_match for a batch of events, returns flat indices into the second collection (-1 if there is no match)
+    '''
+    i1, i2, dr2 = delta_r2_pairs( eta1, phi1, offsets1, eta2, phi2, offsets2 )
+    res = -np.ones( len(eta1), dtype = int )
+    if len(i1) == 0: return res
+    # sort by object and Delta R, the first pair of each object is the best one; stable sort keeps the lowest index for ties
+    order = np.lexsort( ( dr2, i1 ) )
+    first = np.ones( len(order), dtype = bool )
+    first[1:] = i1[order][1:] != i1[order][:-1]
+    best  = order[first]
+    if maxDeltaR is not None:
+        best = best[ dr2[best] < maxDeltaR**2 ]
+    res[ i1[best] ] = i2[best]
+    return res
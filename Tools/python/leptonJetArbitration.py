@@ -2,7 +2,7 @@
 
 # https://github.com/CERN-PH-CMG/cmg-cmssw/blob/0fdfc10e2a2d4732cbb5d540b46543498cb6d006/PhysicsTools/Heppy/python/analyzers/objects/JetAnalyzer.py#L25-L49
 
-from Analysis.Tools.helpers import deltaR2
+from Analysis.Tools.kinematics import to_arrays, delta_r2_matrix
 
 def cleanJetsAndLeptons(jets, leptons, deltaR=0.4, arbitration = (lambda jet, lepton: lepton) ):
     # threshold
@@ -10,19 +10,22 @@ def cleanJetsAndLeptons(jets, leptons, deltaR=0.4, arbitration = (lambda jet, le
     # Assume jets and leptons are all good
     goodjet = [ True for jet in jets ]
     goodlep = [ True for lep in leptons ]
+    # Delta R^2 of all lepton-jet pairs
+    d2 = delta_r2_matrix( *( to_arrays( leptons ) + to_arrays( jets ) ) )
     for i_lep, lep in enumerate(leptons):
         i_jet_best, d2min = -1, dr2
-        for i_jet, jet in enumerate(jets):
-            d2i = deltaR2(lep, jet)
-            if d2i < dr2:
-                choice = arbitration(jet,lep)
-                if choice == jet:
-                   # if the two match, and we prefer the jet, then drop the lepton and be done
-                   goodlep[i_lep] = False
-                   break 
-                elif choice == (jet,lep) or choice == (lep,jet):
-                   # asked to keep both, so we don't consider this match
-                   continue
+        # only jets within the cone can match, in the order of the jets
+        for i_jet in ( d2[i_lep] < dr2 ).nonzero()[0]:
+            jet = jets[i_jet]
+            d2i = d2[i_lep][i_jet]
+            choice = arbitration(jet,lep)
+            if choice == jet:
+               # if the two match, and we prefer the jet, then drop the lepton and be done
+               goodlep[i_lep] = False
+               break 
+            elif choice == (jet,lep) or choice == (lep,jet):
+               # asked to keep both, so we don't consider this match
+               continue
             # find best match
             if d2i < d2min:
                 i_jet_best, d2min = i_jet, d2i
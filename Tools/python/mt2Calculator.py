@@ -1,5 +1,191 @@
 import ROOT, array
 from math import pi, sqrt, cos, sin
+import numpy as np
+
+# Batch evaluation: numpy port of the massless case of mt2_bisect.cpp.
+# All MT2 variants below use massless visible systems, as the mt2Calculator class does.
+RELATIVE_PRECISION = 0.00001
+SCANSTEP           = 0.1
+SCANSTEP_BLOCK     = 100
+
+def _nsols_massless( Dsq, Ea, Easq, pax_positive, mnsq, a2, b2, c2, d21, d20, e21, e20, f22, f21, f20 ):
+    ''' Number of solutions from the Sturm sequence, as mt2::nsols_massless
+    '''
+    delta = Dsq/(2*Easq)
+    d2    = d21*delta+d20
+    e2    = e21*delta+e20
+    f2    = f22*delta*delta+f21*delta+f20
+
+    a = np.where( pax_positive,  Ea/Dsq, -Ea/Dsq )
+    b = np.where( pax_positive, -Dsq/(4*Ea)+mnsq*Ea/Dsq, Dsq/(4*Ea)-mnsq*Ea/Dsq )
+
+    A4 = a*a*a2
+    A3 = 2*a*b2/Ea
+    A2 = (2*a*a2*b+c2+2*a*d2)/(Easq)
+    A1 = (2*b*b2+2*e2)/(Easq*Ea)
+    A0 = (a2*b*b+2*b*d2+f2)/(Easq*Easq)
+
+    # long double where the C++ code uses long double
+    ld   = np.longdouble
+    A3sq = ld(A3)*ld(A3)
+    B3   = ld(4*A4)
+    B2   = ld(3*A3)
+    B1   = ld(2*A2)
+    B0   = ld(A1)
+    C2   = -(ld(A2/2) - 3*A3sq/ld(16*A4))
+    C1   = ld( -(3*A1/4. -A2*A3/(8*A4)) )
+    C0   = ld( -A0 + A1*A3/(16*A4) )
+    D1   = -B1 - (B3*C1*C1/C2 - B3*C0 -B2*C1)/C2
+    D0   = -B0 - B3 *C0 *C1/(C2*C2)+ B2*C0/C2
+    E0   = -C0 - C2*D0*D0/(D1*D1) + C1*D0/D1
+
+    t = [ ld(A4), ld(A4), C2, D1, E0 ]
+    nsol = sum( (t[i]*t[i+1]>0).astype(int) for i in range(4) ) - sum( (t[i]*t[i+1]<0).astype(int) for i in range(4) )
+    return np.maximum( nsol, 0 )
+
+def mt2_massless( pax, pay, pbx, pby, pmissx, pmissy, mn ):
+    ''' MT2 for arrays of transverse momenta of two massless visible systems pa, pb, the missing transverse momentum pmiss and the invisible mass mn.
+        Bisection for all events at once, the result agrees with mt2::get_mt2 within its precision.
+    '''
+    pax, pay, pbx, pby, pmissx, pmissy, mn = np.broadcast_arrays( *[ np.asarray( x, dtype = float ) for x in ( pax, pay, pbx, pby, pmissx, pmissy, mn ) ] )
+    shape = pax.shape
+    pax, pay, pbx, pby, pmissx, pmissy, mn = [ x.flatten() for x in ( pax, pay, pbx, pby, pmissx, pmissy, mn ) ]
+
+    with np.errstate( divide = 'ignore', invalid = 'ignore' ):
+        #normalize max{Ea, Eb, pmiss} to 100
+        scale = np.maximum( np.sqrt( pax*pax+pay*pay ), np.sqrt( pbx*pbx+pby*pby ) )/100.
+        scale = np.where( np.sqrt( pmissx*pmissx+pmissy*pmissy )/100 > scale, np.sqrt( pmissx*pmissx+pmissy*pmissy )/100, scale )
+        pax, pay, pbx, pby, pmissx, pmissy, mn = [ x/scale for x in ( pax, pay, pbx, pby, pmissx, pmissy, np.abs(mn) ) ]
+        pmisssq   = pmissx*pmissx + pmissy*pmissy
+        mnsq      = mn*mn
+        precision = 100.*RELATIVE_PRECISION
+
+        #rotate so that pay = 0
+        theta  = np.arctan( pay/pax )
+        s, c   = np.sin( theta ), np.cos( theta )
+        Easq   = pax*pax+pay*pay
+        Ebsq   = pbx*pbx+pby*pby
+        Ea     = np.sqrt( Easq )
+        Eb     = np.sqrt( Ebsq )
+        pax    = pax*c+pay*s
+        pbx, pby       = pbx*c+pby*s, -s*pbx+c*pby
+        pmissx, pmissy = pmissx*c+pmissy*s, -s*pmissx+c*pmissy
+
+        pbpmiss = pbx*pmissx + pby*pmissy
+        coeffs  = [ Ea, Easq, pax > 0, mnsq,
+            1-pbx*pbx/(Ebsq), -pbx*pby/(Ebsq), 1-pby*pby/(Ebsq),                                                                   # a2, b2, c2
+            (Easq*pbx)/Ebsq, - pmissx + (pbx*pbpmiss)/Ebsq, (Easq*pby)/Ebsq, - pmissy + (pby*pbpmiss)/Ebsq,                      # d21, d20, e21, e20
+            -(Easq*Easq/Ebsq), -2*Easq*pbpmiss/Ebsq, mnsq + pmisssq - pbpmiss*pbpmiss/Ebsq ]                                    # f22, f21, f20
+        nsols  = lambda Dsq, idx: _nsols_massless( Dsq, *[ x[idx] for x in coeffs ] )
+
+        res  = np.zeros( len(pax) )
+        todo = np.arange( len(pax) )
+
+        Deltasq_low = np.full( len(pax), precision )
+        nsols_low   = nsols( Deltasq_low, todo )
+        done        = nsols_low > 1
+        res[done]   = mn[done]
+        todo        = todo[~done]
+
+        #look for when both parablos contain origin
+        Deltasq_high1 = 2*Eb*np.sqrt(pmissx*pmissx+pmissy*pmissy+mnsq)-2*pbx*pmissx-2*pby*pmissy
+        Deltasq_high2 = 2*Ea*mn
+        Deltasq_high  = np.where( Deltasq_high1 < Deltasq_high2, Deltasq_high2, Deltasq_high1 )
+        nsols_high    = nsols( Deltasq_high, np.arange( len(pax) ) )
+
+        # scan upwards if the upper bound has the same number of solutions, SCANSTEP_BLOCK steps at a time
+        scan    = todo[ nsols_high[todo] == nsols_low[todo] ]
+        mass    = mn[scan] + SCANSTEP
+        maxmass = np.sqrt( mnsq[scan] + Deltasq_high[scan] )
+        while len(scan)>0:
+            # consecutive additions as in the C++ loop
+            masses  = np.cumsum( np.column_stack( [ mass ] + [ np.full( len(scan), SCANSTEP ) ]*( SCANSTEP_BLOCK-1 ) ), axis = 1 )
+            Dsq     = masses*masses - mnsq[scan][:,np.newaxis]
+            n       = nsols( Dsq.flatten(), np.repeat( scan, SCANSTEP_BLOCK ) ).reshape( Dsq.shape )
+            hit     = ( masses < maxmass[:,np.newaxis] ) & ( n > 0 )
+
+            found   = hit.any( axis = 1 )
+            first   = np.argmax( hit, axis = 1 )[found]
+            rows    = np.arange( len(scan) )[found]
+            Deltasq_high[scan[found]] = Dsq[rows, first]
+            nsols_high[scan[found]]   = n[rows, first]
+            Deltasq_low[scan[found]]  = (masses[rows, first]-SCANSTEP)*(masses[rows, first]-SCANSTEP) - mnsq[scan[found]]
+
+            # Deltasq_high not found
+            notfound = ~found & ~( masses[:,-1] < maxmass )
+            res[scan[notfound]] = np.sqrt( Deltasq_low[scan[notfound]] + mnsq[scan[notfound]] )
+            todo     = np.setdiff1d( todo, scan[notfound] )
+
+            more = ~found & ~notfound
+            scan, mass, maxmass = scan[more], masses[more,-1]+SCANSTEP, maxmass[more]
+
+        # still the same number of solutions
+        error       = todo[ nsols_high[todo] == nsols_low[todo] ]
+        res[error]  = np.sqrt( mnsq[error] + Deltasq_low[error] )
+        todo        = np.setdiff1d( todo, error )
+
+        # bisection
+        minmass = np.sqrt( Deltasq_low[todo]  + mnsq[todo] )
+        maxmass = np.sqrt( Deltasq_high[todo] + mnsq[todo] )
+        active  = maxmass - minmass > precision
+        while np.any( active ):
+            idx       = todo[active]
+            midmass   = (minmass[active]+maxmass[active])/2.
+            nsols_mid = nsols( midmass*midmass - mnsq[idx], idx )
+            minmass[active] = np.where( nsols_mid == nsols_low[idx], midmass, minmass[active] )
+            maxmass[active] = np.where( nsols_mid != nsols_low[idx], midmass, maxmass[active] )
+            active    = maxmass - minmass > precision
+        res[todo] = minmass
+
+    return ( res*scale ).reshape( shape )
+
+def _pxpy( pt, phi ):
+    pt, phi = np.asarray( pt, dtype = float ), np.asarray( phi, dtype = float )
+    return pt*np.cos( phi ), pt*np.sin( phi )
+
+def _mass( *vectors ):
+    ''' Invariant mass of the sum of ( pt, eta, phi, m ) arrays, negative for space like vectors as TLorentzVector::M
+    '''
+    px, py, pz, E = 0., 0., 0., 0.
+    for pt, eta, phi, m in vectors:
+        pt, eta, phi = np.asarray( pt, dtype = float ), np.asarray( eta, dtype = float ), np.asarray( phi, dtype = float )
+        px_, py_, pz_ = pt*np.cos( phi ), pt*np.sin( phi ), pt*np.sinh( eta )
+        px, py, pz, E = px+px_, py+py_, pz+pz_, E+np.sqrt( px_*px_+py_*py_+pz_*pz_+m*m )
+    m2 = E*E-px*px-py*py-pz*pz
+    return np.where( m2 < 0, -np.sqrt( np.abs(m2) ), np.sqrt( np.abs(m2) ) )
+
+def mt2ll_array( met_pt, met_phi, l1_pt, l1_phi, l2_pt, l2_phi, mt2Mass = 0. ):
+    ''' Traditional MT2 for arrays of events
+    '''
+    return mt2_massless( *( _pxpy( l1_pt, l1_phi ) + _pxpy( l2_pt, l2_phi ) + _pxpy( met_pt, met_phi ) + ( mt2Mass, ) ) )
+
+def mt2bb_array( met_pt, met_phi, l1_pt, l1_phi, l2_pt, l2_phi, b1_pt, b1_phi, b2_pt, b2_phi, mt2Mass = 80.4 ):
+    ''' MT2bb for arrays of events (treating leptons invisibly, endpoint at top mass)
+    '''
+    met_px, met_py = _pxpy( met_pt, met_phi )
+    l1_px,  l1_py  = _pxpy( l1_pt, l1_phi )
+    l2_px,  l2_py  = _pxpy( l2_pt, l2_phi )
+    return mt2_massless( *( _pxpy( b1_pt, b1_phi ) + _pxpy( b2_pt, b2_phi ) + ( met_px+(l1_px+l2_px), met_py+(l1_py+l2_py), mt2Mass ) ) )
+
+def mt2blbl_array( met_pt, met_phi, l1_pt, l1_eta, l1_phi, l2_pt, l2_eta, l2_phi, b1_pt, b1_eta, b1_phi, b2_pt, b2_eta, b2_phi, mt2Mass = 0., leptonMass = 0., bjetMass = 0. ):
+    ''' MT2blbl for arrays of events, lepton/bjet pairing by minimizing maximum mass
+    '''
+    l1, l2 = ( l1_pt, l1_eta, l1_phi, leptonMass ), ( l2_pt, l2_eta, l2_phi, leptonMass )
+    b1, b2 = ( b1_pt, b1_eta, b1_phi, bjetMass ),   ( b2_pt, b2_eta, b2_phi, bjetMass )
+    max1 = np.maximum( _mass( l1, b1 ), _mass( l2, b2 ) )
+    max2 = np.maximum( _mass( l1, b2 ), _mass( l2, b1 ) )
+    #Choose pairing with smaller invariant mass
+    pairing1 = max1 < max2
+
+    l1_px, l1_py = _pxpy( l1_pt, l1_phi )
+    l2_px, l2_py = _pxpy( l2_pt, l2_phi )
+    b1_px, b1_py = _pxpy( b1_pt, b1_phi )
+    b2_px, b2_py = _pxpy( b2_pt, b2_phi )
+    bl1_px = np.where( pairing1, l1_px+b1_px, l1_px+b2_px )
+    bl1_py = np.where( pairing1, l1_py+b1_py, l1_py+b2_py )
+    bl2_px = np.where( pairing1, l2_px+b2_px, l2_px+b1_px )
+    bl2_py = np.where( pairing1, l2_py+b2_py, l2_py+b1_py )
+    return mt2_massless( *( ( bl1_px, bl1_py, bl2_px, bl2_py ) + _pxpy( met_pt, met_phi ) + ( mt2Mass, ) ) )
 
 #wrapper class for MT2 variables
 class mt2Calculator:
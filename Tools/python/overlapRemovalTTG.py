@@ -3,7 +3,7 @@ import ROOT
 import copy
 from math import isnan
 
-from Analysis.Tools.helpers         import deltaR
+from Analysis.Tools.kinematics      import to_arrays, delta_r_matrix
 
 """ 
 Make sure you use nMax = 1000 (or large number) when reading in genParts from nanoAOD using VectorTreeVariable.fromString('GenPart[%s]'%variables, nMax = 1000)
@@ -11,45 +11,119 @@ These functions use gen-matching where the references to ALL gen particles are n
 
 """ 
 
+def genealogy_key( genParticles ):
+    ''' Everything the ancestor chains depend on
+    '''
+    return tuple( ( g["index"], g["genPartIdxMother"], g["pdgId"] ) for g in genParticles )
+
+class Genealogy:
+    ''' Index of the gen particles of an event. Ancestor chains are computed once per particle and shared by all functions of this module.
+        Particles are found via their "index", hence the genParticles list can be sorted or filtered.
+    '''
+    def __init__( self, genParticles, key = None ):
+        self.key           = key if key is not None else genealogy_key( genParticles )
+        self.setParticles( genParticles )
+        # index of a particle -> indices of the particle and all its ancestors
+        self.chains        = {}
+        self.chainSets     = {}
+
+    def setParticles( self, genParticles ):
+        ''' The particle dicts returned by get, the genealogy must be the same
+        '''
+        self.genParticles  = genParticles
+        self.byIndex       = {}
+        for genParticle in genParticles:
+            # first match, as the list comprehension before
+            self.byIndex.setdefault( genParticle["index"], genParticle )
+
+    def get( self, index ):
+        return self.byIndex.get( index )
+
+    def endsInLoop( self, chain ):
+        ''' A chain ends either at a missing mother or at a generator loop
+        '''
+        if not chain: return False
+        mother = self.byIndex[chain[-1]]['genPartIdxMother']
+        return mother >= 0 and mother in self.byIndex
+
+    def chain( self, index ):
+        ''' Indices of the particle and its ancestors. Ends at a missing mother or when an index repeats.
+        '''
+        if index in self.chains: return self.chains[index]
+        res     = []
+        visited = set()
+        while index >= 0 and index in self.byIndex and index not in visited:
+            if index in self.chains:
+                # the walk follows the cached chain up to the first index that repeats
+                for i in self.chains[index]:
+                    if i in visited: break
+                    res.append( i )
+                    visited.add( i )
+                break
+            res.append( index )
+            visited.add( index )
+            index = self.byIndex[index]['genPartIdxMother']
+        if self.endsInLoop( res ):
+            # generator loop, the chains of the ancestors end at a different index
+            self.chains[res[0]] = res
+        else:
+            for i_res, i in enumerate( res ):
+                self.chains.setdefault( i, res[i_res:] )
+        return res
+
+    def parentIndices( self, g ):
+        if g['genPartIdxMother'] < 0 or g['genPartIdxMother'] not in self.byIndex: return []
+        return list( self.chain( g['genPartIdxMother'] ) )
+
+    def parentIds( self, g ):
+        return [ self.byIndex[index]['pdgId'] for index in self.parentIndices( g ) ]
+
+    def hasAncestor( self, g, index ):
+        ''' Is the particle with index an ancestor of g?
+        '''
+        mother = g['genPartIdxMother']
+        if mother < 0 or mother not in self.byIndex: return False
+        if mother not in self.chainSets:
+            self.chainSets[mother] = set( self.chain( mother ) )
+        return index in self.chainSets[mother]
+
+# Genealogy of the last event
+_genealogy = None
+
+def getGenealogy( genParticles ):
+    ''' Genealogy for the genParticles list, re-used as long as indices, mothers and pdgIds of the particles are the same
+    '''
+    global _genealogy
+    key = genealogy_key( genParticles )
+    if _genealogy is None or _genealogy.key != key:
+        _genealogy = Genealogy( genParticles, key = key )
+    else:
+        # same genealogy, but the list or its dicts may be new
+        _genealogy.setParticles( genParticles )
+    return _genealogy
+
 def isIsolatedPhoton( g, genparts, coneSize=0.2, ptCut=5, excludedPdgIds=[ 12, -12, 14, -14, 16, -16 ] ):
-    for other in genparts:
+    genealogy = getGenealogy( genparts )
+    dr        = delta_r_matrix( *( to_arrays( [g] ) + to_arrays( genparts ) ) )[0]
+    for i_other, other in enumerate( genparts ):
         if other["index"] == g["index"]:             continue # same particle
         if other['pdgId']              == 22:        continue   # Avoid photon or generator copies of it
         if other['pdgId'] in excludedPdgIds:         continue   # Avoid particles you don't want to consider (e.g. neutrinos)
         if other['status']             != 1:         continue   # Only final state particles
         if other['pt']                  < ptCut:     continue   # pt > 5
-        if deltaR( g, other )           >= coneSize: continue   # check deltaR
-        if g["index"] in getParentIndices( other, genparts ): continue # check if the particle is a decay particle of the photon, if so, ignore those
+        if dr[i_other]                  >= coneSize: continue   # check deltaR
+        if genealogy.hasAncestor( other, g["index"] ): continue # check if the particle is a decay particle of the photon, if so, ignore those
         return False
     return True
 
 # Run through parents in genparticles, and return list of their pdgId
 def getParentIds( g, genParticles ):
-  parents = []
-
-  if g['genPartIdxMother'] >= 0:
-    try:
-        # This is safer than "genParticles[ g['genPartIdxMother'] ]", as the genParticles list can be sorted first, however it requires to add "index" in the dict before sorting
-        mother1  = [ genParticle for genParticle in genParticles if genParticle["index"] == g['genPartIdxMother'] ][0]
-        parents += [ mother1['pdgId'] ] + getParentIds( mother1, genParticles )
-    except:
-        # when no 'status' selection is made for g, this can run in a kind of endless-loop, then python throws an Exception
-        return parents
-  return parents
+    # The genParticles are found via "index", hence the genParticles list can be sorted first, however it requires to add "index" in the dict before sorting
+    return getGenealogy( genParticles ).parentIds( g )
 
 # Run through parents in genparticles, and return list of their indices
 def getParentIndices( g, genParticles ):
-  parents = []
-
-  if g['genPartIdxMother'] >= 0:
-    try:
-        # This is safer than "genParticles[ g['genPartIdxMother'] ]", as the genParticles list can be sorted first, however it requires to add "index" in the dict before sorting
-        mother1  = [ genParticle for genParticle in genParticles if genParticle["index"] == g['genPartIdxMother'] ][0]
-        parents += [ mother1['index'] ] + getParentIndices( mother1, genParticles )
-    except:
-        # when no 'status' selection is made for g, this can run in a kind of endless-loop, then python throws an Exception
-        return parents
-  return parents
+    return getGenealogy( genParticles ).parentIndices( g )
 
 def hasMesonMother( parentList ):
     if not parentList: return False
@@ -110,7 +184,8 @@ def getAdvancedPhotonCategory( recoPart, genParts, coneSize=0.3, ptCut=5., exclu
 
     # nanoAOD genMatch found, just take that, do standard categorization
     if recoPart['genPartIdx'] >= 0:
-        gen = filter( lambda g: g['index']==recoPart['genPartIdx'], genParts )[0]
+        gen = getGenealogy( genParts ).get( recoPart['genPartIdx'] )
+        if gen is None: raise IndexError( "Gen particle %i not found." % recoPart['genPartIdx'] )
         return getPhotonCategory( gen, genParts ) # standard photon categories
 
     rec = { val:recoPart[val] for val in ["pt","eta","phi","genPartIdx"] }
@@ -136,7 +211,7 @@ def getAdvancedPhotonCategory( recoPart, genParts, coneSize=0.3, ptCut=5., exclu
     # thus check for these kind of events with deltaR matching
 
     # get all deltaR values to the reco photon
-    genAll  = [ (g, deltaR( recoPart, g )) for g in gParts ]
+    genAll  = zip( gParts, delta_r_matrix( *( to_arrays( [recoPart] ) + to_arrays( gParts ) ) )[0] )
     # filter gen particle collection to only those in the delta R cone
     genCone = filter( lambda (gen, dr): dr < coneSize, genAll ) if coneSize > 0 else genAll
 
@@ -175,26 +250,26 @@ def addParticle( to, add ):
 
 def addParticlesInCone( to, add, coneSize=0. ):
     # add particles from the add collection to particles from the to collection, if they are within a certain coneSize
-    # one of the worst functions ever, sorry
     if coneSize <= 0: return copy.copy(to), copy.copy(add)
 
-    add_ = copy.copy(add)
-    to_  = []
+    # Delta R of all pairs, with respect to the original to-particles
+    dr        = delta_r_matrix( *( to_arrays( to ) + to_arrays( add ) ) )
+    remaining = [ True for a in add ]
+    to_       = []
 
-    for t in to:
+    for i_t, t in enumerate( to ):
 
-        removeIndex = []
-        t_comb      = copy.copy(t)
+        t_comb = copy.copy(t)
 
-        for i, a in enumerate( add_ ):
-            if deltaR( t, a ) > coneSize: continue # no close particle, no particle to add
+        for i, a in enumerate( add ):
+            if not remaining[i]:      continue # already added to another particle
+            if dr[i_t][i] > coneSize: continue # no close particle, no particle to add
             t_comb = addParticle( t_comb, a )
-            removeIndex.append(i)
+            remaining[i] = False
             
         to_.append( t_comb )
-        add_ = [ g for i, g in enumerate( add_ ) if i not in removeIndex ]
 
-    return to_, add_
+    return to_, [ a for i, a in enumerate( add ) if remaining[i] ]
 
 def calculateGenIso( g, genParts, coneSize=0.3, ptCut=5., excludedPdgIds=[ 12, -12, 14, -14, 16, -16 ], chgIso=False ):
 
@@ -204,7 +279,8 @@ def calculateGenIso( g, genParts, coneSize=0.3, ptCut=5., excludedPdgIds=[ 12, -
     gParts = filter( lambda p: p['status'] == 1 and p['pt']>ptCut and p['pdgId'] not in excludedPdgIds and not (p['pt']==g['pt'] and p['eta']==g['eta'] and p['phi']==g['phi']), genParts )
 
     # filter gen particles in cone
-    gParts = [ (p, deltaR( g, p )) for p in gParts ]
+    dr     = delta_r_matrix( *( to_arrays( [g] ) + to_arrays( gParts ) ) )[0]
+    gParts = zip( gParts, dr )
     gParts = filter( lambda (p, dr): dr < coneSize, gParts ) if coneSize > 0 else gParts
     if not gParts: return 0.
 
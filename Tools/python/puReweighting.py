@@ -3,8 +3,11 @@
 #Standard imports
 import ROOT, os
 
+import numpy as np
+
 # helpers
 from Analysis.Tools.helpers import getObjFromFile
+from Analysis.Tools.arrayHelpers import HistoLookup
 
 # Logging
 import logging
@@ -12,6 +15,9 @@ logger = logging.getLogger(__name__)
 
 puDataPath = "$CMSSW_BASE/src/Analysis/Tools/data/puReweightingData/"
 
+# Process wide registry of reweighting histos and their array copies, data files are read only once
+_registry = {}
+
 def extendHistoTo(h, hc):
     logger.info( "Extend histo h to nbins of hc" )
     res = ROOT.TH1D( h.GetName() + "_extended", h.GetTitle(), hc.GetNbinsX(), hc.GetXaxis().GetXmin(), hc.GetXaxis().GetXmax() )
@@ -24,8 +30,12 @@ def extendHistoTo(h, hc):
         res.SetBinContent( i, h.GetBinContent(i) )
     return res
 
-#Define a functor that returns a reweighting-function according to the era
-def getReweightingFunction( data="PU_2100_XSecCentral", mc="Spring15" ):
+def getReweightingHisto( data="PU_2100_XSecCentral", mc="Spring15" ):
+    ''' Ratio of the normalized data and MC pileup profiles. Cached if mc is the name of a MC profile.
+    '''
+    key = ( 'histo', data, mc )
+    if isinstance( mc, basestring ) and key in _registry:
+        return _registry[key]
 
     # Data
     fileNameData = puDataPath + "%s.root" % data
@@ -49,6 +59,27 @@ def getReweightingFunction( data="PU_2100_XSecCentral", mc="Spring15" ):
     # Create reweighting histo
     reweightingHisto = histoData.Clone( '_'.join( [ 'reweightingHisto', data ] ) )
     reweightingHisto.Divide(mcProfile)
+    reweightingHisto.SetDirectory(0)
+
+    if isinstance( mc, basestring ):
+        _registry[key] = reweightingHisto
+    return reweightingHisto
+
+def getReweightingLookup( data="PU_2100_XSecCentral", mc="Spring15" ):
+    ''' Array copy (HistoLookup) of getReweightingHisto
+    '''
+    key = ( 'lookup', data, mc )
+    if isinstance( mc, basestring ) and key in _registry:
+        return _registry[key]
+    lookup = HistoLookup.fromHisto( getReweightingHisto( data, mc ) )
+    if isinstance( mc, basestring ):
+        _registry[key] = lookup
+    return lookup
+
+#Define a functor that returns a reweighting-function according to the era
+def getReweightingFunction( data="PU_2100_XSecCentral", mc="Spring15" ):
+
+    reweightingHisto = getReweightingHisto( data, mc )
 
     # Define reweightingFunc
     def reweightingFunc( nvtx ):
@@ -61,12 +92,67 @@ def getNVTXReweightingFunction( key, filename="dilepton_allZ_isOS_4000pb4000_80X
     if not key in ['rw', 'up', 'down', 'vup', 'vdown']:
         raise ValueError( "Need to specify value PU reweighting key" )
 
-    # 2016 PU reweighting with sigma(QCD) uncertainty
-    import pickle, os
-    data = pickle.load( file( os.path.expandvars( puDataPath + filename ) ) )
-    h = data[key]
+    h = getNVTXReweightingData( filename )[key]
     def reweightingFunc( nvtx ):
         ib = h.FindBin( nvtx )
         return h.GetBinContent( ib )
 
     return reweightingFunc
+
+def getNVTXReweightingData( filename="dilepton_allZ_isOS_4000pb4000_80X.pkl" ):
+    ''' Histos of the NVTX reweighting, loaded once per process
+    '''
+    key = ( 'nvtx', filename )
+    if key not in _registry:
+        # 2016 PU reweighting with sigma(QCD) uncertainty
+        import pickle
+        _registry[key] = pickle.load( file( os.path.expandvars( puDataPath + filename ) ) )
+    return _registry[key]
+
+def getNVTXReweightingLookup( key, filename="dilepton_allZ_isOS_4000pb4000_80X.pkl" ):
+    ''' Array copy (HistoLookup) of the NVTX reweighting histo
+    '''
+    if not key in ['rw', 'up', 'down', 'vup', 'vdown']:
+        raise ValueError( "Need to specify value PU reweighting key" )
+
+    if ( 'nvtx_lookup', key, filename ) not in _registry:
+        _registry[( 'nvtx_lookup', key, filename )] = HistoLookup.fromHisto( getNVTXReweightingData( filename )[key] )
+    return _registry[( 'nvtx_lookup', key, filename )]
+
+class PUReweighting:
+    ''' Pileup weights of all variations for arrays of nTrueInt.
+    Usage:
+        puReweighting = PUReweighting( "PU_2018_59740_XSec", "Autumn18" )
+        weights = puReweighting.evaluate( nTrueInt ) # { 'Central':array, 'Up':array, ... }
+    '''
+    variations = [ 'Central', 'Up', 'Down', 'VUp', 'VDown', 'VVUp' ]
+
+    def __init__( self, data = "PU_2016_35920_XSec", mc = "Summer16", variations = None ):
+        '''
+        data:       name of the data profiles without the variation, e.g. PU_2016_35920_XSec
+        mc:         name of the MC profile or a histogram
+        variations: subset of PUReweighting.variations
+        '''
+        self.variations = variations if variations is not None else PUReweighting.variations
+        for variation in self.variations:
+            if variation not in PUReweighting.variations:
+                raise ValueError( "Unknown variation %s. Use %s." % ( variation, ", ".join( PUReweighting.variations ) ) )
+
+        lookups = [ getReweightingLookup( data + variation, mc ) for variation in self.variations ]
+        # all data profiles have the same binning, one bin search for all variations
+        for lookup in lookups[1:]:
+            if not np.array_equal( lookup.edges[0], lookups[0].edges[0] ):
+                raise ValueError( "Data profiles %s have different binnings." % data )
+        self.edges   = lookups[0].edges
+        self.weights = np.column_stack( [ lookup.contents for lookup in lookups ] )
+
+    def evaluate_array( self, nTrueInt ):
+        ''' Weights of shape ( len(nTrueInt), len(variations) )
+        '''
+        return self.weights[ np.searchsorted( self.edges[0], np.asarray( nTrueInt, dtype = float ), side = 'right' ) ]
+
+    def evaluate( self, nTrueInt ):
+        ''' Dictionary of the weights per variation
+        '''
+        weights = self.evaluate_array( nTrueInt )
+        return { variation:weights[..., i] for i, variation in enumerate( self.variations ) }
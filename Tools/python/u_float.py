@@ -1,11 +1,16 @@
 ''' Class to hold a float and it's Gaussian uncertainty.
+    u_array holds arrays of values and uncertainties with the same propagation rules.
 '''
 from math import sqrt
 import numbers
+import numpy as np
 
-class u_float():
+class u_float(object):
 
-    def __init__(self,val,sigma=0):
+    # no instance dict, u_floats are created in large numbers
+    __slots__ = ('val', 'sigma')
+
+    def __init__(self,val=0,sigma=0):
         if type(val)==type(()):
             if not len(val)==2: 
                 raise ValueError( "Not possible to construct u_float from tuple %r"%val )
@@ -22,6 +27,14 @@ class u_float():
             self.val    = float(val)
             self.sigma  = float(sigma)
 
+    # pickling with __slots__, the state is the dict of the former old-style class
+    def __getstate__(self):
+        return {'val':self.val, 'sigma':self.sigma}
+
+    def __setstate__(self, state):
+        self.val   = state['val']
+        self.sigma = state['sigma']
+
     @classmethod
     def fromString(cls, uString):
         s = uString.split('+-')
@@ -32,6 +45,7 @@ class u_float():
         return u
 
     def __add__(self,other):
+        if isinstance(other, u_array): return NotImplemented
         if not type(other)==type(self):
             if other == 0 or other == None: return self
             elif self == 0 or self == None: return other
@@ -48,6 +62,7 @@ class u_float():
         return self + other
 
     def __sub__(self,other):
+        if isinstance(other, u_array): return NotImplemented
         if not type(other)==type(self):
             raise ValueError( "Can't add, two objects should be u_float but is %r."%(type(other)) )
 
@@ -56,6 +71,7 @@ class u_float():
         return u_float(val,sigma)
 
     def __mul__(self,other):
+        if isinstance(other, u_array): return NotImplemented
         if not ( isinstance(other, numbers.Number) or type(other)==type(self)):
             raise ValueError( "Can't multiply, %r is not a float, int or u_float"%type(other) )
         if type(other)==type(self):
@@ -72,6 +88,7 @@ class u_float():
         return self.__mul__(other)
 
     def __div__(self,other):
+        if isinstance(other, u_array): return NotImplemented
         if not ( isinstance(other, numbers.Number) or type(other)==type(self)):
             raise ValueError( "Can't divide, %r is not a float, int or u_float"%type(other) )
         if type(other)==type(self):
@@ -106,3 +123,158 @@ class u_float():
 
     def __repr__(self):
         return self.__str__()
+
+class u_array(object):
+    ''' Arrays of values and their Gaussian uncertainties, operations act elementwise with the propagation rules of u_float.
+        u_floats, numbers and numpy arrays are broadcast. add, sub, mul and div take correlated=True for fully correlated uncertainties.
+    '''
+
+    __slots__ = ('val', 'sigma')
+    # numpy arrays defer to the reflected operations of u_array
+    __array_priority__ = 1000
+    __hash__ = None
+
+    def __init__(self,val,sigma=0):
+        if isinstance(val, (u_array, u_float)):
+            val, sigma = val.val, val.sigma
+        elif type(val)==type(()):
+            if not len(val)==2:
+                raise ValueError( "Not possible to construct u_array from tuple of length %i"%len(val) )
+            val, sigma = val
+        elif type(val)==type({}):
+            val, sigma = val['val'], val['sigma']
+        self.val   = np.array(val, dtype=float)
+        self.sigma = np.array(np.broadcast_to(sigma, self.val.shape), dtype=float)
+
+    @classmethod
+    def _new(cls, val, sigma):
+        # no copies of arrays that are already computed
+        res = cls.__new__(cls)
+        res.val, res.sigma = val, sigma
+        return res
+
+    @classmethod
+    def fromList(cls, values):
+        return cls([v.val for v in values], [v.sigma for v in values])
+
+    def tolist(self):
+        return [ u.tolist() if isinstance(u, u_array) else u for u in self ]
+
+    def __getstate__(self):
+        return {'val':self.val, 'sigma':self.sigma}
+
+    def __setstate__(self, state):
+        self.val   = state['val']
+        self.sigma = state['sigma']
+
+    @property
+    def shape(self):
+        return self.val.shape
+
+    def __len__(self):
+        return len(self.val)
+
+    def __getitem__(self, index):
+        val = self.val[index]
+        if np.ndim(val)==0: return u_float(float(val), float(self.sigma[index]))
+        return u_array._new(val, self.sigma[index])
+
+    def __setitem__(self, index, value):
+        if not isinstance(value, (u_array, u_float)):
+            raise ValueError( "Can't assign %r, should be u_float or u_array."%type(value) )
+        self.val[index]   = value.val
+        self.sigma[index] = value.sigma
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+    def sum(self, axis=None):
+        ''' Sum of uncorrelated entries, a u_float if all axes are summed
+        '''
+        val   = self.val.sum(axis=axis)
+        sigma = np.sqrt((self.sigma**2).sum(axis=axis))
+        if np.ndim(val)==0: return u_float(float(val), float(sigma))
+        return u_array._new(val, sigma)
+
+    def add(self,other,correlated=False):
+        if not isinstance(other, (u_array, u_float)):
+            if other is None or (isinstance(other, numbers.Number) and other == 0): return self
+            else: raise ValueError( "Can't add, two objects should be u_array or u_float but is %r."%(type(other)) )
+        val = self.val+other.val
+        if correlated: sigma = np.abs(self.sigma+other.sigma)
+        else:          sigma = np.sqrt(self.sigma**2+other.sigma**2)
+        return u_array._new(val,sigma)
+
+    def sub(self,other,correlated=False):
+        if not isinstance(other, (u_array, u_float)):
+            raise ValueError( "Can't subtract, two objects should be u_array or u_float but is %r."%(type(other)) )
+        val = self.val-other.val
+        if correlated: sigma = np.abs(self.sigma-other.sigma)
+        else:          sigma = np.sqrt(self.sigma**2+other.sigma**2)
+        return u_array._new(val,sigma)
+
+    def mul(self,other,correlated=False):
+        if isinstance(other, (u_array, u_float)):
+            val = self.val*other.val
+            if correlated: sigma = np.abs(self.sigma*other.val+self.val*other.sigma)
+            else:          sigma = np.sqrt((self.sigma*other.val)**2+(self.val*other.sigma)**2)
+        elif isinstance(other, (numbers.Number, np.ndarray)):
+            val = self.val*other
+            sigma = self.sigma*other
+        else:
+            raise ValueError( "Can't multiply, %r is not a float, int, array, u_float or u_array"%type(other) )
+        return u_array._new(val,sigma)
+
+    def div(self,other,correlated=False):
+        if isinstance(other, (u_array, u_float)):
+            val = self.val/other.val
+            if correlated: sigma = np.abs(self.sigma-val*other.sigma)/np.abs(other.val)
+            else:          sigma = (1./other.val)*np.sqrt(self.sigma**2+((self.val*other.sigma)/other.val)**2)
+        elif isinstance(other, (numbers.Number, np.ndarray)):
+            val = self.val/other
+            sigma = self.sigma/other
+        else:
+            raise ValueError( "Can't divide, %r is not a float, int, array, u_float or u_array"%type(other) )
+        return u_array._new(val,sigma)
+
+    def __add__(self,other):  return self.add(other)
+    def __radd__(self,other): return self.add(other)
+    def __sub__(self,other):  return self.sub(other)
+    def __mul__(self,other):  return self.mul(other)
+    def __rmul__(self,other): return self.mul(other)
+    def __div__(self,other):  return self.div(other)
+    __truediv__ = __div__
+
+    def __rsub__(self,other):
+        if not isinstance(other, u_float):
+            raise ValueError( "Can't subtract, two objects should be u_array or u_float but is %r."%(type(other)) )
+        return u_array(other).sub(self)
+
+    def __rdiv__(self,other):
+        if not isinstance(other, u_float):
+            raise ValueError( "Can't divide, %r is not a u_float"%type(other) )
+        return u_array(other).div(self)
+    __rtruediv__ = __rdiv__
+
+    @staticmethod
+    def _value(other):
+        if isinstance(other, (u_array, u_float)):           return other.val
+        elif isinstance(other, (numbers.Number, np.ndarray)): return other
+        else: raise ValueError("Can only compare with u_array, u_float, array, float or int, got %r" % type(other))
+
+    # elementwise comparisons of the values
+    def __lt__(self,other): return self.val <  self._value(other)
+    def __gt__(self,other): return self.val >  self._value(other)
+    def __le__(self,other): return self.val <= self._value(other)
+    def __ge__(self,other): return self.val >= self._value(other)
+    def __eq__(self,other): return self.val == self._value(other)
+    def __ne__(self,other): return self.val != self._value(other)
+
+    def __abs__(self): return u_array._new(np.abs(self.val), self.sigma.copy())
+
+    def __str__(self):
+        return str(self.tolist())
+
+    def __repr__(self):
+        return "u_array(%r, %r)"%(self.val, self.sigma)
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+''' Report broken root files of a sample directory, see RootFileScanner
+'''
+
+import os
+
+from Analysis.Tools.RootFileScanner import RootFileScanner, all_checks
+
+def get_parser():
+    ''' Argument parser
+    '''
+    import argparse
+    argParser = argparse.ArgumentParser(description = "Argument parser")
+    argParser.add_argument('--logLevel',  action='store',      default='INFO', nargs='?', choices=['CRITICAL', 'ERROR', 'WARNING', 'INFO', 'DEBUG', 'TRACE', 'NOTSET'], help="Log level for logging")
+    argParser.add_argument('directories', action='store',      nargs='+',                                  help="Sample directories or files")
+    argParser.add_argument('--ledger',    action='store',      default=os.path.expandvars('/tmp/$USER/rootFileLedger'), help="Directory of the ledger")
+    argParser.add_argument('--nJobs',     action='store',      type=int, default=8,                        help="Number of worker processes")
+    argParser.add_argument('--treeName',  action='store',      default='Events',                           help="Tree that must be in the files")
+    argParser.add_argument('--checks',    action='store',      nargs='+', choices=all_checks, default=all_checks, help="Which checks?")
+    argParser.add_argument('--timeout',   action='store',      type=int, default=600,                      help="Time in seconds a worker may spend on a single file")
+    argParser.add_argument('--mapLogDir', action='store',      default=None,                               help="Directory of the temporary TFile::Map output, default is the system temporary directory")
+    argParser.add_argument('--recheck',   action='store_true',                                             help="Ignore the ledger")
+    argParser.add_argument('--remove',    action='store_true',                                             help="Remove broken files")
+    return argParser
+
+if __name__ == "__main__":
+
+    args = get_parser().parse_args()
+
+    import Analysis.Tools.logger as logger
+    logger = logger.get_logger(args.logLevel, logFile = None )
+
+    files = []
+    for directory in args.directories:
+        if os.path.isdir( directory ):
+            for dirpath, dirnames, filenames in os.walk( directory ):
+                files.extend( os.path.join( dirpath, f ) for f in filenames if f.endswith( '.root' ) )
+        else:
+            files.append( directory )
+    logger.info( "Found %i files.", len(files) )
+
+    scanner = RootFileScanner( ledger = args.ledger, nJobs = args.nJobs, treeName = args.treeName, checks = args.checks, timeout = args.timeout, mapLogDir = args.mapLogDir )
+
+    broken = []
+    for i_file, (filename, good, reason) in enumerate( scanner.scan( files, recheck = args.recheck ) ):
+        if not good:
+            broken.append( filename )
+            print "Broken (%s): %s" % ( reason, filename )
+        if (i_file+1)%100 == 0:
+            logger.info( "Checked %i/%i files.", i_file+1, len(files) )
+
+    logger.info( "%i of %i files are broken.", len(broken), len(files) )
+
+    if args.remove:
+        for filename in broken:
+            if os.path.exists( filename ):
+                logger.info( "Removing %s", filename )
+                os.remove( filename )
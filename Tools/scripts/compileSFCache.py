@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+''' Write the SF cache files of LeptonSF, LeptonTrackingEfficiency, PhotonSF, L1PrefireWeight and BTagEfficiency, see SFCache
+'''
+
+import os
+
+def get_parser():
+    ''' Argument parser
+    '''
+    import argparse
+    argParser = argparse.ArgumentParser(description = "Argument parser")
+    argParser.add_argument('--logLevel',  action='store',      default='INFO', nargs='?', choices=['CRITICAL', 'ERROR', 'WARNING', 'INFO', 'DEBUG', 'TRACE', 'NOTSET'], help="Log level for logging")
+    argParser.add_argument('--years',     action='store',      nargs='+', type=int, default=[2016, 2017, 2018], help="Which years?")
+    argParser.add_argument('--IDs',       action='store',      nargs='+', default=['medium', 'tight'],         help="Lepton IDs")
+    argParser.add_argument('--taggers',   action='store',      nargs='+', default=['DeepCSV', 'DeepJet'],      help="b-taggers")
+    argParser.add_argument('--directory', action='store',      default=None,                                   help="Directory of the cache files, default is SFCache.defaultDirectory")
+    return argParser
+
+if __name__ == "__main__":
+
+    args = get_parser().parse_args()
+
+    import Analysis.Tools.logger as logger
+    logger = logger.get_logger(args.logLevel, logFile = None )
+
+    import Analysis.Tools.SFCache as SFCache
+    from Analysis.Tools.LeptonSF                 import LeptonSF
+    from Analysis.Tools.LeptonTrackingEfficiency import LeptonTrackingEfficiency
+    from Analysis.Tools.PhotonSF                 import PhotonSF
+    from Analysis.Tools.L1PrefireWeight          import L1PrefireWeight
+    from Analysis.Tools.BTagEfficiency           import BTagEfficiency, OP_MEDIUM
+
+    def filename( name, *args_ ):
+        if args.directory is None:
+            return None
+        return os.path.join( args.directory, os.path.basename( SFCache.cache_file( name, *args_ ) ) )
+
+    for year in args.years:
+        for ID in args.IDs:
+            LeptonSF( year = year, ID = ID ).toCache( filename( 'LeptonSF', year, ID ) )
+        LeptonTrackingEfficiency( year = year ).toCache( filename( 'LeptonTrackingEfficiency', year ) )
+        PhotonSF( year = year ).toCache( filename( 'PhotonSF', year ) )
+        L1PrefireWeight( year ).toCache( filename( 'L1PrefireWeight', year ) )
+        for tagger in args.taggers:
+            for fastSim in [ False, True ]:
+                WP = OP_MEDIUM
+                BTagEfficiency( WP = WP, fastSim = fastSim, year = year, tagger = tagger ).toCache( filename( 'BTagEfficiency', year, tagger, 'FastSim' if fastSim else 'FullSim', WP ) )
@@ -8,12 +8,13 @@ hostname    = os.getenv("HOSTNAME")
 
 def checkRootFile( file ):
     logger.info("Checking root file: %s"%file)
-    from Analysis.Tools.helpers import checkRootFile, deepCheckRootFile, deepCheckWeight
-    valid = checkRootFile( file, checkForObjects=["Events"] ) and deepCheckRootFile( file ) and deepCheckWeight( file )
+    # no ledger: the file is checked again after every copy attempt
+    from Analysis.Tools.RootFileScanner import RootFileScanner
+    (_, valid, reason), = RootFileScanner( nJobs = 1 ).scan( [file] )
     if valid:
         logger.info("Check done!")
     else:
-        logger.info("Corrupt root file: %s"%file)
+        logger.info("Corrupt root file (%s): %s"%(reason, file))
     return valid
 
 def getDPMFiles( path, fromLxPlus=False ):
@@ -24,7 +24,7 @@ def test_if_cache( directory ):
     if os.path.isdir( directory ):
         if 'merged' in os.listdir( directory ):
             return True
-        if any([ x.startswith('tmp_') for x in os.listdir( directory ) ]):
+        if any([ x.startswith('tmp_') or x.startswith('journal_') for x in os.listdir( directory ) ]):
             return True
     return False
 
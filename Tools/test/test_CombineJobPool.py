@@ -0,0 +1,97 @@
+''' CombineJobPool with a stand-in combine executable
+    python -m unittest discover -s $CMSSW_BASE/src/Analysis/Tools/test
+'''
+
+# Standard imports
+import os
+import stat
+import shutil
+import tempfile
+import unittest
+
+# Analysis
+import Analysis.Tools.cardFileWriter.CombineJobPool as CombineJobPool
+from Analysis.Tools.cardFileWriter.CombineJobPool import CombineJob
+
+# The card is the last argument. The stand-in sleeps for the time in the 'sleep' line of the card and writes its 'value' line to stub.txt.
+combine = '''#!/bin/bash
+card="${@: -1}"
+echo "$card" >> %(control)s/calls
+sleep $(awk '$1=="sleep"{print $2}' $card)
+awk '$1=="value"{print $2}' $card > stub.txt
+'''
+
+def read_stub_file( fname ):
+    with open( fname ) as f:
+        return float( f.read() )
+
+class CombineJobPoolTest( unittest.TestCase ):
+
+    def setUp( self ):
+        self.tmpDir  = tempfile.mkdtemp()
+        self.combine = os.path.join( self.tmpDir, "combine.sh" )
+        with open( self.combine, "w" ) as f:
+            f.write( combine % { "control":self.tmpDir } )
+        os.chmod( self.combine, os.stat( self.combine ).st_mode | stat.S_IEXEC )
+        # a method for the stand-in, the readers of the real methods need ROOT
+        CombineJobPool.methods['stub'] = ( "-M Stub", "stub.txt", read_stub_file )
+
+    def tearDown( self ):
+        del CombineJobPool.methods['stub']
+        shutil.rmtree( self.tmpDir )
+
+    def card( self, name, value, sleep = 0 ):
+        filename = os.path.join( self.tmpDir, name + ".txt" )
+        with open( filename, "w" ) as f:
+            f.write( "shapes * * %s.root $PROCESS\nvalue %s\nsleep %s\n" % ( name, value, sleep ) )
+        with open( os.path.join( self.tmpDir, name + ".root" ), "w" ) as f:
+            f.write( "shapes of %s" % name )
+        return filename
+
+    def pool( self, nJobs = 2 ):
+        return CombineJobPool.CombineJobPool( nJobs = nJobs, cacheDir = os.path.join( self.tmpDir, "cache" ), combine = self.combine, workDir = self.tmpDir )
+
+    def calls( self ):
+        if not os.path.exists( os.path.join( self.tmpDir, "calls" ) ): return []
+        with open( os.path.join( self.tmpDir, "calls" ) ) as f:
+            return [ os.path.basename( line.strip() ) for line in f ]
+
+    def test_cache( self ):
+        cards = [ self.card( name, value ) for name, value in [ ( "a", 1 ), ( "b", 2 ), ( "c", 3 ) ] ]
+        jobs  = [ CombineJob( card, 'stub' ) for card in cards ]
+        self.assertEqual( self.pool().runAll( jobs ), [ 1, 2, 3 ] )
+        self.assertEqual( sorted( self.calls() ), [ "a.txt", "b.txt", "c.txt" ] )
+
+        # nothing changed
+        self.assertEqual( self.pool().runAll( jobs ), [ 1, 2, 3 ] )
+        self.assertEqual( len( self.calls() ), 3 )
+
+        # changed card and changed shape file, the unchanged card is not run
+        self.card( "a", 4 )
+        with open( os.path.join( self.tmpDir, "b.root" ), "w" ) as f:
+            f.write( "new shapes" )
+        self.assertEqual( self.pool().runAll( jobs ), [ 4, 2, 3 ] )
+        self.assertEqual( sorted( self.calls()[3:] ), [ "a.txt", "b.txt" ] )
+
+        # other options are another result
+        self.assertEqual( self.pool().runAll( [ CombineJob( cards[2], 'stub', options = '--other' ) ] ), [ 3 ] )
+        self.assertEqual( self.calls()[-1], "c.txt" )
+
+    def test_failure_not_cached( self ):
+        card = self.card( "a", "" )
+        self.assertEqual( self.pool().runAll( [ CombineJob( card, 'stub' ) ] ), [ None ] )
+        self.assertEqual( self.pool().runAll( [ CombineJob( card, 'stub' ) ] ), [ None ] )
+        self.assertEqual( len( self.calls() ), 2 )
+
+    def test_streaming_order( self ):
+        cached = self.card( "cached", 0 )
+        self.pool().runAll( [ CombineJob( cached, 'stub' ) ] )
+
+        slow = self.card( "slow", 1, sleep = 1 )
+        fast = self.card( "fast", 2 )
+        # cached results first, then as the jobs finish
+        order = [ os.path.basename( job.card ) for job, res in self.pool().run( [ CombineJob( card, 'stub' ) for card in [ slow, fast, cached ] ] ) ]
+        self.assertEqual( order, [ "cached.txt", "fast.txt", "slow.txt" ] )
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+''' ImpactRunner with stand-in executables for text2workspace.py, combineTool.py and plotImpacts.py
+    python -m unittest discover -s $CMSSW_BASE/src/Analysis/Tools/test
+'''
+
+# Standard imports
+import os
+import stat
+import shutil
+import tempfile
+import unittest
+
+# Analysis
+from Analysis.Tools.cardFileWriter.ImpactRunner import ImpactRunner
+
+# Every call is logged to <control>/calls. A nuisance fit writes no output and exits 0 if <control>/fail_<nuisance> exists.
+text2workspace = '''#!/bin/bash
+echo "text2workspace $@" >> %(control)s/calls
+touch ${1%%.txt}.root
+'''
+
+combineTool = '''#!/bin/bash
+echo "combineTool $@" >> %(control)s/calls
+args="$*"
+if [[ "$args" == *--doInitialFit* ]]; then touch higgsCombine_initialFit_Test.MultiDimFit.mH125.root; exit 0; fi
+if [[ "$args" == *--doFits* ]]; then
+    n=$(echo "$args" | sed 's/.*--named \\([^ ]*\\).*/\\1/')
+    if [ -f %(control)s/fail_$n ]; then exit 0; fi
+    touch higgsCombine_paramFit_Test_$n.MultiDimFit.mH125.root
+    exit 0
+fi
+touch impacts.json
+'''
+
+plotImpacts = '''#!/bin/bash
+touch impacts.pdf
+'''
+
+class ImpactRunnerTest( unittest.TestCase ):
+
+    def setUp( self ):
+        self.tmpDir  = tempfile.mkdtemp()
+        self.control = os.path.join( self.tmpDir, "control" )
+        os.makedirs( self.control )
+        self.executables = {}
+        for name, script in [ ( "text2workspace", text2workspace ), ( "combineTool", combineTool ), ( "plotImpacts", plotImpacts ) ]:
+            self.executables[name] = os.path.join( self.control, name + ".sh" )
+            with open( self.executables[name], "w" ) as f:
+                f.write( script % { "control":self.control } )
+            os.chmod( self.executables[name], os.stat( self.executables[name] ).st_mode | stat.S_IEXEC )
+
+        cardDir = os.path.join( self.tmpDir, "card" )
+        os.makedirs( cardDir )
+        self.card   = os.path.join( cardDir, "card.txt" )
+        self.shapes = os.path.join( cardDir, "shapes.root" )
+        with open( self.card, "w" ) as f:
+            f.write( "shapes * * shapes.root $PROCESS\nshapes * ch2 FAKE\nimax 1\n" )
+        with open( self.shapes, "w" ) as f:
+            f.write( "nominal" )
+
+    def tearDown( self ):
+        shutil.rmtree( self.tmpDir )
+
+    def runner( self ):
+        return ImpactRunner( self.card, os.path.join( self.tmpDir, "impacts" ), nuisances = [ "a", "b", "c" ],
+                             text2workspace = self.executables["text2workspace"], combineTool = self.executables["combineTool"], plotImpacts = self.executables["plotImpacts"] )
+
+    def calls( self, pattern ):
+        with open( os.path.join( self.control, "calls" ) ) as f:
+            return len( [ line for line in f if pattern in line ] )
+
+    def setFailing( self, nuisance, failing = True ):
+        filename = os.path.join( self.control, "fail_" + nuisance )
+        if failing: open( filename, "w" ).close()
+        elif os.path.exists( filename ): os.remove( filename )
+
+    def test_resume( self ):
+        runner = self.runner()
+        self.setFailing( "c" )
+        self.assertEqual( runner.run( "observed", nJobs = 2 ), [ "c" ] )
+        self.assertFalse( runner.done( "observed" ) )
+
+        self.setFailing( "c", False )
+        self.assertEqual( runner.run( "observed", nJobs = 2 ), [] )
+        self.assertTrue( runner.done( "observed" ) )
+        # only the missing fit is repeated
+        self.assertEqual( self.calls( "--doFits" ), 4 )
+        self.assertEqual( self.calls( "--doInitialFit" ), 1 )
+        self.assertTrue( os.path.exists( runner.plot( "observed" ) ) )
+
+    def test_workspace_reuse( self ):
+        runner = self.runner()
+        self.assertEqual( runner.run( "observed" ), [] )
+        self.assertEqual( self.runner().run( "expected" ), [] )
+        self.assertEqual( self.calls( "text2workspace" ), 1 )
+
+        runner.clean( "observed" )
+        self.assertEqual( runner.run( "observed" ), [] )
+        self.assertEqual( self.calls( "text2workspace" ), 1 )
+
+    def test_invalidation( self ):
+        runner = self.runner()
+        self.assertEqual( runner.run( "observed" ), [] )
+
+        # new shapes: the workspace is recompiled and the fits of the old workspace are not reused
+        with open( self.shapes, "w" ) as f:
+            f.write( "changed" )
+        self.setFailing( "a" )
+        self.assertEqual( runner.run( "observed" ), [ "a" ] )
+        self.assertEqual( self.calls( "text2workspace" ), 2 )
+        self.assertEqual( self.calls( "--doInitialFit" ), 2 )
+        self.assertFalse( runner.done( "observed" ) )
+        self.assertRaises( RuntimeError, runner.plot, "observed" )
+
+if __name__ == "__main__":
+    unittest.main()
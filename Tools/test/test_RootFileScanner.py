@@ -0,0 +1,63 @@
+''' RootFileScanner with a stand-in worker
+    python -m unittest discover -s $CMSSW_BASE/src/Analysis/Tools/test
+'''
+
+# Standard imports
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+# Analysis
+from Analysis.Tools.RootFileScanner import RootFileScanner
+
+# The stand-in hangs on files named 'hang', crashes on files named 'crash' and reports all other files as good.
+worker = '''
+import os, sys, json, time
+open( %(mapLog)r %% os.getpid(), 'w' ).close()
+for line in iter( sys.stdin.readline, '' ):
+    filename = line.rstrip('\\n')
+    if os.path.basename( filename ) == 'hang': time.sleep( 60 )
+    if os.path.basename( filename ) == 'crash': os._exit( 1 )
+    sys.stdout.write( json.dumps( [ filename, True, "" ] ) + '\\n' )
+    sys.stdout.flush()
+'''
+
+class StubScanner( RootFileScanner ):
+
+    def start_worker( self ):
+        cmd = [ sys.executable, '-c', worker % { 'mapLog':os.path.join( self.mapLogDir, 'rootFileScanner_%i.log' ) } ]
+        return subprocess.Popen( cmd, stdin = subprocess.PIPE, stdout = subprocess.PIPE )
+
+class RootFileScannerTest( unittest.TestCase ):
+
+    def setUp( self ):
+        self.tmpDir = tempfile.mkdtemp()
+
+    def tearDown( self ):
+        shutil.rmtree( self.tmpDir )
+
+    def scanner( self, **kwargs ):
+        return StubScanner( ledger = os.path.join( self.tmpDir, "ledger" ), nJobs = 2, timeout = 1, mapLogDir = self.tmpDir, **kwargs )
+
+    def test_timeout( self ):
+        files = [ os.path.join( self.tmpDir, name ) for name in [ "a", "hang", "b", "crash", "c" ] ]
+        result = { filename:( good, reason ) for filename, good, reason in self.scanner().scan( files ) }
+        self.assertEqual( result[files[1]], ( False, "timeout" ) )
+        self.assertEqual( result[files[3]], ( False, "crash" ) )
+        for filename in files[0:1] + files[2:3] + files[4:]:
+            self.assertEqual( result[filename], ( True, "" ) )
+
+        # the map logs of the stopped workers are removed
+        self.assertEqual( [ f for f in os.listdir( self.tmpDir ) if f.startswith( "rootFileScanner_" ) ], [] )
+
+        # timeouts are checked again, everything else comes from the ledger
+        scanner = self.scanner()
+        scanner.start_worker = lambda: self.fail( "Started a worker for a file in the ledger." )
+        self.assertEqual( [ filename for filename, good, reason in scanner.scan( [ f for f in files if f != files[1] ] ) ], [ f for f in files if f != files[1] ] )
+        self.assertEqual( [ ( filename, reason ) for filename, good, reason in self.scanner().scan( files[1:2] ) ], [ ( files[1], "timeout" ) ] )
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+''' Ancestor chains of overlapRemovalTTG, in particular with generator loops in the mother graph
+    python -m unittest discover -s $CMSSW_BASE/src/Analysis/Tools/test
+'''
+
+# Standard imports
+import unittest
+
+# Analysis
+import Analysis.Tools.overlapRemovalTTG as overlapRemovalTTG
+from Analysis.Tools.overlapRemovalTTG import Genealogy, getParentIds, getParentIndices, getPhotonCategory
+
+def genParticles( pdgIdsAndMothers ):
+    return [ { "index":i, "pdgId":pdgId, "genPartIdxMother":mother, "status":1, "pt":10., "eta":0., "phi":0. } for i, ( pdgId, mother ) in enumerate( pdgIdsAndMothers ) ]
+
+def walk( genParticles, g ):
+    ''' Parent indices without any cache, up to the first repeated index
+    '''
+    byIndex = { p["index"]:p for p in genParticles }
+    res     = []
+    index   = g["genPartIdxMother"]
+    while index >= 0 and index in byIndex and index not in res:
+        res.append( index )
+        index = byIndex[index]["genPartIdxMother"]
+    return res
+
+class GenealogyTest( unittest.TestCase ):
+
+    # 0 -> 1 -> 2 -> 1 is a generator loop
+    looping = [ (22,1), (111,2), (21,1), (22,0), (22,3), (22,2) ]
+
+    def setUp( self ):
+        overlapRemovalTTG._genealogy = None
+
+    def test_loop_independent_of_query_order( self ):
+        parts = genParticles( self.looping )
+        getParentIndices( parts[0], parts )
+        getParentIndices( parts[4], parts )
+        self.assertEqual( getParentIds( parts[5], parts ), [ 21, 111 ] )
+        self.assertEqual( getPhotonCategory( parts[5], parts ), 1 )
+
+    def test_all_query_orders( self ):
+        parts = genParticles( self.looping )
+        expected = [ walk( parts, g ) for g in parts ]
+        for first in range( len(parts) ):
+            for second in range( len(parts) ):
+                genealogy = Genealogy( parts )
+                genealogy.parentIndices( parts[first] )
+                genealogy.parentIndices( parts[second] )
+                self.assertEqual( [ genealogy.parentIndices( g ) for g in parts ], expected )
+
+    def test_reused_list( self ):
+        parts = genParticles( [ (6,-1), (22,0) ] )
+        self.assertEqual( getParentIds( parts[1], parts ), [ 6 ] )
+        # the same list object with the particles of the next event
+        parts[:] = genParticles( [ (111,-1), (22,0) ] )
+        self.assertEqual( getParentIds( parts[1], parts ), [ 111 ] )
+        self.assertEqual( getPhotonCategory( parts[1], parts ), 1 )
+
+if __name__ == "__main__":
+    unittest.main()